@@ -0,0 +1,123 @@
+import os
+import json
+from typing import Dict, List
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from dotenv import load_dotenv
+from utils.llm_gateway import get_llm_gateway
+
+load_dotenv()
+
+# 段落分类与标签维度，与 SentenceAnalyzerAgent / TagAnalyzerAgent 保持一致
+PARAGRAPH_TYPES = ["事实描述", "情感表达", "对话内容", "环境描述", "思考感悟"]
+TAG_DIMENSIONS = ["时间维度", "场景维度", "情感维度", "事件维度", "人物维度"]
+
+
+class AnalyzedParagraph(BaseModel):
+    """单个段落的分析结果"""
+    text: str = Field(min_length=1)
+    type: str
+    tags: Dict[str, List[str]] = Field(default_factory=dict)
+
+    @field_validator("type")
+    @classmethod
+    def check_type(cls, value: str) -> str:
+        if value not in PARAGRAPH_TYPES:
+            raise ValueError(f"未知的段落类型: {value}")
+        return value
+
+    @field_validator("tags")
+    @classmethod
+    def clean_tags(cls, value: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        # 只保留已知维度，去掉空标签和"无明确体现"
+        cleaned = {}
+        for dimension, tags in value.items():
+            if dimension not in TAG_DIMENSIONS:
+                continue
+            tags = [tag.strip() for tag in tags if tag.strip() and tag.strip() != "无明确体现"]
+            if tags:
+                cleaned[dimension] = tags
+        return cleaned
+
+
+class CombinedAnalysis(BaseModel):
+    """合并分析结果：分段、分类和标签"""
+    paragraphs: List[AnalyzedParagraph] = Field(min_length=1)
+
+
+class CombinedAnalyzerAgent:
+    """一次调用完成分段、段落分类和多维度标签识别，输出JSON"""
+
+    MODEL = "glm-4-air"
+    PROMPT_VERSION = "1"  # 修改提示词时递增，用于失效结果缓存
+
+    def __init__(self):
+        self.api_key = os.getenv("API_KEY_CONF")
+        self.gateway = get_llm_gateway()  # 共享的模型调用网关
+
+    async def aanalyze(self, narrative_text):
+        """将叙事体按自然段落划分，为每个段落分类并识别标签，返回JSON文本
+        调用被取消时模型请求随之取消"""
+        prompt = self._prompt(narrative_text)
+
+        try:
+            return await self.gateway.chat(
+                model=self.MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                response_format={"type": "json_object"},
+            )
+
+        except Exception as e:
+            return f"合并分析出错：{str(e)}"
+
+    def _prompt(self, narrative_text):
+        """合并分析的提示词"""
+        return f"""请将以下叙事体文本按自然段落进行划分，为每个段落进行分类，并按照给定的标签体系进行多维度标签识别。
+
+段落分类（只能选择其一）：{"、".join(PARAGRAPH_TYPES)}
+
+标签体系：
+1. 时间维度：童年(0-12岁)、青少年(13-18岁)、成年早期(18-30岁)、成年中期(30-50岁)、成年后期(50岁以后)；学前、小学、初中、高中、大学、工作初期
+2. 场景维度：家庭场景（亲子关系、夫妻关系、居住环境）、学校场景（学习经历、师生关系、同学关系）、职场场景（工作内容、职业发展、同事关系）、社交场景（朋友关系、社团活动、兴趣爱好）
+3. 情感维度：快乐、悲伤、成就感、挫折；转折点、人生感悟
+4. 事件维度：人生选择、重要决定、意外事件、成长经历、转折点
+5. 人物维度：家庭成员、恩师、朋友、同事、贵人
+
+分析要求：
+1. 段落文本必须保持原文，不要改写
+2. 只标注文本中明确提到或可以合理推断的标签，不要捏造
+3. 某个维度没有体现时省略该维度
+
+文本内容：
+{narrative_text}
+
+请只输出JSON，格式如下：
+{{"paragraphs": [{{"text": "段落原文", "type": "事实描述", "tags": {{"时间维度": ["小学"], "情感维度": ["快乐"]}}}}]}}"""
+
+    @staticmethod
+    def parse(analysis_result):
+        """
+        解析并校验模型输出
+        Returns:
+            [{"content", "type", "tags"}]，格式与 AnalysisNode 的合并结果一致
+        Raises:
+            ValueError: 输出不是合法JSON或不符合结构要求
+        """
+        if not analysis_result or analysis_result.startswith("合并分析出错"):
+            raise ValueError(analysis_result or "模型没有返回内容")
+
+        text = analysis_result.strip()
+        if text.startswith("```"):
+            # 去掉代码块标记
+            text = text.strip("`")
+            text = text[text.index("{"):] if "{" in text else text
+
+        try:
+            analysis = CombinedAnalysis.model_validate(json.loads(text))
+        except (json.JSONDecodeError, ValidationError) as e:
+            raise ValueError(f"合并分析结果格式错误: {str(e)}")
+
+        return [
+            {"content": p.text, "type": p.type, "tags": p.tags}
+            for p in analysis.paragraphs
+        ]
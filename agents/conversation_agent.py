@@ -1,8 +1,11 @@
-import zhipuai
 import os
+import asyncio
 from dotenv import load_dotenv
-import json
+from utils.llm_gateway import get_llm_gateway
+from agents.conversation_context import create_conversation_context
+from utils.conversation_log import get_conversation_log
 from datetime import datetime
+import uuid
 
 load_dotenv()
 
@@ -12,17 +15,20 @@ class ConversationAgent:
         print(f"Debug - API密钥: {self.api_key}")  # 仅用于调试
         if not self.api_key:
             raise ValueError("未找到API密钥，请检查环境变量 API_KEY_CONF")
-        self.client = zhipuai.ZhipuAI(api_key=self.api_key)
+        self.gateway = get_llm_gateway()  # 共享的模型调用网关
+        # 每轮只发送系统提示、历史摘要和预算内的最近对话，完整历史仍保存在日志中
+        self.context = create_conversation_context(self.summarize_history)
         self.conversation_history = []
         self.init_conversation_history()
-        # 创建日志文件
+        # 开始新的日志会话
         self.create_new_log_file()
         self.save_history()
 
     def create_new_log_file(self):
-        """创建新的日志文件"""
-        os.makedirs('logs', exist_ok=True)
-        self.log_file = f"logs/conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        """开始新的日志会话：所有会话共用追加写的对话日志，不再每次创建新文件"""
+        self.log = get_conversation_log()
+        self.log_session = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.logged_count = 0  # 已写入日志的消息条数
 
     def init_conversation_history(self):
         """初始化对话历史"""
@@ -40,12 +46,16 @@ class ConversationAgent:
             {"role": "system", "content": prompt_template}
         ]
         self.conversation_history = messages
+        self.context.reset()
         
     def save_history(self):
-        """保存对话历史到日志文件"""
+        """把上次保存之后新增的消息追加到对话日志"""
         try:
-            with open(self.log_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, ensure_ascii=False, indent=2)
+            if len(self.conversation_history) < self.logged_count:
+                # 历史被截短，作为新会话重新记录
+                self.create_new_log_file()
+            self.log.append(self.log_session, self.conversation_history[self.logged_count:])
+            self.logged_count = len(self.conversation_history)
         except Exception as e:
             print(f"保存对话历史时发生错误：{str(e)}")
 
@@ -76,6 +86,7 @@ class ConversationAgent:
             
             # 设置新的对话历史
             self.conversation_history = history
+            self.context.reset()
             
             # 保存到新的日志文件
             self.create_new_log_file()
@@ -89,25 +100,71 @@ class ConversationAgent:
 
 
     def chat(self, user_input):
-        """与用户进行对话"""
+        """与用户进行对话（同步版本，供界面调用，不能在事件循环中调用）"""
+        return asyncio.run(self.achat(user_input))
+
+    async def achat(self, user_input):
+        """与用户进行对话，等待模型响应时不阻塞事件循环"""
         self.conversation_history.append({"role": "user", "content": user_input})
-        
+
         try:
-            response = self.client.chat.completions.create(
+            assistant_response = await self.gateway.chat(
                 model="glm-4-air",
-                messages=self.conversation_history,
+                messages=self.context.build(self.conversation_history),
                 temperature=0.7,
             )
-            
-            assistant_response = response.choices[0].message.content
             self.conversation_history.append({"role": "assistant", "content": assistant_response})
             self.save_history()  # 每次对话后保存历史
             return assistant_response
-                
+
         except Exception as e:
             print(f"发生错误：{str(e)}")
             return f"发生错误：{str(e)}"
     
+    async def achat_stream(self, user_input):
+        """流式对话，逐段产出模型生成的文本，生成完毕后保存历史
+        调用失败时抛出异常，不把错误信息当作回复产出"""
+        self.conversation_history.append({"role": "user", "content": user_input})
+
+        chunks = []
+        try:
+            async for delta in self.gateway.chat_stream(
+                model="glm-4-air",
+                messages=self.context.build(self.conversation_history),
+                temperature=0.7,
+            ):
+                chunks.append(delta)
+                yield delta
+        except Exception as e:
+            print(f"发生错误：{str(e)}")
+            # 没有得到完整回复，移除这一轮的用户消息
+            self.conversation_history.pop()
+            raise
+
+        self.conversation_history.append({"role": "assistant", "content": "".join(chunks)})
+        self.save_history()  # 每次对话后保存历史
+
+    def summarize_history(self, summary, messages):
+        """把较早的对话折叠进滚动摘要（在后台线程中调用）"""
+        dialogue = "\n".join(
+            f"{'讲述者' if msg['role'] == 'user' else '采访者'}：{msg['content']}" for msg in messages
+        )
+        prompt = f"""你正在协助一位回忆录采访者整理采访记录。请把已有摘要和新增的对话合并为一份新的摘要。要求：
+1. 保留讲述者提到的人物、时间、地点、事件和情感等关键信息
+2. 记录已经问过的话题，避免采访者重复提问
+3. 使用第三人称，简洁连贯，不超过600字
+
+已有摘要：
+{summary or "（无）"}
+
+新增对话：
+{dialogue}"""
+        return self.gateway.chat_sync(
+            model="glm-4-air",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+        )
+
     def get_conversation_history(self):
         """获取当前会话的对话历史"""
 
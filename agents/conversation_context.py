@@ -0,0 +1,158 @@
+import math
+import os
+import re
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中日韩字符和全角标点按1个计，其余字符按4个折合1个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """单条消息的token数，含角色等格式开销"""
+    return estimate_tokens(message.get("content") or "") + 4
+
+
+class ConversationContext:
+    """对话上下文：在token预算内构造每轮发给模型的消息
+
+    - 系统提示和最近的对话原样保留
+    - 更早的对话折叠进滚动摘要，作为系统消息放在最近对话之前
+    - 未折叠的对话超过 summarize_ratio * max_tokens 时，在后台线程中刷新摘要，
+      不阻塞当前这一轮对话；刷新完成前超出预算的旧对话暂时不发送
+    """
+
+    def __init__(self, summarize: Callable[[str, List[Dict[str, str]]], str],
+                 max_tokens: int = 4000, summarize_ratio: float = 0.75, keep_ratio: float = 0.5):
+        """
+        Args:
+            summarize: 摘要函数 (已有摘要, 需要折叠的对话) -> 新摘要
+            max_tokens: 每轮消息的token预算
+            summarize_ratio: 未折叠对话占预算的比例超过该值时刷新摘要
+            keep_ratio: 刷新摘要后原样保留的最近对话占预算的比例
+        """
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.summarize_ratio = summarize_ratio
+        self.keep_ratio = keep_ratio
+        self.summary = ""
+        self.summarized = 0  # 已折叠进摘要的对话条数（不含系统提示）
+        self._generation = 0  # 每次重置递增，丢弃重置前开始的摘要刷新
+        self._lock = threading.Lock()
+        self._refreshing: Optional[threading.Thread] = None
+
+    def reset(self):
+        """对话历史被替换或清空时重置摘要"""
+        with self._lock:
+            self.summary = ""
+            self.summarized = 0
+            self._generation += 1
+
+    def build(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        构造本轮发给模型的消息
+        Args:
+            history: 完整的对话历史，第一条可以是系统提示
+        Returns:
+            系统提示 + 摘要 + 预算内的最近对话；最后一条消息总是保留
+        """
+        system = [history[0]] if history and history[0]["role"] == "system" else []
+        dialogue = history[len(system):]
+
+        with self._lock:
+            if self.summarized > len(dialogue):
+                # 历史被截短，摘要已经不对应当前对话
+                self.summary, self.summarized = "", 0
+            summary, summarized = self.summary, self.summarized
+
+        messages = list(system)
+        if summary:
+            messages.append({"role": "system", "content": f"以下是之前对话内容的摘要：\n{summary}"})
+        budget = self.max_tokens - sum(message_tokens(message) for message in messages)
+
+        pending = dialogue[summarized:]
+        recent: List[Dict[str, str]] = []
+        used = 0
+        for message in reversed(pending):
+            tokens = message_tokens(message)
+            if recent and used + tokens > budget:
+                break
+            recent.append(message)
+            used += tokens
+        recent.reverse()
+
+        if sum(message_tokens(message) for message in pending) > self.max_tokens * self.summarize_ratio:
+            self._schedule_refresh(dialogue, summary, summarized)
+
+        return messages + recent
+
+    def _schedule_refresh(self, dialogue: List[Dict[str, str]], summary: str, summarized: int):
+        """把保留范围之前的对话交给后台线程折叠进摘要，同一时刻只刷新一次"""
+        keep_budget = self.max_tokens * self.keep_ratio
+        cut = len(dialogue)
+        used = 0
+        while cut > summarized and used + message_tokens(dialogue[cut - 1]) <= keep_budget:
+            used += message_tokens(dialogue[cut - 1])
+            cut -= 1
+        # 至少保留最后一轮对话，且只在用户消息处切分，保持问答成对
+        cut = min(cut, len(dialogue) - 1)
+        while cut > summarized and dialogue[cut]["role"] != "user":
+            cut -= 1
+        if cut <= summarized:
+            return
+
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            generation = self._generation
+            self._refreshing = threading.Thread(
+                target=self._refresh,
+                args=(summary, list(dialogue[summarized:cut]), cut, generation),
+                name="context-summary",
+                daemon=True
+            )
+            self._refreshing.start()
+
+    def _refresh(self, summary: str, messages: List[Dict[str, str]], cut: int, generation: int):
+        try:
+            new_summary = self.summarize(summary, messages)
+        except Exception as e:
+            logger.error(f"刷新对话摘要失败: {str(e)}")
+            return
+        if not new_summary:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return  # 刷新期间对话历史已被重置
+            self.summary = new_summary
+            self.summarized = cut
+        logger.info(f"对话摘要已更新，折叠 {cut} 条对话")
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待正在进行的摘要刷新完成"""
+        refreshing = self._refreshing
+        if refreshing is not None:
+            refreshing.join(timeout)
+
+
+def create_conversation_context(summarize: Callable[[str, List[Dict[str, str]]], str]) -> ConversationContext:
+    """根据环境变量创建对话上下文
+
+    - CHAT_CONTEXT_MAX_TOKENS: 每轮消息的token预算，默认4000
+    - CHAT_CONTEXT_SUMMARIZE_RATIO: 未折叠对话超过预算的该比例时刷新摘要，默认0.75
+    - CHAT_CONTEXT_KEEP_RATIO: 刷新摘要后原样保留的最近对话占预算的比例，默认0.5
+    """
+    return ConversationContext(
+        summarize,
+        max_tokens=int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "4000")),
+        summarize_ratio=float(os.getenv("CHAT_CONTEXT_SUMMARIZE_RATIO", "0.75")),
+        keep_ratio=float(os.getenv("CHAT_CONTEXT_KEEP_RATIO", "0.5"))
+    )
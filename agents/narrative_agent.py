@@ -1,25 +1,64 @@
-import zhipuai
 import os
+import asyncio
 from dotenv import load_dotenv
+from utils.llm_gateway import get_llm_gateway
 
 load_dotenv()
 
 class NarrativeAgent:
+    MODEL = "glm-4-air"
+    PROMPT_VERSION = "1"  # 修改提示词时递增，用于失效结果缓存
+
     def __init__(self):
         self.api_key = os.getenv("API_KEY_CONF")
-        zhipuai.api_key = self.api_key
-        self.client = zhipuai.ZhipuAI(api_key=self.api_key)
+        self.gateway = get_llm_gateway()  # 共享的模型调用网关
         
     def generate_narrative(self, conversation_history):
-        """将对话历史转换为叙事体"""
+        """将对话历史转换为叙事体（同步版本，供界面调用，不能在事件循环中调用）"""
+        return asyncio.run(self.agenerate_narrative(conversation_history))
+
+    async def agenerate_narrative(self, conversation_history):
+        """将对话历史转换为叙事体，调用被取消时模型请求随之取消"""
+        return await self._generate(self._narrative_prompt, conversation_history)
+
+    async def acontinue_narrative(self, previous_narrative, new_dialogue, context_chars=1500):
+        """根据新增对话续写已有叙事体，只返回新增部分
+
+        Args:
+            previous_narrative: 已生成的叙事文本
+            new_dialogue: 上次生成之后新增的对话
+            context_chars: 作为上文参考的叙事末尾字数，保证每次调用的输入规模恒定
+        """
+        return await self._generate(self._continue_prompt, previous_narrative, new_dialogue, context_chars)
+
+    async def _generate(self, build_prompt, *args):
+        """按提示词调用模型，出错时返回错误信息"""
+        try:
+            prompt = build_prompt(*args)
+        except Exception as e:
+            return f"处理对话历史时发生错误：{str(e)}"
+        if prompt is None:
+            return "对话历史中没有有效的对话内容"
+
         try:
-            # 过滤掉系统消息，只保留用户和助手的对话
-            dialogue = [msg for msg in conversation_history if msg["role"] != "system"]
-            
-            if not dialogue:
-                return "对话历史中没有有效的对话内容"
-            
-            prompt = f"""请将以下对话内容转换成一篇流畅的第一人称回忆录叙事体。要求：
+            return await self.gateway.chat(
+                model=self.MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+            )
+
+        except Exception as e:
+            return f"调用AI接口时发生错误：{str(e)}"
+
+    def _narrative_prompt(self, conversation_history):
+        """生成叙事的提示词，没有有效对话时返回None"""
+        # 过滤掉系统消息，只保留用户和助手的对话
+        dialogue = [msg for msg in conversation_history if msg["role"] != "system"]
+
+        if not dialogue:
+            return None
+
+        return f"""请将以下对话内容转换成一篇流畅的第一人称回忆录叙事体。要求：
 1. 只关注对话中"user"（讲述者）所分享的经历和故事内容
 2. 以讲述者的第一人称视角展开叙述
 3. 忽略采访者的提问和回应，仅将其作为引出故事的线索
@@ -29,22 +68,28 @@ class NarrativeAgent:
 
 对话内容：
 {self._format_conversation(dialogue)}"""
-            
-            try:
-                response = self.client.chat.completions.create(
-                    model="glm-4-air",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.7,
-                )
-                
-                return response.choices[0].message.content
-                    
-            except Exception as e:
-                return f"调用AI接口时发生错误：{str(e)}"
-                
-        except Exception as e:
-            return f"处理对话历史时发生错误：{str(e)}"
-    
+
+    def _continue_prompt(self, previous_narrative, new_dialogue, context_chars):
+        """续写叙事的提示词，没有有效对话时返回None"""
+        dialogue = [msg for msg in new_dialogue if msg["role"] != "system"]
+
+        if not dialogue:
+            return None
+
+        context = previous_narrative[-context_chars:]
+        return f"""下面是一篇第一人称回忆录叙事体的结尾部分，以及之后新增的采访对话。请根据新增对话续写这篇回忆录。要求：
+1. 只输出续写的新内容，不要重复已有的叙事
+2. 只关注对话中"user"（讲述者）所分享的经历和故事内容
+3. 以讲述者的第一人称视角展开叙述，与已有叙事自然衔接
+4. 忽略采访者的提问和回应，仅将其作为引出故事的线索
+5. 保持原有故事的情感基调、关键细节和文风
+
+已有叙事（结尾部分）：
+{context}
+
+新增对话内容：
+{self._format_conversation(dialogue)}"""
+
     def _format_conversation(self, conversation_history):
         """格式化对话历史"""
         formatted = []
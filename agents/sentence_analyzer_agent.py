@@ -1,18 +1,39 @@
-import zhipuai
 import os
+import asyncio
 from dotenv import load_dotenv
+from utils.llm_gateway import get_llm_gateway
 
 load_dotenv()
 
 class SentenceAnalyzerAgent:
+    MODEL = "chatglm_turbo"
+    PROMPT_VERSION = "1"  # 修改提示词时递增，用于失效结果缓存
+
     def __init__(self):
         self.api_key = os.getenv("API_KEY_CONF")
-        zhipuai.api_key = self.api_key
-        self.client = zhipuai.ZhipuAI(api_key=self.api_key)
+        self.gateway = get_llm_gateway()  # 共享的模型调用网关
         
     def analyze_narrative(self, narrative_text):
-        """将叙事体拆解为段落并分类"""
-        prompt = f"""请将以下叙事体文本按自然段落进行划分，并为每个段落进行分类。分类包括：
+        """将叙事体拆解为段落并分类（同步版本，供界面调用，不能在事件循环中调用）"""
+        return asyncio.run(self.aanalyze_narrative(narrative_text))
+
+    async def aanalyze_narrative(self, narrative_text):
+        """将叙事体拆解为段落并分类，调用被取消时模型请求随之取消"""
+        prompt = self._prompt(narrative_text)
+
+        try:
+            return await self.gateway.chat(
+                model=self.MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.5,
+            )
+
+        except Exception as e:
+            return f"发生错误：{str(e)}"
+
+    def _prompt(self, narrative_text):
+        """分段分类的提示词"""
+        return f"""请将以下叙事体文本按自然段落进行划分，并为每个段落进行分类。分类包括：
 1. 事实描述 - 描述发生的事件和行为
 2. 情感表达 - 表达情绪和感受的段落
 3. 对话内容 - 包含对话或交谈的段落
@@ -28,18 +49,6 @@ class SentenceAnalyzerAgent:
 类型：[分类]
 ---"""
 
-        try:
-            response = self.client.chat.completions.create(
-                model="chatglm_turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.5,
-            )
-            
-            return response.choices[0].message.content
-                
-        except Exception as e:
-            return f"发生错误：{str(e)}"
-
     def get_paragraphs(self, analysis_result):
         """从分析结果中提取段落和分类"""
         paragraphs = []
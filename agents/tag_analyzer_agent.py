@@ -1,18 +1,39 @@
-import zhipuai
 import os
+import asyncio
 from dotenv import load_dotenv
+from utils.llm_gateway import get_llm_gateway
 
 load_dotenv()
 
 class TagAnalyzerAgent:
+    MODEL = "chatglm_turbo"
+    PROMPT_VERSION = "1"  # 修改提示词时递增，用于失效结果缓存
+
     def __init__(self):
         self.api_key = os.getenv("API_KEY_CONF")
-        zhipuai.api_key = self.api_key
-        self.client = zhipuai.ZhipuAI(api_key=self.api_key)
+        self.gateway = get_llm_gateway()  # 共享的模型调用网关
     
     def analyze_tags(self, text):
-        """基于标签树分析文本中的多维度标签"""
-        prompt = f"""请将以下叙事体文本按自然段落进行划分，并严格按照给定的标签体系对每个段落进行多维度标签识别。要求：
+        """基于标签树分析文本中的多维度标签（同步版本，供界面调用，不能在事件循环中调用）"""
+        return asyncio.run(self.aanalyze_tags(text))
+
+    async def aanalyze_tags(self, text):
+        """基于标签树分析文本中的多维度标签，调用被取消时模型请求随之取消"""
+        prompt = self._prompt(text)
+
+        try:
+            return await self.gateway.chat(
+                model=self.MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+            )
+
+        except Exception as e:
+            return f"标签分析出错：{str(e)}"
+
+    def _prompt(self, text):
+        """标签分析的提示词"""
+        return f"""请将以下叙事体文本按自然段落进行划分，并严格按照给定的标签体系对每个段落进行多维度标签识别。要求：
 
 1. 时间维度：
 - 人生阶段：童年(0-12岁)、青少年(13-18岁)、成年早期(18-30岁)、成年中期(30-50岁)、成年后期(50岁以后)
@@ -52,18 +73,6 @@ class TagAnalyzerAgent:
 人物维度：[用逗号分隔的标签列表，如：朋友]
 ---"""
 
-        try:
-            response = self.client.chat.completions.create(
-                model="chatglm_turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            return f"标签分析出错：{str(e)}"
-    
     def parse_tags(self, analysis_result):
         """解析分析结果，返回结构化的标签数据"""
         if not analysis_result or analysis_result.startswith("标签分析出错"):
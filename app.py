@@ -1,20 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import ValidationError
-from typing import Dict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from datetime import datetime
+import asyncio
 from utils.logger import logger
 from models.api_models import (
     ChatRequest,
     ChatResponse,
     ImportDialogueRequest,
     ImportDialogueResponse,
+    DialogueEntryList,
     WorkflowStatus,
+    BatchStatusRequest,
+    BatchStatusResponse,
+    WorkflowListResponse,
+    RetryResponse,
+    CancelResponse,
+    BatchImportResponse,
     SVGResult
 )
 from workflow.service import WorkflowService
+from workflow.core.admission import QueueFullError
+from workflow.core.workflow_manager import FINISHED_STATUSES
 from services.chat_service import ChatService
 from utils.monitor_pool import monitor_pool
+from utils.idempotency import IdempotencyConflictError, create_idempotency_store
+from utils.conversation_log import get_conversation_log
+from utils.streaming import sse_message, sse_comment, ndjson_line, iter_lines, iter_ndjson, SSE_HEADERS
 
 app = FastAPI(
     title="MemoryTree API",
@@ -34,48 +49,274 @@ app.add_middleware(
 # 初始化服务
 workflow_service = WorkflowService()
 chat_service = ChatService(workflow_service.workflow_manager)
+idempotency_store = create_idempotency_store()
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+async def run_idempotent(scope: str, key: Optional[str], payload: Any,
+                         compute: Callable[[], Awaitable[Any]], response: Response) -> Any:
+    """
+    按 Idempotency-Key 执行请求：客户端重试时返回首次请求的结果，不会重复处理
+    没有幂等键时直接执行
+    """
+    if not key:
+        return await compute()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key 过长")
+    try:
+        result, replayed = await idempotency_store.run(scope, key, payload, compute)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if replayed:
+        logger.info(f"重复请求，返回首次结果: {scope} {key}")
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
 @app.post("/chat", response_model=ChatResponse, name="chat")
-async def chat(request: ChatRequest) -> ChatResponse:
+async def chat(
+    request: ChatRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+) -> ChatResponse:
     """
     处理用户对话
     - 接收用户输入
     - 返回AI响应
     - 可能触发工作流
+    - 带 Idempotency-Key 时，同一个键的重试直接返回首次的响应
     """
     try:
         logger.info(f"处理用户输入: {request.user_input[:20]}...")
-        result = await chat_service.chat(request.user_input)
+        result = await run_idempotent(
+            "chat", idempotency_key, request.model_dump(),
+            lambda: chat_service.chat(request.user_input), response
+        )
         if "unit_id" in result:
             logger.info(f"触发工作流: {result['unit_id']}")
         return ChatResponse(**result)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"聊天处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    流式处理用户对话（Server-Sent Events）
+    - delta 事件：{"content": 文本片段}，按模型生成的顺序推送
+    - done 事件：{"response": 完整响应, "unit_id"?}，对话历史保存和工作流触发在生成完毕后进行
+    - error 事件：{"detail": 错误信息}
+    """
+    logger.info(f"处理流式用户输入: {request.user_input[:20]}...")
+
+    async def stream():
+        async for event in chat_service.chat_stream(request.user_input):
+            if "delta" in event:
+                yield sse_message({"content": event["delta"]}, event="delta")
+            elif "error" in event:
+                yield sse_message({"detail": event["error"]}, event="error")
+            else:
+                if "unit_id" in event:
+                    logger.info(f"触发工作流: {event['unit_id']}")
+                yield sse_message(
+                    {key: value for key, value in event.items() if key != "done"}, event="done"
+                )
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @app.post("/import-dialogue", response_model=ImportDialogueResponse, name="import_dialogue")
-async def import_dialogue(request: ImportDialogueRequest) -> ImportDialogueResponse:
+async def import_dialogue(
+    request: ImportDialogueRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+) -> ImportDialogueResponse:
     """
     导入历史对话
     - 接收对话历史
     - 触发工作流处理
+    - 带 Idempotency-Key 时，同一个键的重试返回首次创建的工作单元，不会重新处理
     """
     try:
         logger.info(f"收到导入请求: {len(request.dialogue_history)} 条对话")
-        unit_id = await chat_service.import_dialogue(
-            [entry.model_dump() for entry in request.dialogue_history]
+        dialogue_history = DialogueEntryList.dump_python(request.dialogue_history)
+
+        async def create():
+            return {"unit_id": await chat_service.import_dialogue(dialogue_history)}
+
+        # 客户端重试时时间戳可能重新生成，只按角色和内容识别请求
+        payload = [[entry["role"], entry["content"]] for entry in dialogue_history]
+        result = await run_idempotent("import-dialogue", idempotency_key, payload, create, response)
+        logger.info(f"导入成功，工作单元ID: {result['unit_id']}")
+        return ImportDialogueResponse(**result)
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        logger.warning(f"导入请求被拒绝: {str(e)}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
-        logger.info(f"导入成功，工作单元ID: {unit_id}")
-        return ImportDialogueResponse(unit_id=unit_id)
     except Exception as e:
         logger.error(f"导入对话失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/import-dialogue/stream", response_model=ImportDialogueResponse)
+async def import_dialogue_stream(request: Request) -> ImportDialogueResponse:
+    """
+    流式导入历史对话（大体积对话）
+    - 请求体为 NDJSON，每行一条对话 {"role", "content", "timestamp"?}
+    - 边接收边分批校验，不需要把整个请求体和全部条目模型同时保留在内存中
+    """
+    try:
+        unit_id = await chat_service.import_dialogue_stream(iter_lines(request.stream()))
+        logger.info(f"流式导入成功，工作单元ID: {unit_id}")
+        return ImportDialogueResponse(unit_id=unit_id)
+    except QueueFullError as e:
+        logger.warning(f"导入请求被拒绝: {str(e)}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"流式导入对话失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/import-dialogue/batch", response_model=BatchImportResponse)
+async def import_dialogue_batch(request: Request) -> BatchImportResponse:
+    """
+    批量导入历史对话
+    - application/x-ndjson: 每行一个对话历史（条目列表或 {"dialogue_history": [...]}），逐行读取
+    - application/json: 对话历史数组
+    - 按内容去重，工作单元在后台按并发上限逐步创建，通过 GET /import-dialogue/batch/{batch_id} 查询进度
+    - 读取请求体的同时投递工作单元；某一行不是合法JSON时返回422，剩余的对话不再投递
+      （已经创建的工作单元照常处理，批次以 failed 结束）；格式不符合要求的对话计入 invalid
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            histories = iter_ndjson(request.stream())
+        else:
+            body = await request.json()
+            if not isinstance(body, list):
+                raise HTTPException(status_code=422, detail="请求体必须是对话历史数组")
+
+            async def iter_body():
+                for item in body:
+                    yield item
+
+            histories = iter_body()
+
+        progress = await workflow_service.import_batch(histories)
+        logger.info(f"批量导入已受理: {progress['batch_id']}，共 {progress['total']} 条")
+        return BatchImportResponse(**progress)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"批量导入失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/import-dialogue/batch/{batch_id}", response_model=BatchImportResponse)
+async def get_import_batch(batch_id: str) -> BatchImportResponse:
+    """获取批量导入进度"""
+    progress = workflow_service.get_batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return BatchImportResponse(**progress)
+
+
+@app.get("/workflow/queue")
+async def get_workflow_queue():
+    """获取准入队列状态：排队深度、运行数量和等待时间"""
+    try:
+        return workflow_service.get_queue_stats()
+    except Exception as e:
+        logger.error(f"获取队列状态失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/workflow/overview")
+async def get_workflow_overview(status: Optional[str] = None, offset: int = 0, limit: int = 50):
+    """
+    分页获取工作流概览
+    - status: 状态分组 active / completed / failed / superseded / cancelled，为空时返回全部
+    - 按从新到旧排序
+    """
+    try:
+        return workflow_service.get_overview(status, max(0, offset), min(max(1, limit), 500))
+    except Exception as e:
+        logger.error(f"获取工作流概览失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def local_isoformat(value: Optional[datetime]) -> Optional[str]:
+    """工作单元创建时间为本地时间，带时区的查询参数先转换为本地时间再比较"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.isoformat()
+
+
+@app.post("/workflow/status:batch", response_model=BatchStatusResponse)
+async def get_workflow_status_batch(request: BatchStatusRequest) -> Dict:
+    """
+    批量获取工作流状态
+    - 一次读取全部状态快照，返回同一时刻的状态
+    - 不存在的工作单元放在 missing 中
+    """
+    try:
+        statuses = workflow_service.get_workflow_statuses(list(dict.fromkeys(request.unit_ids)))
+        return {
+            "items": [status for status in statuses.values() if status is not None],
+            "missing": [unit_id for unit_id, status in statuses.items() if status is None]
+        }
+    except Exception as e:
+        logger.error(f"批量获取工作流状态失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/workflows", response_model=WorkflowListResponse)
+async def list_workflows(
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+) -> Dict:
+    """
+    按条件分页列出工作流状态，从新到旧排序
+    - status: 状态分组 active / completed / failed / superseded / cancelled
+    - type: 工作单元类型 realtime / import
+    - since / until: 创建时间范围（ISO格式）
+    """
+    try:
+        return workflow_service.list_workflows(
+            status=status,
+            unit_type=type,
+            since=local_isoformat(since),
+            until=local_isoformat(until),
+            offset=offset,
+            limit=limit
+        )
+    except Exception as e:
+        logger.error(f"获取工作流列表失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/workflow/{unit_id}/status", response_model=WorkflowStatus)
 async def get_workflow_status(unit_id: str) -> WorkflowStatus:
     """获取工作流状态"""
@@ -109,12 +350,154 @@ async def get_workflow_status(unit_id: str) -> WorkflowStatus:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/workflow/{unit_id}/events")
+async def stream_workflow_events(unit_id: str, request: Request):
+    """
+    以 Server-Sent Events 推送工作流进度
+    - 连接后先推送当前状态，之后推送 status / log / svg_ready 等事件
+    - 工作单元结束后关闭连接
+    """
+    # 先订阅再读取状态，避免漏掉两者之间的事件
+    subscription = workflow_service.subscribe_events({unit_id})
+    status = await workflow_service.get_workflow_status(unit_id)
+    if not status:
+        subscription.close()
+        raise HTTPException(status_code=404, detail=f"工作单元不存在: {unit_id}")
+
+    async def stream():
+        try:
+            yield sse_message({"event": "status", "unit_id": unit_id, "data": status}, event="status")
+            if status["status"] in FINISHED_STATUSES:
+                return
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=15)
+                if event is None:
+                    yield sse_comment()
+                    continue
+                yield sse_message(event, event=event["event"])
+                if event["event"] == "status" and event["data"]["status"] in FINISHED_STATUSES:
+                    break
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.websocket("/ws/workflows")
+async def workflow_events_websocket(websocket: WebSocket):
+    """
+    多路复用的工作流事件推送
+    - 客户端发送 {"action": "subscribe", "unit_ids": [...]} 订阅指定工作单元，
+      unit_ids 为 "*" 时订阅全部事件（包括系统监控点变化）
+    - {"action": "unsubscribe", "unit_ids": [...]} 取消订阅
+    - 订阅时先推送这些工作单元的当前状态；空闲时每15秒发送 ping
+    """
+    await websocket.accept()
+    subscription = workflow_service.subscribe_events(set())
+
+    async def receive():
+        try:
+            while True:
+                message = await websocket.receive_json()
+                action = message.get("action")
+                unit_ids = message.get("unit_ids") or []
+                if action == "subscribe":
+                    if unit_ids == "*":
+                        subscription.unit_ids = None
+                        continue
+                    if subscription.unit_ids is not None:
+                        subscription.unit_ids.update(unit_ids)
+                    for unit_id in unit_ids:
+                        status = await workflow_service.get_workflow_status(unit_id)
+                        if status:
+                            await websocket.send_json({"event": "status", "unit_id": unit_id, "data": status})
+                elif action == "unsubscribe":
+                    if unit_ids == "*":
+                        subscription.unit_ids = set()
+                    elif subscription.unit_ids is not None:
+                        subscription.unit_ids.difference_update(unit_ids)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"工作流事件订阅消息无效: {str(e)}")
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while not receiver.done():
+            getter = asyncio.create_task(subscription.get(timeout=15))
+            await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            await websocket.send_json(getter.result() or {"event": "ping"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"工作流事件推送失败: {str(e)}")
+    finally:
+        receiver.cancel()
+        subscription.close()
+
+
+@app.post("/workflow/{unit_id}/retry", response_model=RetryResponse)
+async def retry_workflow(unit_id: str) -> RetryResponse:
+    """
+    重试失败的工作流
+    - 已完成节点的输出从检查点恢复
+    - 只重新执行失败或缺失的节点
+    """
+    try:
+        logger.info(f"重试工作流: {unit_id}")
+        result = await workflow_service.retry_workflow(unit_id)
+        if not result:
+            raise HTTPException(status_code=404, detail=f"工作单元不存在: {unit_id}")
+        return RetryResponse(**result)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        logger.error(f"重试工作流失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/workflow/{unit_id}", response_model=CancelResponse)
+async def cancel_workflow(unit_id: str) -> CancelResponse:
+    """
+    取消排队中或处理中的工作流
+    - 立即释放工作名额
+    - 未完成的节点在 node_states 中记录为 cancelled
+    """
+    try:
+        logger.info(f"取消工作流: {unit_id}")
+        result = await workflow_service.cancel_workflow(unit_id)
+        if not result:
+            raise HTTPException(status_code=404, detail=f"工作单元不存在: {unit_id}")
+        return CancelResponse(**result)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"取消工作流失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/workflow/{unit_id}/svg", response_model=SVGResult)
-async def get_svg_result(unit_id: str) -> SVGResult:
-    """获取SVG生成结果"""
+async def get_svg_result(unit_id: str, page: int = Query(1, ge=1)) -> SVGResult:
+    """获取SVG生成结果的指定页（page 从1开始，响应中包含总页数）"""
     try:
-        logger.info(f"获取SVG结果: {unit_id}")
-        result = await workflow_service.get_svg_result(unit_id)
+        logger.info(f"获取SVG结果: {unit_id}, 第 {page} 页")
+        try:
+            result = await workflow_service.get_svg_result(unit_id, page)
+        except IndexError as e:
+            raise HTTPException(status_code=404, detail=str(e))
 
         if not result:
             raise HTTPException(
@@ -138,6 +521,29 @@ async def get_svg_result(unit_id: str) -> SVGResult:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/workflow/{unit_id}/svg/stream")
+async def stream_svg_pages(unit_id: str):
+    """
+    以 NDJSON 逐页返回SVG
+    - 每行一页：{"page", "page_count", "content"}
+    - SVG尚未生成时保持连接，SVG节点完成后立即开始输出
+    - 工作单元结束但没有SVG时输出一行 {"error": ...}
+    """
+    status = await workflow_service.get_workflow_status(unit_id)
+    if not status:
+        raise HTTPException(status_code=404, detail=f"工作单元不存在: {unit_id}")
+
+    async def stream():
+        try:
+            async for page in workflow_service.iter_svg_pages(unit_id):
+                yield ndjson_line(page)
+        except Exception as e:
+            logger.error(f"SVG流式输出失败: {str(e)}")
+            yield ndjson_line({"error": str(e)})
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """全局异常处理"""
@@ -186,3 +592,13 @@ async def startup_event():
     except Exception as e:
         logger.error(f"应用启动失败: {str(e)}")
         raise
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """程序退出时写入缓冲的对话日志并保存索引"""
+    try:
+        get_conversation_log().close()
+        logger.info("应用已关闭")
+    except Exception as e:
+        logger.error(f"应用关闭清理失败: {str(e)}")
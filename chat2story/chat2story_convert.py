@@ -1,5 +1,5 @@
 import os
-import zhipuai
+import sys
 from dotenv import load_dotenv
 import re
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QTextEdit, QProgressBar, QLabel, QHBoxLayout, QFileDialog
@@ -9,6 +9,12 @@ import svgwrite
 import markdown
 from bs4 import BeautifulSoup
 
+# 添加项目根目录到 Python 路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from utils.llm_gateway import get_llm_gateway
+
 class ConvertThread(QThread):
     """转换处理线程"""
     progress_signal = pyqtSignal(str)  # 进度信息信号
@@ -234,7 +240,7 @@ class Chat2Story:
         self.api_key = os.getenv("API_KEY_CONF")
         if not self.api_key:
             raise ValueError("未找到API密钥，请检查环境变量 API_KEY_CONF")
-        self.client = zhipuai.ZhipuAI(api_key=self.api_key)
+        self.gateway = get_llm_gateway()  # 共享的模型调用网关
         self.print = print  # 可被GUI重写的打印函数
         self.update_progress = lambda x: None  # 可被GUI重写的进度更新函数
         
@@ -305,13 +311,11 @@ class Chat2Story:
                 {"role": "user", "content": f"请将以下访谈内容转换为优美的第一人称叙事文：\n\n{segment}"}
             ]
             
-            response = self.client.chat.completions.create(
+            result = self.gateway.chat_sync(
                 model="glm-4",
                 messages=messages,
                 temperature=0.7,
             )
-            
-            result = response.choices[0].message.content
             self.print(f"转换完成，输出前100字: {result[:100]}...")
             self.print("-" * 40)
             return result
@@ -1,5 +1,5 @@
 from typing import List, Optional, Dict
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
 
 
@@ -18,12 +18,11 @@ class DialogueEntry(BaseModel):
     """对话条目模型"""
     role: str
     content: str
-    timestamp: str = None
+    timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
 
-    def __init__(self, **data):
-        if "timestamp" not in data:
-            data["timestamp"] = datetime.now().isoformat()
-        super().__init__(**data)
+
+# 对话条目列表校验器：直接从JSON字节整批校验，避免逐条构造和转换
+DialogueEntryList = TypeAdapter(List[DialogueEntry])
 
 
 class ImportDialogueRequest(BaseModel):
@@ -36,6 +35,25 @@ class ImportDialogueResponse(BaseModel):
     unit_id: str
 
 
+class BatchImportResponse(BaseModel):
+    """批量导入进度模型"""
+    batch_id: str
+    status: str  # queued / running / completed / failed / cancelled
+    create_time: str
+    total: int  # 去重后需要导入的对话数
+    duplicates: int  # 重复的对话数（批次内或最近已导入）
+    invalid: int  # 格式无效的对话数
+    submitted: int  # 已创建的工作单元数
+    rejected: int  # 创建工作单元失败的对话数
+    completed: int
+    failed: int
+    queued: int  # 尚未创建工作单元的对话数
+    running: int  # 处理中的工作单元数
+    progress: float  # 0-1
+    unit_ids: List[str]
+    errors: List[str]  # 最近的错误信息
+
+
 class NodeState(BaseModel):
     """节点状态模型"""
     status: str
@@ -53,6 +71,9 @@ class WorkflowStatus(BaseModel):
     node_states: Dict[str, NodeState]
     error: Optional[str] = None
     svg_ready: bool
+    svg_pages: int = 0  # SVG页数
+    superseded_by: Optional[str] = None  # 被同一会话中较新的工作单元取代时指向该单元
+    version: Optional[int] = None  # 状态快照版本，每次状态变化递增
 
     class Config:
         json_schema_extra = {
@@ -74,8 +95,43 @@ class WorkflowStatus(BaseModel):
         }
 
 
+class BatchStatusRequest(BaseModel):
+    """批量查询工作流状态请求模型"""
+    unit_ids: List[str] = Field(min_length=1, max_length=500)
+
+
+class BatchStatusResponse(BaseModel):
+    """批量查询工作流状态响应模型"""
+    items: List[WorkflowStatus]
+    missing: List[str]  # 不存在的工作单元
+
+
+class WorkflowListResponse(BaseModel):
+    """工作流列表响应模型"""
+    total: int  # 满足条件的总数
+    offset: int
+    limit: int
+    items: List[WorkflowStatus]
+
+
+class RetryResponse(BaseModel):
+    """重试工作流响应模型"""
+    unit_id: str
+    status: str
+    pending_nodes: List[str]  # 需要重新执行的节点
+
+
+class CancelResponse(BaseModel):
+    """取消工作流响应模型"""
+    unit_id: str
+    status: str
+    cancelled_nodes: List[str]  # 被取消的节点
+
+
 class SVGResult(BaseModel):
     """SVG结果模型"""
     content: str  # SVG内容字符串
     type: str  # 结果类型
     metadata: dict  # 元数据
+    page: int = 1  # 当前页码，从1开始
+    page_count: int = 1  # 总页数
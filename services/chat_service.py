@@ -1,9 +1,14 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, List, AsyncIterator, Callable, Set, Tuple
 from datetime import datetime
+import asyncio
+import json
+import uuid
+from pydantic import ValidationError
 
 from app import logger
-from workflow.core.workflow_manager import WorkflowManager
+from workflow.core.admission import QueueFullError
 from agents.conversation_agent import ConversationAgent
+from models.api_models import DialogueEntryList
 from utils.monitor_pool import monitor_pool  # 添加导入
 
 
@@ -21,6 +26,8 @@ class ChatService:
         self.message_count = 1
         self.workflow_manager = workflow_manager
         self.conversation_agent = ConversationAgent()  # 初始化对话代理
+        self._chat_lock = asyncio.Lock()  # 模型调用期间不阻塞事件循环，用锁保证对话按顺序处理
+        self._stream_tasks: Set[asyncio.Task] = set()  # 后台生成流式响应的任务，保留引用直到完成
         self.trigger_threshold = 6  # 每6条消息触发一次工作流
         self.init_chat_history()
 
@@ -43,65 +50,142 @@ class ChatService:
         # 确保返回的是列表类型
         self.chat_history = messages
         self.message_count = 1
+        # 每次初始化开启新的会话，watermark 之前的对话已交给工作流处理（跳过系统提示）
+        self.session_id = str(uuid.uuid4())
+        self.watermark = len(messages)
 
     async def chat(self, user_input: str) -> Dict[str, Any]:
         """处理用户输入，返回AI响应"""
+        async with self._chat_lock:
+            return await self._chat(user_input)
+
+    async def _chat(self, user_input: str) -> Dict[str, Any]:
+        turn = (len(self.chat_history), self.message_count)
         try:
-            # 添加用户消息
-            self.chat_history.append({
-                "role": "user",
-                "content": user_input,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.message_count += 1
-
-            # 添加监控点：引导问题辅助资料
-            await monitor_pool.record(
-                category="chat",
-                key="process_user_input",
-                value="RAG"
-            )
+            await self._begin_turn(user_input)
 
             # 生成AI响应
-            response = self.conversation_agent.chat(user_input)
-            self.chat_history.append({
-                "role": "assistant",
-                "content": response,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.message_count += 1
-
-            result = {"response": response}
-
-            # 检查是否需要触发工作流
-            if self.message_count >= self.trigger_threshold:
+            try:
+                response = await self.conversation_agent.achat(user_input)
+            except Exception:
+                self._rollback_turn(*turn)
+                raise
+            return await self._finish_turn(response)
+
+        except Exception as e:
+            logger.error(f"聊天处理失败: {str(e)}")
+            raise
+
+    async def chat_stream(self, user_input: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        处理用户输入，逐段返回AI响应
+        Yields:
+            {"delta": 文本片段}，结束时 {"done": True, "response": 完整响应, "unit_id"?}，
+            处理失败时 {"error": 错误信息}，这一轮不记录AI响应，也不触发工作流
+        对话历史保存和工作流触发检查在响应生成完毕后进行；
+        响应在后台任务中生成，客户端中途断开时这一轮对话仍会完整记录
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self._chat_streaming(user_input, queue.put_nowait))
+        self._stream_tasks.add(task)
+        task.add_done_callback(self._stream_tasks.discard)
+        while True:
+            event = await queue.get()
+            yield event
+            if "delta" not in event:
+                return
+
+    async def _chat_streaming(self, user_input: str, emit: Callable[[Dict[str, Any]], None]):
+        async with self._chat_lock:
+            turn = (len(self.chat_history), self.message_count)
+            try:
+                await self._begin_turn(user_input)
+
+                chunks = []
+                async for delta in self.conversation_agent.achat_stream(user_input):
+                    chunks.append(delta)
+                    emit({"delta": delta})
+            except Exception as e:
+                # 没有生成完整的回复，撤销这一轮的用户消息，避免下一轮带上没有回复的提问
+                self._rollback_turn(*turn)
+                logger.error(f"流式聊天处理失败: {str(e)}")
+                emit({"error": str(e)})
+                return
+
+            try:
+                result = await self._finish_turn("".join(chunks))
+                emit({"done": True, **result})
+            except Exception as e:
+                logger.error(f"流式聊天处理失败: {str(e)}")
+                emit({"error": str(e)})
+
+    def _rollback_turn(self, history_length: int, message_count: int):
+        """撤销 _begin_turn 记录的用户消息"""
+        del self.chat_history[history_length:]
+        self.message_count = message_count
+
+    async def _begin_turn(self, user_input: str):
+        """记录用户消息"""
+        self.chat_history.append({
+            "role": "user",
+            "content": user_input,
+            "timestamp": datetime.now().isoformat()
+        })
+        self.message_count += 1
+
+        # 添加监控点：引导问题辅助资料
+        await monitor_pool.record(
+            category="chat",
+            key="process_user_input",
+            value="RAG"
+        )
+
+    async def _finish_turn(self, response: str) -> Dict[str, Any]:
+        """记录AI响应，检查是否触发工作流"""
+        self.chat_history.append({
+            "role": "assistant",
+            "content": response,
+            "timestamp": datetime.now().isoformat()
+        })
+        self.message_count += 1
+
+        result = {"response": response}
+
+        # 检查是否需要触发工作流
+        if self.message_count >= self.trigger_threshold:
+            try:
+                # 只提交上次触发之后的新增对话，工作流在已有叙事基础上续写
                 unit_id = await self.workflow_manager.create_work_unit(
-                    {"dialogue_history": self.chat_history},
+                    {
+                        "dialogue_history": self.chat_history[self.watermark:],
+                        "session_id": self.session_id,
+                        "watermark": self.watermark
+                    },
                     "realtime"
                 )
                 result["unit_id"] = unit_id
+                self.watermark = len(self.chat_history)
                 # 重置计数
                 self.message_count = 0
+            except QueueFullError as e:
+                # 队列已满时不影响对话，保留计数等下一条消息再触发
+                logger.warning(f"工作流队列已满，暂不触发: {str(e)}")
 
-            # 添加监控点：更新系统的对话历史
-            await monitor_pool.record(
-                category="chat",
-                key="system_history",
-                value=self.conversation_agent.get_conversation_history()
-            )
-
-            # 添加监控点：记录最近的对话历史
-            await monitor_pool.record(
-                category="chat",
-                key="recent_history",
-                value=self.chat_history[-5:] if len(self.chat_history) > 0 else []
-            )
+        # 添加监控点：更新系统的对话历史
+        await monitor_pool.record(
+            category="chat",
+            key="system_history",
+            value=self.conversation_agent.get_conversation_history()
+        )
 
-            return result
+        # 添加监控点：记录最近的对话历史
+        await monitor_pool.record(
+            category="chat",
+            key="recent_history",
+            value=self.chat_history[-5:] if len(self.chat_history) > 0 else []
+        )
 
-        except Exception as e:
-            logger.error(f"聊天处理失败: {str(e)}")
-            raise
+        return result
 
     def _check_trigger_condition(self) -> bool:
         """检查是否满足触发条件"""
@@ -128,6 +212,8 @@ class ChatService:
             dialogue_history: 历史对话列表
         Returns:
             工作单元ID
+        Raises:
+            QueueFullError: 准入队列已满
         """
         return await self.workflow_manager.create_work_unit(
             data={
@@ -137,6 +223,55 @@ class ChatService:
             unit_type="import"
         )
 
+    async def import_dialogue_stream(self, lines: AsyncIterator[Tuple[int, bytes]],
+                                     batch_size: int = 1000) -> str:
+        """
+        流式导入历史对话（NDJSON，每行一条对话）
+        - 每攒够 batch_size 行整批从JSON字节校验，校验后立即转换为字典，
+          同一时刻只保留一批条目的模型对象
+        Args:
+            lines: (行号, 行内容) 流，见 utils.streaming.iter_lines
+            batch_size: 每批校验的行数
+        Returns:
+            工作单元ID
+        Raises:
+            ValueError: 对话为空或某一行不是合法的对话条目
+            QueueFullError: 准入队列已满
+        """
+        history: List[Dict] = []
+        batch: List[Tuple[int, bytes]] = []
+        async for line in lines:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                history.extend(self._validate_entries(batch))
+                batch.clear()
+        if batch:
+            history.extend(self._validate_entries(batch))
+
+        if not history:
+            raise ValueError("对话历史为空")
+        logger.info(f"流式导入校验完成: {len(history)} 条对话")
+        return await self.import_dialogue(history)
+
+    @staticmethod
+    def _validate_entries(batch: List[Tuple[int, bytes]]) -> List[Dict]:
+        """整批校验对话条目，失败时指出出错的行号"""
+        try:
+            entries = DialogueEntryList.validate_json(b"[" + b",".join(line for _, line in batch) + b"]")
+        except ValidationError as e:
+            error = e.errors()[0]
+            if error["loc"] and isinstance(error["loc"][0], int):
+                line_no = batch[error["loc"][0]][0]
+                raise ValueError(f"第 {line_no} 行不是合法的对话条目: {error['msg']}")
+            # JSON语法错误，逐行定位
+            for line_no, line in batch:
+                try:
+                    json.loads(line)
+                except ValueError as line_error:
+                    raise ValueError(f"第 {line_no} 行不是合法的JSON: {str(line_error)}")
+            raise ValueError(f"对话条目格式错误: {error['msg']}")
+        return DialogueEntryList.dump_python(entries)
+
     def get_dialogue_history(self) -> List[Dict]:
         """获取当前对话历史"""
         return self.current_dialogue.copy()
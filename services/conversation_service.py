@@ -7,11 +7,11 @@ class ConversationService:
     def __init__(self):
         self._session = None
         
-    def save_history(self, session_id: str, history: list) -> bool:
-        """保存对话历史"""
+    def save_history(self, session_id: str, history: list, offset: int = 0) -> bool:
+        """保存对话历史，offset 为这些对话在会话中的起始位置（增量保存时序号接续已有对话）"""
         try:
             dialogues = []
-            for idx, msg in enumerate(history, 1):
+            for idx, msg in enumerate(history, offset + 1):
                 dialogue = Dialogue(
                     session_id=session_id,
                     role=msg.get('role'),
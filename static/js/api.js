@@ -28,34 +28,143 @@ class DataManager {
         try {
             const newData = await MonitorAPI.getAllData();
             console.log('获取到新数据:', newData);
-
-            // 通知更新
-            this.updateCallbacks.forEach((callback, key) => {
-                try {
-                    console.log('触发回调:', key);
-                    if (key.startsWith('workflow-')) {
-                        const workflowId = key.replace('workflow-', '');
-                        callback(workflowId, newData);
-                    } else {
-                        callback(newData);
-                    }
-                } catch (error) {
-                    console.error(`回调执行失败 ${key}:`, error);
-                }
-            });
-
             this.data = newData;
+            this.notify();
         } catch (error) {
             console.error('刷新数据失败:', error);
         }
     }
 
-    // 启动定时刷新
+    // 通知更新
+    notify() {
+        this.updateCallbacks.forEach((callback, key) => {
+            try {
+                if (key.startsWith('workflow-')) {
+                    const workflowId = key.replace('workflow-', '');
+                    callback(workflowId, this.data);
+                } else {
+                    callback(this.data);
+                }
+            } catch (error) {
+                console.error(`回调执行失败 ${key}:`, error);
+            }
+        });
+    }
+
+    // 把推送的执行日志和监控点条目合并到本地数据，返回是否有变化
+    applyEvent(event) {
+        if (!this.data) {
+            return false;
+        }
+        const unitId = event.unit_id;
+        const workflows = this.data.workflows = this.data.workflows || {};
+
+        if (event.event === 'log') {
+            const workflow = workflows[unitId] = workflows[unitId] || {};
+            workflow.execution_log = workflow.execution_log || [];
+            workflow.execution_log.push({value: event.data, timestamp: event.timestamp});
+            return true;
+        }
+        if (event.event !== 'monitor') {
+            return false;
+        }
+
+        const {category, key, mode, entry} = event.data;
+        if (mode === 'remove') {
+            delete workflows[unitId];
+            return true;
+        }
+        let target;
+        if (unitId) {
+            target = workflows[unitId] = workflows[unitId] || {};
+        } else {
+            target = this.data[category] = this.data[category] || {};
+        }
+        if (mode === 'append') {
+            target[key] = target[key] || [];
+            target[key].push(entry);
+        } else if (mode === 'merge') {
+            target[key] = {...(target[key] || {}), ...entry};
+        } else {
+            target[key] = entry;
+        }
+        return true;
+    }
+
+    // 启动自动刷新：优先使用WebSocket推送，连接不可用时退回定时轮询
     startAutoRefresh(interval = 1000) {
+        this.pollInterval = interval;
         // 立即执行一次
         this.refreshData();
-        // 设置定时刷新
-        setInterval(() => this.refreshData(), interval);
+        this.connectPush();
+    }
+
+    // 建立推送连接，收到的事件直接合并到本地数据
+    connectPush() {
+        if (!('WebSocket' in window)) {
+            this.startPolling();
+            return;
+        }
+
+        const wsUrl = MonitorAPI.BASE_URL.replace(/^http/, 'ws') + '/ws/workflows';
+        let socket;
+        try {
+            socket = new WebSocket(wsUrl);
+        } catch (error) {
+            console.error('推送连接失败，改为轮询:', error);
+            this.startPolling();
+            return;
+        }
+
+        socket.onopen = () => {
+            console.log('推送连接已建立');
+            this.stopPolling();
+            socket.send(JSON.stringify({action: 'subscribe', unit_ids: '*'}));
+            // 订阅之前的变化可能没有收到，重新拉取一次完整数据，之后只合并推送的条目
+            this.refreshData();
+        };
+
+        socket.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            if (this.applyEvent(event)) {
+                this.scheduleRender();
+            }
+        };
+
+        socket.onclose = () => {
+            console.log('推送连接断开，改为轮询并稍后重连');
+            this.startPolling();
+            setTimeout(() => this.connectPush(), 5000);
+        };
+
+        this.socket = socket;
+    }
+
+    // 短时间内的多个事件合并为一次渲染
+    scheduleRender() {
+        if (this.renderPending) {
+            return;
+        }
+        this.renderPending = true;
+        requestAnimationFrame(() => {
+            this.renderPending = false;
+            this.notify();
+        });
+    }
+
+    // 定时轮询（推送不可用时的后备方案）
+    startPolling() {
+        if (this.pollTimer) {
+            return;
+        }
+        this.pollTimer = setInterval(() => this.refreshData(), this.pollInterval || 1000);
+    }
+
+    stopPolling() {
+        if (this.pollTimer) {
+            clearInterval(this.pollTimer);
+            this.pollTimer = null;
+        }
     }
 
     // 注册回调
@@ -144,13 +144,17 @@ function updateSystemOverview(data) {
 
         const stats = systemData.workflows_overview.value;
 
-        document.getElementById('workflow-total').textContent = stats.all_workflows?.length || 0;
+        // 列表只包含最近的工作流，总数以 counts 为准
 
-        document.getElementById('workflow-active').textContent = stats.active_workflows?.length || 0;
+        const counts = stats.counts || {};
 
-        document.getElementById('workflow-completed').textContent = stats.completed_workflows?.length || 0;
+        document.getElementById('workflow-total').textContent = counts.total ?? stats.all_workflows?.length ?? 0;
 
-        document.getElementById('workflow-failed').textContent = stats.failed_workflows?.length || 0;
+        document.getElementById('workflow-active').textContent = counts.active ?? stats.active_workflows?.length ?? 0;
+
+        document.getElementById('workflow-completed').textContent = counts.completed ?? stats.completed_workflows?.length ?? 0;
+
+        document.getElementById('workflow-failed').textContent = counts.failed ?? stats.failed_workflows?.length ?? 0;
 
 
         // 更新活跃工作流ID列表
@@ -1,3 +1,18 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# 工作单元存储、结果缓存、模型响应缓存和对话日志写到临时目录，不使用默认的 data/ 和 logs/；
+# 必须在导入 app 之前设置，app 导入时就会创建这些存储。
+# 先注册的退出处理最后执行，存储关闭并写完待写队列后再删除目录
+TEST_DATA_DIR = tempfile.mkdtemp(prefix="memory_tree_test_")
+atexit.register(shutil.rmtree, TEST_DATA_DIR, ignore_errors=True)
+os.environ["WORKFLOW_DB_PATH"] = os.path.join(TEST_DATA_DIR, "workflow.db")
+os.environ["NODE_CACHE_PATH"] = os.path.join(TEST_DATA_DIR, "node_cache.db")
+os.environ["LLM_CACHE_PATH"] = os.path.join(TEST_DATA_DIR, "llm_cache.db")
+os.environ["CONVERSATION_LOG_DIR"] = os.path.join(TEST_DATA_DIR, "conversations")
+
 import pytest
 from sqlalchemy import create_engine, text, event
 from sqlalchemy.orm import sessionmaker
@@ -0,0 +1,65 @@
+import pytest
+
+from workflow.core.admission import AdmissionQueue, QueueFullError, parse_concurrency
+
+
+def make_queue(**kwargs):
+    dispatched = []
+    queue = AdmissionQueue(**kwargs)
+    queue.set_dispatcher(dispatched.append)
+    return queue, dispatched
+
+
+def test_realtime_dispatched_before_import():
+    """名额释放时 realtime 优先于先到的 import"""
+    queue, dispatched = make_queue(max_running=1)
+    queue.submit("import-1", "import")
+    queue.submit("import-2", "import")
+    queue.submit("chat-1", "realtime")
+
+    assert dispatched == ["import-1"]
+    queue.release("import-1")
+    assert dispatched == ["import-1", "chat-1"]
+    queue.release("chat-1")
+    assert dispatched == ["import-1", "chat-1", "import-2"]
+
+
+def test_per_type_concurrency_leaves_room_for_realtime():
+    """import 受自身并发上限限制，剩余名额留给 realtime"""
+    queue, dispatched = make_queue(max_running=3, concurrency={"import": 1})
+    for i in range(3):
+        queue.submit(f"import-{i}", "import")
+    queue.submit("chat-1", "realtime")
+
+    assert dispatched == ["import-0", "chat-1"]
+    assert queue.stats()["depth_by_type"] == {"import": 2, "realtime": 0}
+
+
+def test_full_queue_rejects_with_retry_after():
+    """队列已满时拒绝并给出重试时间"""
+    queue, _ = make_queue(max_size=1, max_running=1)
+    queue.submit("a", "import")
+    queue.submit("b", "import")
+
+    with pytest.raises(QueueFullError) as exc_info:
+        queue.check_capacity("import")
+    assert exc_info.value.retry_after >= 1
+    assert queue.stats()["depth"] == 1
+
+
+def test_removed_unit_is_never_dispatched():
+    """被取代的排队单元移出队列后不会再派发"""
+    queue, dispatched = make_queue(max_running=1)
+    queue.submit("a", "realtime")
+    queue.submit("b", "realtime")
+    queue.submit("c", "realtime")
+
+    assert queue.remove("b") is True
+    assert queue.remove("a") is False
+    queue.release("a")
+
+    assert dispatched == ["a", "c"]
+
+
+def test_parse_concurrency():
+    assert parse_concurrency("realtime=8, import=4") == {"realtime": 8, "import": 4}
@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+import pytest
+
+import workflow.core.node as node_module
+import workflow.core.node_types as node_types
+from agents.sentence_analyzer_agent import SentenceAnalyzerAgent
+from agents.tag_analyzer_agent import TagAnalyzerAgent
+from workflow.core.node_types import AnalysisNode, UNCLASSIFIED_TYPE
+
+SENTENCES = "段落：第一段。\n类型：事实描述\n---\n段落：第二段。\n类型：情感表达\n---"
+TAGS = "段落：第一段。\n时间维度：小学\n---\n段落：第二段。\n情感维度：快乐\n---"
+
+
+class StubSentenceAgent(SentenceAnalyzerAgent):
+    """返回固定结果（或抛出异常）的段落分类Agent，解析沿用真实实现"""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def aanalyze_narrative(self, narrative_text):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class StubTagAgent(TagAnalyzerAgent):
+    """返回固定结果（或抛出异常）的标签分析Agent，解析沿用真实实现"""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def aanalyze_tags(self, narrative_text):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeCache:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def set(self, key, value):
+        self.items[key] = value
+
+
+class FakeDB:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def make_node(sentence_result, tag_result):
+    node = AnalysisNode()
+    node.combined_agent = None
+    node.sentence_agent = StubSentenceAgent(sentence_result)
+    node.tag_agent = StubTagAgent(tag_result)
+    return node
+
+
+class FakeNarrativeService:
+    """按会话保存叙事体的假服务"""
+
+    narratives = {}
+
+    def get_by_session(self, session_id):
+        return self.narratives.get(session_id)
+
+    def create(self, narrative):
+        narrative.id = len(self.narratives) + 1
+        self.narratives[narrative.session_id] = narrative
+        return narrative
+
+    def update(self, narrative):
+        return narrative
+
+
+@pytest.fixture
+def persistence(monkeypatch):
+    """用假的数据库会话和服务替代持久化，记录保存的对话、叙事体和段落"""
+    saved = SimpleNamespace(dialogues=[], paragraphs=[], narratives={})
+
+    @contextmanager
+    def fake_db():
+        yield FakeDB()
+
+    def save_history(session_id, history, offset=0):
+        saved.dialogues.append((session_id, offset, len(history)))
+        return True
+
+    def create_paragraph(paragraph):
+        saved.paragraphs.append(paragraph)
+        return paragraph
+
+    monkeypatch.setattr(node_types, "get_db", fake_db)
+    monkeypatch.setattr(FakeNarrativeService, "narratives", saved.narratives)
+    monkeypatch.setattr(node_types, "ConversationService", lambda: SimpleNamespace(save_history=save_history))
+    monkeypatch.setattr(node_types, "NarrativeService", FakeNarrativeService)
+    monkeypatch.setattr(node_types, "ParagraphService",
+                        lambda: SimpleNamespace(create=create_paragraph, update=lambda paragraph: paragraph))
+    monkeypatch.setattr(node_types, "TagService", lambda: SimpleNamespace(
+        find_by_dimension_and_value=lambda dimension, value: None, create=lambda tag: tag
+    ))
+    return saved
+
+
+@pytest.mark.asyncio
+async def test_both_analyses_merge_by_paragraph():
+    errors = {}
+    results = await make_node(SENTENCES, TAGS)._analyze_separately("第一段。\n\n第二段。", errors)
+    assert errors == {}
+    assert results == [
+        {"content": "第一段。", "type": "事实描述", "tags": {"时间维度": ["小学"]}},
+        {"content": "第二段。", "type": "情感表达", "tags": {"情感维度": ["快乐"]}},
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tag_result", [RuntimeError("timeout"), "标签分析出错：timeout"])
+async def test_tag_failure_keeps_classified_paragraphs(tag_result):
+    """标签分析抛出异常或返回错误文本时，段落照常保存，标签为空"""
+    errors = {}
+    results = await make_node(SENTENCES, tag_result)._analyze_separately("叙事", errors)
+    assert "timeout" in errors["tags"] and "sentence" not in errors
+    assert [(r["content"], r["type"], r["tags"]) for r in results] == [
+        ("第一段。", "事实描述", {}), ("第二段。", "情感表达", {})
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sentence_result", [RuntimeError("timeout"), "发生错误：timeout"])
+async def test_sentence_failure_keeps_tagged_paragraphs(sentence_result):
+    """段落分类失败时用标签分析的分段，类型记为未分类"""
+    errors = {}
+    results = await make_node(sentence_result, TAGS)._analyze_separately("叙事", errors)
+    assert "timeout" in errors["sentence"] and "tags" not in errors
+    assert [(r["content"], r["type"], r["tags"]) for r in results] == [
+        ("第一段。", UNCLASSIFIED_TYPE, {"时间维度": ["小学"]}),
+        ("第二段。", UNCLASSIFIED_TYPE, {"情感维度": ["快乐"]}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_mismatched_segment_counts_keep_extra_paragraphs():
+    """两次分析的分段数量不一致时按顺序对齐，多出的段落不丢弃"""
+    sentences = SENTENCES + "\n段落：第三段。\n类型：事实描述\n---"
+    results = await make_node(sentences, TAGS)._analyze_separately("叙事", {})
+    assert [r["content"] for r in results] == ["第一段。", "第二段。", "第三段。"]
+    assert results[2]["tags"] == {}
+
+    tags = TAGS + "\n段落：第三段。\n时间维度：中学\n---"
+    results = await make_node(SENTENCES, tags)._analyze_separately("叙事", {})
+    assert results[2] == {"content": "第三段。", "type": UNCLASSIFIED_TYPE, "tags": {"时间维度": ["中学"]}}
+
+
+@pytest.mark.asyncio
+async def test_both_analyses_failing_raises():
+    errors = {}
+    with pytest.raises(RuntimeError):
+        await make_node(RuntimeError("a"), "标签分析出错：b")._analyze_separately("叙事", errors)
+    assert set(errors) == {"sentence", "tags"}
+
+
+@pytest.mark.asyncio
+async def test_partial_result_is_marked_and_not_cached(monkeypatch, persistence):
+    """部分失败的结果标记 partial 并带上错误，不写入结果缓存；完整结果照常缓存"""
+    cache = FakeCache()
+    monkeypatch.setattr(node_module, "get_result_cache", lambda: cache)
+    work_unit = {
+        "id": "unit-1",
+        "data": {"dialogue_history": []},
+        "results": {"narrative": {"content": "第一段。\n\n第二段。"}},
+        "node_states": {"analysis": {}},
+    }
+
+    node = make_node(SENTENCES, RuntimeError("timeout"))
+    output = await node._process(work_unit)
+    assert output["analyse"]["partial"] is True
+    assert "timeout" in output["analyse"]["errors"]["tags"]
+    assert work_unit["node_states"]["analysis"]["partial"] is True
+    assert [paragraph.content for paragraph in persistence.paragraphs] == ["第一段。", "第二段。"]
+    assert cache.items == {}
+
+    node.tag_agent = StubTagAgent(TAGS)
+    work_unit["node_states"] = {"analysis": {}}
+    output = await node._process(work_unit)
+    assert "partial" not in output["analyse"]
+    assert len(cache.items) == 1
+
+
+@pytest.mark.asyncio
+async def test_realtime_units_append_to_session_narrative(monkeypatch, persistence):
+    """同一实时会话的工作单元保存到一个叙事体下，对话和段落序号接续之前的单元"""
+    monkeypatch.setenv("NODE_CACHE_ENABLED", "0")
+    node = make_node(SENTENCES, TAGS)
+    first = {
+        "id": "unit-1",
+        "data": {"dialogue_history": [{"role": "user", "content": "a"}] * 3, "session_id": "chat"},
+        "results": {"narrative": {"content": "第一段。\n\n第二段。"}},
+        "node_states": {"analysis": {}},
+    }
+    await node._process(first)
+
+    second = {
+        "id": "unit-2",
+        "data": {
+            "dialogue_history": [{"role": "user", "content": "b"}] * 2, "session_id": "chat",
+            "dialogue_offset": 3, "paragraph_offset": 2
+        },
+        "results": {"narrative": {"content": "第一段。\n\n第二段。\n\n新的两段", "delta": "新的两段"}},
+        "node_states": {"analysis": {}},
+    }
+    await node._process(second)
+
+    assert list(persistence.narratives) == ["chat"]
+    assert persistence.narratives["chat"].content == "第一段。\n\n第二段。\n\n新的两段"
+    assert {paragraph.narrative_id for paragraph in persistence.paragraphs} == {1}
+    assert [paragraph.sequence_number for paragraph in persistence.paragraphs] == [1, 2, 3, 4]
+    assert persistence.dialogues == [("chat", 0, 3), ("chat", 3, 2)]
@@ -4,6 +4,8 @@ import json
 from datetime import datetime
 import logging
 import asyncio
+import threading
+import time
 
 # 配置日志
 logging.basicConfig(
@@ -11,7 +13,8 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-from app import app
+from app import app, workflow_service
+from utils.event_bus import event_bus
 
 # 创建测试客户端
 client = TestClient(app)
@@ -136,4 +139,227 @@ async def test_error_handling():
     )
     assert response.status_code == 500  # 服务器内部错误
     error_data = response.json()
-    assert "detail" in error_data 
\ No newline at end of file
+    assert "detail" in error_data 
+
+
+@pytest.mark.asyncio
+async def test_status_batch_and_listing():
+    """测试批量状态查询和工作流列表"""
+    unit_ids = []
+    for i in range(2):
+        response = client.post(
+            "/import-dialogue",
+            json={"dialogue_history": [{"role": "user", "content": f"批量状态测试{i}"}]}
+        )
+        assert response.status_code == 200
+        unit_ids.append(response.json()["unit_id"])
+
+    response = client.post("/workflow/status:batch", json={"unit_ids": unit_ids + ["invalid-id"]})
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["id"] for item in data["items"]] == unit_ids
+    assert data["missing"] == ["invalid-id"]
+
+    response = client.get("/workflows", params={"type": "import", "limit": 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] >= 2 and len(data["items"]) == 1
+    assert data["items"][0]["id"] == unit_ids[-1]
+
+
+class ScriptedWorkflow:
+    """替代 WorkflowThread.process：叙事节点写入检查点，之后按 fail 决定成败；
+    hold 设置时在叙事节点之后一直等待，直到 release 被设置；成功时结果中带上 svg 分页"""
+
+    def __init__(self):
+        self.fail = False
+        self.svg = ["<svg>1</svg>"]
+        self.hold = False
+        self.release = threading.Event()
+        self.checkpoints = []  # 每次执行收到的检查点
+
+    async def process(self, work_unit, status_callback=None, checkpoints=None, checkpoint_callback=None):
+        checkpoints = checkpoints or {}
+        self.checkpoints.append(set(checkpoints))
+        if "narrative" not in checkpoints:
+            await checkpoint_callback(work_unit["id"], "narrative", {"narrative": {"content": "叙事"}})
+        node_states = {"narrative": {"status": "completed"}}
+        await status_callback(work_unit["id"], {"node_states": node_states})
+        while self.hold and not self.release.is_set():
+            await asyncio.sleep(0.01)
+        if self.fail:
+            return {"status": "failed", "results": {}, "node_states": node_states, "error": "分析失败"}
+        return {
+            "status": "completed",
+            "results": {
+                "narrative": {"content": "叙事"},
+                "svg": {"content": list(self.svg), "type": "memory_tree", "metadata": {}}
+            },
+            "node_states": {**node_states, "analysis": {"status": "completed"}, "svg": {"status": "completed"}},
+            "error": None
+        }
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    """工作流替换为 ScriptedWorkflow，整个测试使用同一个事件循环"""
+    workflow = ScriptedWorkflow()
+    monkeypatch.setattr(workflow_service.workflow_manager.workflow_thread, "process", workflow.process)
+    with TestClient(app) as test_client:
+        yield test_client, workflow
+    workflow.release.set()
+
+
+def import_unit(test_client, content):
+    response = test_client.post("/import-dialogue", json={"dialogue_history": [{"role": "user", "content": content}]})
+    assert response.status_code == 200
+    return response.json()["unit_id"]
+
+
+def wait_status(test_client, unit_id, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = test_client.get(f"/workflow/{unit_id}/status").json()
+        if status["status"] in statuses:
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"工作单元 {unit_id} 未在 {timeout} 秒内进入 {statuses}")
+
+
+def test_svg_pages(scripted):
+    """按页获取SVG，页码超出范围时返回404"""
+    test_client, workflow = scripted
+    workflow.svg = ["<svg>1</svg>", "<svg>2</svg>"]
+    unit_id = import_unit(test_client, "分页测试")
+    assert wait_status(test_client, unit_id, ("completed",))["svg_pages"] == 2
+
+    response = test_client.get(f"/workflow/{unit_id}/svg", params={"page": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["content"], data["page"], data["page_count"]) == ("<svg>2</svg>", 2, 2)
+
+    response = test_client.get(f"/workflow/{unit_id}/svg", params={"page": 3})
+    assert response.status_code == 404
+
+
+def test_retry_skips_checkpointed_nodes(scripted):
+    """重试失败的工作流：返回待执行节点，已完成节点从检查点恢复；非失败状态返回409，不存在返回404"""
+    test_client, workflow = scripted
+    workflow.fail = True
+    unit_id = import_unit(test_client, "重试测试")
+    assert wait_status(test_client, unit_id, ("failed",))["error"] == "分析失败"
+
+    workflow.fail = False
+    response = test_client.post(f"/workflow/{unit_id}/retry")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["unit_id"] == unit_id and data["status"] == "pending"
+    assert "narrative" not in data["pending_nodes"] and data["pending_nodes"]
+
+    status = wait_status(test_client, unit_id, ("completed",))
+    assert status["node_states"]["narrative"]["status"] == "completed"
+    assert workflow.checkpoints == [set(), {"narrative"}]
+
+    assert test_client.post(f"/workflow/{unit_id}/retry").status_code == 409
+    assert test_client.post("/workflow/invalid-id/retry").status_code == 404
+
+
+
+def test_cancel_workflow(scripted, monkeypatch):
+    """取消处理中和排队中的工作流；已取消或已结束返回409，不存在返回404"""
+    test_client, workflow = scripted
+    monkeypatch.setattr(workflow_service.workflow_manager.admission, "max_running", 1)
+    workflow.hold = True
+    running = import_unit(test_client, "取消测试1")
+    wait_status(test_client, running, ("processing",))
+    queued = import_unit(test_client, "取消测试2")
+    assert test_client.get(f"/workflow/{queued}/status").json()["status"] == "pending"
+
+    response = test_client.delete(f"/workflow/{queued}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+
+    response = test_client.delete(f"/workflow/{running}")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["unit_id"] == running and data["status"] == "cancelled"
+    assert "narrative" not in data["cancelled_nodes"] and data["cancelled_nodes"]
+    assert test_client.get(f"/workflow/{running}/status").json()["status"] == "cancelled"
+
+    assert test_client.delete(f"/workflow/{running}").status_code == 409
+    assert test_client.delete("/workflow/invalid-id").status_code == 404
+
+    workflow.hold = False
+    finished = import_unit(test_client, "取消测试3")
+    wait_status(test_client, finished, ("completed",))
+    assert test_client.delete(f"/workflow/{finished}").status_code == 409
+    assert workflow.checkpoints == [set(), set()]
+
+
+def read_sse_events(body):
+    """解析 SSE 响应体为 [(事件类型, 数据)]，跳过心跳注释"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = [line for line in block.split("\n") if not line.startswith(":")]
+        if not lines:
+            continue
+        event = next(line[len("event: "):] for line in lines if line.startswith("event: "))
+        data = "\n".join(line[len("data: "):] for line in lines if line.startswith("data: "))
+        events.append((event, json.loads(data)))
+    return events
+
+
+def test_workflow_events_sse(scripted):
+    """SSE 先推送当前状态，之后只推送该工作单元的事件，结束后关闭连接并释放订阅"""
+    test_client, workflow = scripted
+    workflow.hold = True
+    unit_id = import_unit(test_client, "SSE测试")
+    other = import_unit(test_client, "SSE测试-其他")
+    wait_status(test_client, unit_id, ("processing",))
+    subscribers = event_bus.subscriber_count
+
+    threading.Timer(0.2, workflow.release.set).start()
+    response = test_client.get(f"/workflow/{unit_id}/events")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = read_sse_events(response.text)
+    assert events[0][0] == "status" and events[0][1]["data"]["status"] == "processing"
+    assert events[-1][0] == "status" and events[-1][1]["data"]["status"] == "completed"
+    assert {data["unit_id"] for _, data in events} == {unit_id}
+    assert event_bus.subscriber_count == subscribers
+    wait_status(test_client, other, ("completed",))
+
+    # 已结束的工作单元只推送当前状态
+    events = read_sse_events(test_client.get(f"/workflow/{unit_id}/events").text)
+    assert [(event, data["data"]["status"]) for event, data in events] == [("status", "completed")]
+    assert test_client.get("/workflow/invalid-id/events").status_code == 404
+
+
+def test_workflow_events_websocket(scripted):
+    """WebSocket 订阅指定工作单元：先推送当前状态，只收到订阅的工作单元的事件，断开后释放订阅"""
+    test_client, workflow = scripted
+    workflow.hold = True
+    unit_id = import_unit(test_client, "WebSocket测试")
+    other = import_unit(test_client, "WebSocket测试-其他")
+    wait_status(test_client, unit_id, ("processing",))
+    wait_status(test_client, other, ("processing",))
+    subscribers = event_bus.subscriber_count
+
+    with test_client.websocket_connect("/ws/workflows") as websocket:
+        websocket.send_json({"action": "subscribe", "unit_ids": [unit_id]})
+        event = websocket.receive_json()
+        assert (event["event"], event["unit_id"], event["data"]["status"]) == ("status", unit_id, "processing")
+        assert event_bus.subscriber_count == subscribers + 1
+
+        workflow.release.set()
+        events = []
+        while not (events and events[-1]["event"] == "status" and events[-1]["data"]["status"] == "completed"):
+            events.append(websocket.receive_json())
+        assert {event["unit_id"] for event in events} == {unit_id}
+    wait_status(test_client, other, ("completed",))
+
+    deadline = time.monotonic() + 5
+    while event_bus.subscriber_count != subscribers and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert event_bus.subscriber_count == subscribers
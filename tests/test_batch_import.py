@@ -0,0 +1,180 @@
+import asyncio
+import json
+import pytest
+
+from utils.event_bus import event_bus
+from models.api_models import DialogueEntryList
+from utils.streaming import iter_lines, iter_ndjson
+from workflow.core.admission import QueueFullError
+from workflow.core.batch_import import BatchImporter, history_hash, is_valid_history
+
+
+class FakeManager:
+    """模拟工作流管理器：创建的工作单元在短暂延迟后完成"""
+
+    def __init__(self, full_times: int = 0, fail_on=(), reject=False):
+        self.full_times = full_times
+        self.reject = reject  # 创建工作单元时抛出异常
+        self.fail_on = set(fail_on)  # 包含这些内容的对话处理失败
+        self.statuses = {}
+        self.outcomes = {}
+        self.max_running = 0
+
+    async def create_work_unit(self, data, unit_type):
+        if self.full_times:
+            self.full_times -= 1
+            raise QueueFullError(0, 1)
+        if self.reject:
+            raise RuntimeError(f"rejected {data['dialogue_history'][0]['content']}")
+        unit_id = f"unit-{len(self.statuses)}"
+        self.statuses[unit_id] = "processing"
+        failed = any(entry["content"] in self.fail_on for entry in data["dialogue_history"])
+        self.outcomes[unit_id] = "failed" if failed else "completed"
+        running = sum(1 for status in self.statuses.values() if status == "processing")
+        self.max_running = max(self.max_running, running)
+        asyncio.get_running_loop().call_later(0.01, self._finish, unit_id)
+        return unit_id
+
+    def _finish(self, unit_id):
+        self.statuses[unit_id] = self.outcomes[unit_id]
+        event_bus.publish("status", {"status": self.statuses[unit_id]}, unit_id)
+
+    async def get_unit_status(self, unit_id):
+        return {"status": self.statuses[unit_id]}
+
+
+async def aiter(items):
+    for item in items:
+        yield item
+
+
+def dialogue(text):
+    return [{"role": "user", "content": text, "timestamp": "2024-01-01T00:00:00"}]
+
+
+def test_history_hash_ignores_timestamps():
+    """去重只看角色和内容"""
+    other = [{"role": "user", "content": "你好", "timestamp": "2025-06-01T00:00:00"}]
+    assert history_hash(dialogue("你好")) == history_hash(other)
+    assert history_hash(dialogue("你好")) != history_hash(dialogue("再见"))
+
+
+def test_is_valid_history():
+    assert is_valid_history(dialogue("你好"))
+    assert not is_valid_history([])
+    assert not is_valid_history({"role": "user", "content": "你好"})
+    assert not is_valid_history([{"role": "user"}])
+
+
+@pytest.mark.asyncio
+async def test_iter_ndjson_splits_across_chunks():
+    """行可能跨越多个数据块，空行跳过"""
+    chunks = [b'{"a": 1}\n{"b"', b': 2}\n\n', b'[3]']
+    assert [item async for item in iter_ndjson(aiter(chunks))] == [{"a": 1}, {"b": 2}, [3]]
+
+    with pytest.raises(ValueError):
+        [item async for item in iter_ndjson(aiter([b'{"a": 1}\nnot json\n']))]
+
+    lines = [item async for item in iter_lines(aiter([b"a\n\nb", b"c\n"]))]
+    assert lines == [(1, b"a"), (3, b"bc")]
+
+
+def test_dialogue_entries_validate_from_json():
+    """整批从JSON字节校验，缺少时间戳的条目补上当前时间"""
+    entries = DialogueEntryList.dump_python(DialogueEntryList.validate_json(
+        b'[{"role": "user", "content": "hi"}, {"role": "assistant", "content": "ok", "timestamp": "t"}]'
+    ))
+    assert entries[0]["timestamp"] and entries[1]["timestamp"] == "t"
+
+
+@pytest.mark.asyncio
+async def test_batch_dedup_and_bounded_concurrency():
+    """批次内和跨批次去重，同时处理的工作单元不超过并发上限"""
+    manager = FakeManager(full_times=1)
+    importer = BatchImporter(manager, concurrency=2)
+    items = [dialogue(f"第{i}段") for i in range(5)]
+    items += [dialogue("第0段"), {"dialogue_history": dialogue("第5段")}, "无效"]
+
+    progress = await importer.submit(aiter(items))
+    assert (progress["total"], progress["duplicates"], progress["invalid"]) == (6, 1, 1)
+
+    while importer.progress(progress["batch_id"])["status"] != "completed":
+        await asyncio.sleep(0.01)
+    final = importer.progress(progress["batch_id"])
+    assert final["completed"] == 6 and final["running"] == 0 and final["progress"] == 1.0
+    assert manager.max_running <= 2
+
+    again = await importer.submit(aiter([dialogue("第1段")]))
+    assert again["duplicates"] == 1 and again["status"] == "completed"
+
+
+@pytest.mark.asyncio
+async def test_failed_units_can_be_imported_again():
+    """以非完成状态结束的对话不参与去重，可以重新导入"""
+    manager = FakeManager(fail_on={"第1段"})
+    importer = BatchImporter(manager)
+
+    first = await importer.submit(aiter([dialogue("第0段"), dialogue("第1段")]))
+    while importer.progress(first["batch_id"])["status"] != "completed":
+        await asyncio.sleep(0.01)
+    final = importer.progress(first["batch_id"])
+    assert (final["completed"], final["failed"]) == (1, 1)
+
+    manager.fail_on.clear()
+    again = await importer.submit(aiter([dialogue("第0段"), dialogue("第1段")]))
+    assert (again["total"], again["duplicates"]) == (1, 1)
+    while importer.progress(again["batch_id"])["status"] != "completed":
+        await asyncio.sleep(0.01)
+    assert importer.progress(again["batch_id"])["completed"] == 1
+
+
+async def wait_finished(importer, batch_id):
+    while importer.progress(batch_id)["status"] in ("queued", "running"):
+        await asyncio.sleep(0.01)
+    return importer.progress(batch_id)
+
+
+@pytest.mark.asyncio
+async def test_reading_waits_for_submission():
+    """读取输入和投递同时进行，读取最多领先投递 queue_size 条左右"""
+    manager = FakeManager()
+    importer = BatchImporter(manager, concurrency=1, queue_size=2)
+    lag = []
+
+    async def histories():
+        for i in range(30):
+            lag.append(i - len(manager.statuses))
+            yield dialogue(f"第{i}段")
+
+    progress = await importer.submit(histories())
+    assert progress["total"] == 30
+    assert max(lag) <= 2 + 2
+    final = await wait_finished(importer, progress["batch_id"])
+    assert final["status"] == "completed" and final["completed"] == 30
+
+
+@pytest.mark.asyncio
+async def test_errors_are_capped():
+    importer = BatchImporter(FakeManager(reject=True), max_errors=3)
+    progress = await importer.submit(aiter([dialogue(f"第{i}段") for i in range(8)]))
+    final = await wait_finished(importer, progress["batch_id"])
+    assert final["rejected"] == 8 and final["progress"] == 1.0
+    assert final["errors"] == ["rejected 第5段", "rejected 第6段", "rejected 第7段"]
+
+
+@pytest.mark.asyncio
+async def test_invalid_json_stops_the_batch():
+    """读取到非法JSON时剩余的对话不再投递，已创建的工作单元照常跟踪"""
+    manager = FakeManager()
+    importer = BatchImporter(manager, concurrency=1, queue_size=1)
+    lines = [json.dumps(dialogue(f"第{i}段")).encode() + b"\n" for i in range(5)]
+    body = b"".join(lines) + b"not json\n" + json.dumps(dialogue("last")).encode() + b"\n"
+
+    with pytest.raises(ValueError):
+        await importer.submit(iter_ndjson(aiter([body[:40], body[40:]])))
+    batch_id = next(reversed(importer._batches))
+    final = await wait_finished(importer, batch_id)
+    assert final["status"] == "failed" and "读取输入失败" in final["errors"][-1]
+    assert final["queued"] == 0 and final["submitted"] == final["completed"] == final["total"]
+    assert len(manager.statuses) == final["submitted"] <= 5
+    assert history_hash(dialogue("last")) not in importer._imported
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import pytest
+
+import app  # noqa: F401  先加载应用，避免 services.chat_service 循环导入
+import services.chat_service as chat_service_module
+from services.chat_service import ChatService
+from utils.streaming import iter_lines
+
+
+class StubConversationAgent:
+    """按脚本逐段产出回复的对话Agent，fail_after 指定产出几段后抛出异常"""
+
+    def __init__(self):
+        self.deltas = ["你好", "，请讲讲", "你的童年"]
+        self.fail_after = None
+
+    async def achat_stream(self, user_input):
+        for index, delta in enumerate(self.deltas):
+            if index == self.fail_after:
+                raise RuntimeError("stream broken")
+            await asyncio.sleep(0)
+            yield delta
+
+    def get_conversation_history(self):
+        return []
+
+
+class FakeWorkflowManager:
+    def __init__(self):
+        self.units = []
+
+    async def create_work_unit(self, data, unit_type):
+        self.units.append((data, unit_type))
+        return f"unit-{len(self.units)}"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(chat_service_module, "ConversationAgent", StubConversationAgent)
+    return ChatService(FakeWorkflowManager())
+
+
+async def collect(service, user_input):
+    return [event async for event in service.chat_stream(user_input)]
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_yields_deltas_then_done(service):
+    events = await collect(service, "开始吧")
+    assert events == [
+        {"delta": "你好"}, {"delta": "，请讲讲"}, {"delta": "你的童年"},
+        {"done": True, "response": "你好，请讲讲你的童年"},
+    ]
+    assert [(m["role"], m["content"]) for m in service.chat_history[1:]] == [
+        ("user", "开始吧"), ("assistant", "你好，请讲讲你的童年")
+    ]
+    assert service.message_count == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_stream_rolls_back_user_turn(service):
+    """流式生成失败时不保留没有回复的用户消息，下一轮从干净的历史开始"""
+    service.conversation_agent.fail_after = 1
+    events = await collect(service, "第一问")
+    assert events == [{"delta": "你好"}, {"error": "stream broken"}]
+    assert len(service.chat_history) == 1 and service.message_count == 1
+
+    service.conversation_agent.fail_after = None
+    await collect(service, "第二问")
+    assert [m["content"] for m in service.chat_history[1:]] == ["第二问", "你好，请讲讲你的童年"]
+    assert service.message_count == 3
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_triggers_workflow_at_threshold(service):
+    for index in range(3):
+        events = await collect(service, f"问题{index}")
+    assert events[-1]["unit_id"] == "unit-1"
+    data, unit_type = service.workflow_manager.units[0]
+    assert unit_type == "realtime" and len(data["dialogue_history"]) == 6
+    assert service.message_count == 0
+
+
+async def body_chunks(body: bytes, size: int = 7):
+    """按固定大小切分请求体，让行跨越多个字节块"""
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def ndjson_body(entries) -> bytes:
+    return "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode()
+
+
+ENTRIES = [
+    {"role": "user", "content": "我出生在一个小镇"},
+    {"role": "assistant", "content": "能讲讲小镇的样子吗？", "timestamp": "2024-01-01T00:00:00"},
+    {"role": "user", "content": "镇上有一条河"},
+]
+
+
+@pytest.mark.asyncio
+async def test_import_dialogue_stream_validates_in_batches(service):
+    body = ndjson_body(ENTRIES[:1]) + b"\n" + ndjson_body(ENTRIES[1:])
+    unit_id = await service.import_dialogue_stream(iter_lines(body_chunks(body)), batch_size=2)
+    assert unit_id == "unit-1"
+    data, unit_type = service.workflow_manager.units[0]
+    assert unit_type == "import"
+    assert [(e["role"], e["content"]) for e in data["dialogue_history"]] == [
+        (e["role"], e["content"]) for e in ENTRIES
+    ]
+    assert data["dialogue_history"][1]["timestamp"] == "2024-01-01T00:00:00"
+    assert data["dialogue_history"][0]["timestamp"]
+
+
+@pytest.mark.asyncio
+async def test_import_dialogue_stream_without_trailing_newline(service):
+    body = ndjson_body(ENTRIES).rstrip(b"\n")
+    await service.import_dialogue_stream(iter_lines(body_chunks(body)))
+    data, _ = service.workflow_manager.units[0]
+    assert [e["content"] for e in data["dialogue_history"]] == [e["content"] for e in ENTRIES]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bad_line, message", [
+    (b'{"role": "user"}', "第 5 行不是合法的对话条目"),
+    (b'{"role": "user", "content": ', "第 5 行不是合法的JSON"),
+])
+async def test_import_dialogue_stream_reports_line_number(service, bad_line, message):
+    """出错的条目在第二批中，行号按原始请求体计算（空行也计入）"""
+    body = ndjson_body(ENTRIES[:2]) + b"\n" + ndjson_body(ENTRIES[2:]) + bad_line + b"\n"
+    with pytest.raises(ValueError, match=message):
+        await service.import_dialogue_stream(iter_lines(body_chunks(body)), batch_size=2)
+    assert service.workflow_manager.units == []
+
+
+@pytest.mark.asyncio
+async def test_import_dialogue_stream_rejects_empty_body(service):
+    with pytest.raises(ValueError, match="对话历史为空"):
+        await service.import_dialogue_stream(iter_lines(body_chunks(b"\n\n")))
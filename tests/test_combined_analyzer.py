@@ -0,0 +1,29 @@
+import json
+import pytest
+
+from agents.combined_analyzer_agent import CombinedAnalyzerAgent
+
+
+def test_parse_valid_output():
+    """合法输出转换为段落列表，清理未知维度和空标签"""
+    output = json.dumps({"paragraphs": [
+        {"text": "那年我上小学。", "type": "事实描述",
+         "tags": {"时间维度": ["小学"], "情感维度": ["无明确体现"], "未知维度": ["x"]}},
+        {"text": "我很开心。", "type": "情感表达", "tags": {"情感维度": ["快乐"]}},
+    ]}, ensure_ascii=False)
+
+    assert CombinedAnalyzerAgent.parse(f"```json\n{output}\n```") == [
+        {"content": "那年我上小学。", "type": "事实描述", "tags": {"时间维度": ["小学"]}},
+        {"content": "我很开心。", "type": "情感表达", "tags": {"情感维度": ["快乐"]}},
+    ]
+
+
+@pytest.mark.parametrize("output", [
+    "不是JSON",
+    json.dumps({"paragraphs": []}),
+    json.dumps({"paragraphs": [{"text": "段落", "type": "未知类型"}]}, ensure_ascii=False),
+    "合并分析出错：timeout",
+])
+def test_parse_rejects_invalid_output(output):
+    with pytest.raises(ValueError):
+        CombinedAnalyzerAgent.parse(output)
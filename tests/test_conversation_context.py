@@ -0,0 +1,58 @@
+from agents.conversation_context import ConversationContext, estimate_tokens, message_tokens
+
+
+def make_history(turns):
+    history = [{"role": "system", "content": "你是一位回忆录采访者。"}]
+    for i in range(turns):
+        history.append({"role": "user", "content": f"第{i}轮，" + "我小时候住在乡下。" * 10})
+        history.append({"role": "assistant", "content": f"第{i}轮追问：" + "能多讲讲吗？" * 5})
+    return history
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("hello world!") == 3
+
+
+def test_context_stays_within_budget_and_folds_old_turns():
+    """超出预算的旧对话折叠进摘要，系统提示和最近对话原样保留"""
+    folded = []
+
+    def summarize(summary, messages):
+        folded.append(len(messages))
+        return (summary + f"[{len(messages)}条]").strip()
+
+    context = ConversationContext(summarize, max_tokens=400)
+    history = make_history(20)
+
+    messages = context.build(history)
+    assert messages[0] == history[0]
+    assert messages[-1] == history[-1]
+    assert sum(message_tokens(message) for message in messages) <= 400
+    context.wait(5)
+    assert context.summary and folded
+
+    # 摘要刷新后作为系统消息出现在最近对话之前，仍然不超预算
+    history.append({"role": "user", "content": "后来我去城里读书了。"})
+    messages = context.build(history)
+    assert messages[1]["role"] == "system" and "摘要" in messages[1]["content"]
+    assert messages[2]["role"] == "user"
+    assert messages[-1] == history[-1]
+    assert sum(message_tokens(message) for message in messages) <= 400
+
+
+def test_short_history_is_sent_verbatim():
+    context = ConversationContext(lambda summary, messages: "不应调用", max_tokens=4000)
+    history = make_history(2)
+    assert context.build(history) == history
+    context.wait(1)
+    assert context.summary == ""
+
+
+def test_reset_discards_summary():
+    context = ConversationContext(lambda summary, messages: "摘要", max_tokens=400)
+    context.build(make_history(20))
+    context.wait(5)
+    assert context.summary == "摘要"
+    context.reset()
+    assert context.summary == "" and context.summarized == 0
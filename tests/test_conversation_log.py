@@ -0,0 +1,82 @@
+import os
+
+from utils.conversation_log import ConversationLog
+
+
+def messages(session, start, count):
+    return [{"role": "user", "content": f"{session}-{i}"} for i in range(start, start + count)]
+
+
+def test_append_and_read_sessions(tmp_path):
+    """每次只追加新增消息，按会话读取"""
+    log = ConversationLog(str(tmp_path), fsync_every=2)
+    log.append("a", messages("a", 0, 2))
+    log.append("b", messages("b", 0, 1))
+    log.append("a", messages("a", 2, 1))
+
+    assert [m["content"] for m in log.read("a")] == ["a-0", "a-1", "a-2"]
+    assert log.sessions()["b"]["messages"] == 1
+    assert log.read("missing") == []
+    log.close()
+
+
+def test_index_recovered_after_restart(tmp_path):
+    """关闭后从索引快照恢复，快照之后追加的记录通过扫描恢复，末尾的半行被截掉"""
+    log = ConversationLog(str(tmp_path))
+    log.append("a", messages("a", 0, 2))
+    log.close()
+
+    log = ConversationLog(str(tmp_path))
+    log.append("a", messages("a", 2, 1))
+    log.flush()
+    # 模拟写入中途退出：不调用 close，末尾留下半行
+    with open(os.path.join(str(tmp_path), "segment_000001.jsonl"), "ab") as f:
+        f.write(b'{"session": "a", "role"')
+
+    log = ConversationLog(str(tmp_path))
+    assert [m["content"] for m in log.read("a")] == ["a-0", "a-1", "a-2"]
+    log.close()
+
+
+def test_compaction_merges_segments_and_drops_expired(tmp_path):
+    """封存的段超过上限时合并，同一会话的消息保持顺序，过期会话被删除"""
+    log = ConversationLog(str(tmp_path), segment_bytes=200, max_segments=100, retention_days=30)
+    for i in range(10):
+        log.append("a", messages("a", i, 1))
+        log.append("b", messages("b", i, 1))
+    with log._lock:
+        log._roll()  # 封存当前段，全部记录参与压缩
+    log._index["b"]["updated"] = "2000-01-01T00:00:00"
+    segments = len(log._segments)
+    assert segments > 3
+
+    log.compact()
+    assert len(log._segments) == 2
+    assert log.read("b") == []
+    assert [m["content"] for m in log.read("a")] == [f"a-{i}" for i in range(10)]
+    assert "b" not in log.sessions()
+    log.close()
+
+    log = ConversationLog(str(tmp_path))
+    assert [m["content"] for m in log.read("a")] == [f"a-{i}" for i in range(10)]
+    log.close()
+
+
+def test_compaction_snapshot_covers_buffered_records(tmp_path):
+    """压缩保存的索引快照包含当前段缓冲中的记录，异常退出后重启不会重复索引"""
+    log = ConversationLog(str(tmp_path), fsync_every=1000, fsync_interval=3600, max_segments=100)
+    log.append("s1", messages("s1", 0, 2))
+    with log._lock:
+        log._roll()
+    log.append("s2", messages("s2", 0, 1))  # 只在文件缓冲中
+    log.compact()
+    counts = {session: meta["messages"] for session, meta in log.sessions().items()}
+
+    # 模拟进程退出：缓冲写入文件，但不调用 close 保存索引
+    log._closed.set()
+    log._file.close()
+    del log
+
+    log = ConversationLog(str(tmp_path))
+    assert {session: meta["messages"] for session, meta in log.sessions().items()} == counts == {"s1": 2, "s2": 1}
+    log.close()
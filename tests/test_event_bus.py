@@ -0,0 +1,66 @@
+import json
+import pytest
+
+from utils.event_bus import EventBus, event_bus
+from utils.monitor_pool import monitor_pool
+from utils.streaming import sse_message
+
+
+@pytest.mark.asyncio
+async def test_subscribers_receive_only_their_units():
+    """按工作单元过滤事件，全量订阅者同时收到系统事件"""
+    bus = EventBus()
+    unit_sub = bus.subscribe({"unit-1"})
+    all_sub = bus.subscribe()
+
+    bus.publish("status", {"status": "processing"}, "unit-1")
+    bus.publish("status", {"status": "pending"}, "unit-2")
+    bus.publish("monitor", {"category": "system", "key": "workflows_overview"})
+
+    event = await unit_sub.get(timeout=0.1)
+    assert event["unit_id"] == "unit-1" and event["data"]["status"] == "processing"
+    assert await unit_sub.get(timeout=0.01) is None
+    assert [(await all_sub.get(timeout=0.1))["event"] for _ in range(3)] == ["status", "status", "monitor"]
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest_events():
+    """消费过慢时丢弃最旧的事件，不阻塞发布者"""
+    bus = EventBus(max_queue=2)
+    subscription = bus.subscribe()
+    for i in range(5):
+        bus.publish("log", i, "unit-1")
+
+    assert subscription.dropped == 3
+    assert [(await subscription.get(timeout=0.1))["data"] for _ in range(2)] == [3, 4]
+
+    subscription.close()
+    assert bus.subscriber_count == 0
+
+
+def test_sse_message_format():
+    message = sse_message({"text": "第一行\n第二行"}, event="status")
+    assert message.startswith("event: status\ndata: ")
+    assert message.endswith("\n\n")
+    assert json.loads(message.split("data: ", 1)[1]) == {"text": "第一行\n第二行"}
+
+
+@pytest.mark.asyncio
+async def test_monitor_events_carry_written_entries():
+    """监控点事件带有本次写入的条目，订阅者可以直接合并，不需要重新拉取"""
+    subscription = event_bus.subscribe({"unit-m"})
+    try:
+        await monitor_pool.record("workflows", "node_results", {"narrative": {"content": "叙事"}},
+                                  unit_id="unit-m", mode="merge")
+        await monitor_pool.record("workflows", "stage", "analysis", unit_id="unit-m")
+        await monitor_pool.record("workflows", "execution_log", {"node": "svg"}, unit_id="unit-m", mode="append")
+        await monitor_pool.remove_units(["unit-m"])
+
+        merge, update, log, remove = [await subscription.get(timeout=0.1) for _ in range(4)]
+        assert merge["data"] == {"category": "workflows", "key": "node_results", "mode": "merge",
+                                 "entry": {"narrative": {"content": "叙事"}}}
+        assert update["data"]["entry"]["value"] == "analysis" and update["data"]["entry"]["timestamp"]
+        assert (log["event"], log["data"]) == ("log", {"node": "svg"})
+        assert remove["data"]["mode"] == "remove"
+    finally:
+        subscription.close()
@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+
+from utils.idempotency import IdempotencyConflictError, IdempotencyStore
+from utils.tiered_cache import TieredCache
+
+
+@pytest.mark.asyncio
+async def test_retry_replays_first_response():
+    """同一个键的重试返回首次结果，并发重试只执行一次"""
+    store = IdempotencyStore(TieredCache(ttl_seconds=60))
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"unit_id": f"unit-{len(calls)}"}
+
+    results = await asyncio.gather(*[store.run("import", "key-1", {"n": 1}, compute) for _ in range(3)])
+    assert len(calls) == 1
+    assert [response for response, _ in results] == [{"unit_id": "unit-1"}] * 3
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+
+    # 不同接口的同名键互不影响
+    assert await store.run("chat", "key-1", {"n": 1}, compute) == ({"unit_id": "unit-2"}, False)
+
+    with pytest.raises(IdempotencyConflictError):
+        await store.run("import", "key-1", {"n": 2}, compute)
+
+
+@pytest.mark.asyncio
+async def test_failed_request_can_be_retried():
+    """首次请求失败时不保存结果"""
+    store = IdempotencyStore(TieredCache(ttl_seconds=60))
+
+    async def fail():
+        raise RuntimeError("queue full")
+
+    async def succeed():
+        return {"unit_id": "unit-1"}
+
+    with pytest.raises(RuntimeError):
+        await store.run("import", "key-1", {}, fail)
+    assert await store.run("import", "key-1", {}, succeed) == ({"unit_id": "unit-1"}, False)
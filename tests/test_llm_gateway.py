@@ -0,0 +1,169 @@
+import asyncio
+import json
+import threading
+import httpx
+import pytest
+
+from utils.llm_gateway import LLMError, LLMGateway
+from utils.tiered_cache import TieredCache
+
+
+class FakeProvider:
+    """本地模拟的对话补全接口，记录并发数，可以指定前几次返回的状态码"""
+
+    def __init__(self, statuses=(), delay=0.05):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.requests = []
+        self._lock = threading.Lock()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        with self._lock:
+            self.requests.append(payload)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            status = self.statuses.pop(0) if self.statuses else 200
+        await asyncio.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        if status != 200:
+            return httpx.Response(status, json={"error": {"message": "busy"}})
+        content = payload["messages"][-1]["content"]
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"echo:{content}"}}]})
+
+
+def make_gateway(provider, monkeypatch, **kwargs):
+    monkeypatch.setenv("API_KEY_CONF", "test-key")
+    return LLMGateway(transport=httpx.MockTransport(provider.handle), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limited_per_provider(monkeypatch):
+    """同一提供方的并发调用不超过配置的上限"""
+    provider = FakeProvider()
+    gateway = make_gateway(provider, monkeypatch, concurrency={"zhipu": 2})
+    try:
+        results = await asyncio.gather(*[
+            gateway.chat(model="m", messages=[{"role": "user", "content": str(i)}]) for i in range(6)
+        ])
+        assert results == [f"echo:{i}" for i in range(6)]
+        assert provider.max_running == 2
+        assert gateway.stats()["zhipu"]["completed"] == 6
+    finally:
+        gateway.close()
+
+
+def test_sync_calls_share_one_gateway(monkeypatch):
+    """多个线程的同步调用共用同一个网关，临时错误自动重试"""
+    provider = FakeProvider(statuses=[429])
+    gateway = make_gateway(provider, monkeypatch, max_retries=1)
+    try:
+        results = []
+        threads = [
+            threading.Thread(target=lambda i=i: results.append(
+                gateway.chat_sync(model="m", messages=[{"role": "user", "content": str(i)}], temperature=0.3)
+            ))
+            for i in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == ["echo:0", "echo:1", "echo:2"]
+        assert len(provider.requests) == 4 and provider.requests[0]["temperature"] == 0.3
+    finally:
+        gateway.close()
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    provider = FakeProvider(statuses=[400])
+    gateway = make_gateway(provider, monkeypatch)
+    try:
+        with pytest.raises(LLMError) as error:
+            gateway.chat_sync(model="m", messages=[{"role": "user", "content": "x"}])
+        assert error.value.status_code == 400 and len(provider.requests) == 1
+    finally:
+        gateway.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_yields_deltas(monkeypatch):
+    """流式调用按服务端事件逐段产出文本"""
+    async def handle(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        events = [
+            {"choices": [{"delta": {"role": "assistant"}}]},
+            {"choices": [{"delta": {"content": "你"}}]},
+            {"choices": [{"delta": {"content": "好"}}]},
+        ]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+    monkeypatch.setenv("API_KEY_CONF", "test-key")
+    gateway = LLMGateway(transport=httpx.MockTransport(handle))
+    try:
+        chunks = [delta async for delta in gateway.chat_stream(model="m", messages=[{"role": "user", "content": "hi"}])]
+        assert chunks == ["你", "好"]
+    finally:
+        gateway.close()
+
+
+@pytest.mark.asyncio
+async def test_low_temperature_responses_cached(monkeypatch, tmp_path):
+    """低温度的重复调用直接返回缓存，重启后仍然命中；高温度和参数不同的调用不命中"""
+    provider = FakeProvider(delay=0)
+    db_path = str(tmp_path / "llm_cache.db")
+    gateway = make_gateway(provider, monkeypatch, cache=TieredCache(db_path=db_path))
+    messages = [{"role": "user", "content": "x"}]
+    try:
+        assert await gateway.chat(model="m", messages=messages, temperature=0.3) == "echo:x"
+        assert gateway.chat_sync(model="m", messages=messages, temperature=0.3) == "echo:x"
+        assert len(provider.requests) == 1
+
+        await gateway.chat(model="m", messages=messages, temperature=0.3, response_format={"type": "json_object"})
+        await gateway.chat(model="m", messages=messages, temperature=0.7)
+        await gateway.chat(model="m", messages=messages, temperature=0.7)
+        assert len(provider.requests) == 4
+        assert gateway.cache_stats()["hits"] == 1
+    finally:
+        gateway.close()
+        gateway.cache.close()
+
+    gateway = make_gateway(provider, monkeypatch, cache=TieredCache(db_path=db_path))
+    try:
+        assert gateway.chat_sync(model="m", messages=messages, temperature=0.3) == "echo:x"
+        assert len(provider.requests) == 4
+    finally:
+        gateway.close()
+        gateway.cache.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_call_releases_provider_slot(monkeypatch):
+    """调用方取消时请求随之取消，立即释放提供方的并发名额"""
+    cancelled = threading.Event()
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return httpx.Response(200, json={"choices": [{"message": {"content": "late"}}]})
+
+    monkeypatch.setenv("API_KEY_CONF", "test-key")
+    gateway = LLMGateway(transport=httpx.MockTransport(handle), concurrency={"zhipu": 1})
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(gateway.chat(model="m", messages=[{"role": "user", "content": "x"}]), 0.1)
+        assert await asyncio.to_thread(cancelled.wait, 2)
+        for _ in range(50):
+            if not gateway._semaphores["zhipu"].locked():
+                break
+            await asyncio.sleep(0.02)
+        assert not gateway._semaphores["zhipu"].locked()
+    finally:
+        gateway.close()
@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+
+from workflow.core.node import BaseNode
+from workflow.core.scheduler import DAGScheduler
+
+
+class EchoNode(BaseNode):
+    """测试节点：记录执行顺序，可选延迟或失败"""
+
+    def __init__(self, name, inputs=None, delay=0, fail=False, trace=None):
+        super().__init__(name, inputs=inputs, outputs=[name])
+        self.delay = delay
+        self.fail = fail
+        self.trace = trace if trace is not None else []
+
+    async def _process(self, work_unit):
+        self.trace.append(f"{self.name}:start")
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} 失败")
+        self.trace.append(f"{self.name}:end")
+        return {self.name: {"content": self.name}}
+
+
+def make_unit():
+    return {"id": "unit-1", "data": {}, "results": {}, "node_states": {}}
+
+
+@pytest.mark.asyncio
+async def test_independent_nodes_start_together():
+    """依赖完成后，互不依赖的节点并行启动"""
+    trace = []
+    scheduler = DAGScheduler([
+        EchoNode("narrative", trace=trace),
+        EchoNode("svg", inputs=["narrative"], delay=0.05, trace=trace),
+        EchoNode("analysis", inputs=["narrative"], delay=0.01, trace=trace),
+    ])
+    unit = make_unit()
+    states = await scheduler.run(unit)
+
+    assert states == {"narrative": "completed", "svg": "completed", "analysis": "completed"}
+    assert trace.index("svg:start") < trace.index("analysis:end")
+    assert set(unit["results"]) == {"narrative", "svg", "analysis"}
+
+
+@pytest.mark.asyncio
+async def test_failed_node_skips_downstream_only():
+    """上游失败时跳过下游节点，不影响其他分支"""
+    events = []
+
+    async def on_event(name, event, unit, error):
+        events.append((name, event))
+
+    scheduler = DAGScheduler([
+        EchoNode("narrative"),
+        EchoNode("svg", inputs=["narrative"], fail=True),
+        EchoNode("embedding", inputs=["svg"]),
+        EchoNode("analysis", inputs=["narrative"]),
+    ])
+    unit = make_unit()
+    states = await scheduler.run(unit, on_event=on_event)
+
+    assert states["svg"] == "error"
+    assert states["embedding"] == "skipped"
+    assert states["analysis"] == "completed"
+    assert unit["node_states"]["embedding"]["status"] == "skipped"
+    assert ("embedding", "skipped") in events
+
+
+def test_invalid_graphs_rejected():
+    """缺失上游或存在环的声明会被拒绝"""
+    with pytest.raises(ValueError):
+        DAGScheduler([EchoNode("svg", inputs=["narrative"])])
+
+    with pytest.raises(ValueError):
+        DAGScheduler([EchoNode("a", inputs=["b"]), EchoNode("b", inputs=["a"])])
+
+
+@pytest.mark.asyncio
+async def test_checkpointed_nodes_are_not_rerun():
+    """检查点中的节点直接恢复，只执行缺失的节点"""
+    trace = []
+    scheduler = DAGScheduler([
+        EchoNode("narrative", trace=trace),
+        EchoNode("svg", inputs=["narrative"], trace=trace),
+        EchoNode("analysis", inputs=["narrative"], trace=trace),
+    ])
+    unit = make_unit()
+    checkpoints = {
+        "narrative": {"narrative": {"content": "已保存的叙事"}},
+        "svg": {"svg": {"content": "已保存的SVG"}},
+    }
+    states = await scheduler.run(unit, checkpoints=checkpoints)
+
+    assert states == {"narrative": "completed", "svg": "completed", "analysis": "completed"}
+    assert trace == ["analysis:start", "analysis:end"]
+    assert unit["results"]["narrative"]["content"] == "已保存的叙事"
+    assert unit["node_states"]["svg"]["restored"] is True
+
+
+@pytest.mark.asyncio
+async def test_node_timeout_fails_node():
+    """超过执行期限的节点以错误结束，下游被跳过"""
+    slow = EchoNode("narrative", delay=1)
+    slow.timeout = 0.05
+    scheduler = DAGScheduler([slow, EchoNode("svg", inputs=["narrative"])])
+    unit = make_unit()
+    states = await scheduler.run(unit)
+
+    assert states == {"narrative": "error", "svg": "skipped"}
+    assert "超时" in unit["node_states"]["narrative"]["error"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_marks_running_and_pending_nodes():
+    """取消运行中的工作单元时，运行中和未启动的节点都记录为已取消"""
+    scheduler = DAGScheduler([
+        EchoNode("narrative", delay=1),
+        EchoNode("svg", inputs=["narrative"]),
+    ])
+    unit = make_unit()
+    task = asyncio.create_task(scheduler.run(unit))
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert unit["node_states"]["narrative"]["status"] == "cancelled"
+    assert unit["node_states"]["svg"]["status"] == "cancelled"
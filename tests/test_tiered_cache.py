@@ -0,0 +1,79 @@
+import threading
+import time
+
+from utils.tiered_cache import TieredCache, content_hash
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """内存层淘汰或重启后从磁盘层读取"""
+    db_path = str(tmp_path / "cache.db")
+    cache = TieredCache(db_path, memory_items=1)
+    cache.set("k1", {"content": "叙事"})
+    cache.set("k2", ["page"])
+    assert "k1" not in cache._memory
+    assert cache.get("k1") == {"content": "叙事"}
+    cache.close()
+
+    reopened = TieredCache(db_path)
+    assert reopened.get("k2") == ["page"]
+    assert reopened.stats()["hits"] == 1
+    reopened.close()
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = TieredCache(str(tmp_path / "cache.db"), ttl_seconds=0.01)
+    cache.set("k", "v")
+    time.sleep(0.02)
+    assert cache.get("k") is None
+    cache.close()
+
+
+def test_disk_size_cap(tmp_path):
+    """磁盘条目超过上限时删除最久未访问的条目"""
+    cache = TieredCache(str(tmp_path / "cache.db"), memory_items=1, max_items=50)
+    for i in range(200):
+        cache.set(f"k{i}", i)
+    cache.flush()
+    count = cache._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    assert count <= 150
+    assert cache.get("k199") == 199
+    cache.close()
+
+
+def test_disk_reads_do_not_wait_for_writer(tmp_path):
+    """写线程提交一批数据时，磁盘读取和写入都不等待；访问时间由写线程批量更新"""
+    cache = TieredCache(str(tmp_path / "cache.db"), memory_items=1)
+    cache.set("k1", "v1")
+    cache.set("k2", "v2")
+    cache.flush()
+    accessed_at = cache._conn.execute("SELECT accessed_at FROM cache WHERE key = 'k1'").fetchone()[0]
+
+    results = []
+    with cache._db_lock:  # 模拟写线程正在提交一批数据
+        reader = threading.Thread(target=lambda: results.append((cache.get("k1"), cache.set("k3", "v3"))))
+        reader.start()
+        reader.join(timeout=2)
+        assert results == [("v1", None)]
+        assert cache.get("k3") == "v3"
+
+    cache.flush()
+    rows = dict(cache._conn.execute("SELECT key, accessed_at FROM cache").fetchall())
+    assert set(rows) == {"k1", "k2", "k3"}
+    assert rows["k1"] > accessed_at
+    cache.close()
+
+
+def test_unwritten_entries_are_readable(tmp_path):
+    """内存层已淘汰、尚未写入磁盘的条目从待写队列读取"""
+    cache = TieredCache(str(tmp_path / "cache.db"), memory_items=1)
+    with cache._db_lock:
+        cache.set("k1", {"content": "叙事"})
+        cache.set("k2", "v2")
+        assert "k1" not in cache._memory
+        assert cache.get("k1") == {"content": "叙事"}
+    cache.close()
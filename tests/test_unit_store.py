@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+from workflow.core.unit_store import TieredUnitStore, MemoryUnitStore
+
+
+def make_unit(unit_id, status="completed"):
+    return {
+        "id": unit_id,
+        "type": "import",
+        "status": status,
+        "create_time": datetime.now().isoformat(),
+        "data": {"dialogue_history": [{"role": "user", "content": "你好"}], "create_time": datetime.now()},
+        "results": {},
+        "node_states": {},
+        "error": None
+    }
+
+
+def test_tiered_store_lazy_loads_after_eviction(tmp_path):
+    """热层淘汰后可从磁盘层懒加载，重启后数据仍在"""
+    db_path = str(tmp_path / "workflow.db")
+    store = TieredUnitStore(db_path, hot_capacity=2)
+    for i in range(5):
+        store.save(make_unit(f"u{i}"))
+
+    assert len(store._hot) == 2
+    unit = store.get("u0")
+    assert unit["data"]["dialogue_history"][0]["content"] == "你好"
+    store.close()
+
+    reopened = TieredUnitStore(db_path, hot_capacity=2)
+    assert "u4" in reopened
+    assert len(reopened) == 5
+    reopened.close()
+
+
+def test_tiered_store_keeps_active_units_hot(tmp_path):
+    """处理中的工作单元不会被热层淘汰"""
+    store = TieredUnitStore(str(tmp_path / "workflow.db"), hot_capacity=1)
+    active = make_unit("active", status="processing")
+    store.save(active)
+    store.save(make_unit("done"))
+
+    assert store.get("active") is active
+    store.close()
+
+
+def test_purge_respects_ttl_and_size_budget(tmp_path):
+    """按TTL和容量清理，活动工作单元不受影响"""
+    store = TieredUnitStore(str(tmp_path / "workflow.db"), ttl_seconds=60, max_units=2)
+    store.save(make_unit("running", status="processing"))
+    for i in range(3):
+        store.save(make_unit(f"u{i}"))
+
+    deleted = store.purge()
+    assert deleted == ["u0", "u1"]
+    assert set(store.statuses()) == {"running", "u2"}
+
+    time.sleep(0.01)
+    assert store.purge(max_age_seconds=0) == ["u2"]
+    assert "running" in store
+    store.close()
+
+
+def test_memory_store_purge():
+    """内存存储同样遵守容量预算"""
+    store = MemoryUnitStore(max_units=1)
+    store.save(make_unit("a"))
+    store.save(make_unit("b"))
+    assert store.purge() == ["a"]
+    assert store.get("b") is not None
+
+
+def test_status_only_saves_keep_payload(tmp_path):
+    """只有状态变化时不重写 data / results；排队合并的写入中有一次改变 results 时仍会写入"""
+    db_path = str(tmp_path / "workflow.db")
+    store = TieredUnitStore(db_path)
+    unit = make_unit("u1", status="processing")
+    store.save(unit)
+    store.flush()
+    payload = store._conn.execute("SELECT payload FROM work_units WHERE id = 'u1'").fetchone()[0]
+
+    unit["node_states"] = {"narrative": {"status": "processing"}}
+    store.save(unit, payload=False)
+    store.flush()
+    assert store._conn.execute("SELECT payload FROM work_units WHERE id = 'u1'").fetchone()[0] == payload
+
+    # 写线程忙时两次保存合并为一次写入
+    with store._db_lock:
+        unit["results"] = {"narrative": {"content": "叙事"}}
+        store.save(unit)
+        unit["status"] = "completed"
+        store.save(unit, payload=False)
+    store.close()
+
+    reopened = TieredUnitStore(db_path)
+    unit = reopened.get("u1")
+    assert unit["status"] == "completed"
+    assert unit["node_states"] == {"narrative": {"status": "processing"}}
+    assert unit["results"] == {"narrative": {"content": "叙事"}}
+    assert reopened.statuses() == {"u1": "completed"}
+    reopened.close()
+
+
+def test_reads_rows_written_by_previous_version(tmp_path):
+    """兼容旧版本整行保存的工作单元"""
+    db_path = str(tmp_path / "workflow.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE work_units (
+            id TEXT PRIMARY KEY, type TEXT, status TEXT, create_time TEXT, updated_at REAL, payload TEXT NOT NULL
+        )
+    """)
+    unit = make_unit("old", status="failed")
+    unit["data"]["create_time"] = unit["data"]["create_time"].isoformat()
+    conn.execute(
+        "INSERT INTO work_units VALUES (?, ?, ?, ?, ?, ?)",
+        ("old", "import", "failed", unit["create_time"], time.time(), json.dumps(unit))
+    )
+    conn.commit()
+    conn.close()
+
+    store = TieredUnitStore(db_path)
+    loaded = store.get("old")
+    assert loaded["status"] == "failed"
+    loaded["status"] = "pending"
+    store.save(loaded, payload=False)
+    store.close()
+
+    reopened = TieredUnitStore(db_path)
+    assert reopened.get("old")["status"] == "pending"
+    assert reopened.get("old")["data"]["dialogue_history"][0]["content"] == "你好"
+    reopened.close()
+
+
+def test_query_filters_and_pages(tmp_path):
+    """按状态、类型和创建时间过滤分页，从新到旧排序；待写入和已写入磁盘的工作单元结果一致"""
+    tiered = TieredUnitStore(str(tmp_path / "workflow.db"))
+    memory = MemoryUnitStore()
+    for store in (tiered, memory):
+        for i in range(6):
+            unit = make_unit(f"u{i}", status="completed" if i % 2 else "failed")
+            unit["type"] = "realtime" if i < 3 else "import"
+            unit["create_time"] = f"2026-01-0{i + 1}T00:00:00"
+            store.save(unit)
+
+    for store in (tiered, memory):
+        assert store.query() == (6, ["u5", "u4", "u3", "u2", "u1", "u0"])
+        assert store.query(statuses=("completed",), offset=1, limit=2) == (3, ["u3", "u1"])
+        assert store.query(unit_type="import", until="2026-01-05T00:00:00") == (2, ["u4", "u3"])
+        assert store.query(since="2026-01-03", statuses=("failed", "pending")) == (2, ["u4", "u2"])
+
+    tiered.flush()
+    assert tiered.query(statuses=("completed",), offset=1, limit=2) == (3, ["u3", "u1"])
+    # 状态更新不论是否已写入磁盘都能查到
+    unit = tiered.get("u1")
+    unit["status"] = "failed"
+    tiered.save(unit, payload=False)
+    assert tiered.query(statuses=("completed",)) == (2, ["u5", "u3"])
+    tiered.close()
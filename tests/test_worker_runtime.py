@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import time
+
+from workflow.core.worker_runtime import WorkerRuntime
+
+
+def test_units_share_long_lived_loops():
+    """多个工作单元在固定数量的事件循环上并发运行"""
+    initialized = []
+    runtime = WorkerRuntime(
+        num_loops=2,
+        thread_initializer=lambda: initialized.append(threading.current_thread().name)
+    )
+
+    loops = set()
+
+    async def unit():
+        loops.add(id(asyncio.get_running_loop()))
+        await asyncio.sleep(0.1)
+        return "done"
+
+    start = time.monotonic()
+    futures = [runtime.submit(unit) for _ in range(20)]
+    results = [future.result(timeout=5) for future in futures]
+    elapsed = time.monotonic() - start
+
+    assert results == ["done"] * 20
+    assert len(loops) == 2
+    assert len(initialized) == 2
+    # 20个单元并发运行，总耗时远小于串行的2秒
+    assert elapsed < 1.0
+    assert runtime.load() == [0, 0]
+    runtime.shutdown(wait=True)
+
+
+def test_cancel_releases_slot():
+    """取消的工作单元立即释放负载计数"""
+    runtime = WorkerRuntime(num_loops=1)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    future = runtime.submit(hang)
+    time.sleep(0.05)
+    assert runtime.load() == [1]
+    future.cancel()
+    time.sleep(0.05)
+    assert runtime.load() == [0]
+    runtime.shutdown(wait=True)
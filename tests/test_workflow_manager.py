@@ -0,0 +1,349 @@
+import asyncio
+import threading
+import pytest
+
+from workflow.core.admission import AdmissionQueue
+from workflow.core.unit_store import MemoryUnitStore
+from workflow.core.workflow_manager import WorkflowManager, FINISHED_STATUSES
+from utils.event_bus import event_bus
+from utils.monitor_pool import monitor_pool
+
+
+class FakeWorkflow:
+    """替代 WorkflowThread.process：记录每个单元收到的对话，叙事为已有叙事加上新增对话
+
+    - fail_on: 对话中包含这些内容时处理失败
+    - hold: 对话中包含这些内容时一直等待，直到 release 被设置
+    - svg: 设置时作为SVG页面列表放入结果
+    """
+
+    def __init__(self):
+        self.inputs = {}
+        self.offsets = {}  # 每个单元的对话在会话中的起始位置
+        self.fail_on = set()
+        self.hold = set()
+        self.release = threading.Event()
+        self.svg = None
+
+    async def process(self, work_unit, status_callback=None, checkpoints=None, checkpoint_callback=None):
+        dialogue = [turn["content"] for turn in work_unit["data"]["dialogue_history"]]
+        self.inputs.setdefault(work_unit["id"], []).append(dialogue)
+        self.offsets[work_unit["id"]] = work_unit["data"].get("dialogue_offset")
+        if self.hold & set(dialogue):
+            await status_callback(work_unit["id"], {"node_states": {"narrative": {"status": "processing"}}})
+            while not self.release.is_set():
+                await asyncio.sleep(0.01)
+        if self.fail_on & set(dialogue):
+            return {"status": "failed", "results": {}, "node_states": {}, "error": "模拟失败"}
+
+        previous = work_unit["data"].get("previous_narrative")
+        narrative = " ".join(([previous] if previous else []) + dialogue)
+        results = {"narrative": {"content": narrative}}
+        if self.svg is not None:
+            results["svg"] = {"content": self.svg, "type": "memory_tree", "metadata": {}}
+        return {
+            "status": "completed",
+            "results": results,
+            "node_states": {"narrative": {"status": "completed"}},
+            "error": None
+        }
+
+
+@pytest.fixture
+def workflow():
+    return FakeWorkflow()
+
+
+@pytest.fixture
+def manager(workflow):
+    manager = WorkflowManager(store=MemoryUnitStore())
+    manager.workflow_thread.process = workflow.process
+    yield manager
+    manager._runtime.shutdown(wait=True)
+
+
+@pytest.fixture
+def single_slot_manager(workflow):
+    """同时只运行一个工作单元，后续单元在准入队列中排队"""
+    manager = WorkflowManager(store=MemoryUnitStore(), admission=AdmissionQueue(max_running=1))
+    manager.workflow_thread.process = workflow.process
+    yield manager
+    workflow.release.set()
+    manager._runtime.shutdown(wait=True)
+
+
+def turns(start, end):
+    return [{"role": "user", "content": f"m{i}"} for i in range(start, end)]
+
+
+async def create(manager, session_id, start, end):
+    data = {"dialogue_history": turns(start, end), "session_id": session_id, "watermark": start}
+    return await manager.create_work_unit(data, "realtime")
+
+
+async def wait_finished(manager, unit_id, timeout=5.0):
+    for _ in range(int(timeout / 0.02)):
+        status = await manager.get_unit_status(unit_id)
+        if status["status"] in FINISHED_STATUSES:
+            return status
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"工作单元 {unit_id} 未在 {timeout} 秒内结束")
+
+
+def names(start, end):
+    return [f"m{i}" for i in range(start, end)]
+
+
+async def collect_pages(manager, unit_id):
+    return [page async for page in manager.iter_svg_pages(unit_id)]
+
+
+@pytest.mark.asyncio
+async def test_realtime_unit_processes_only_its_delta(manager, workflow):
+    """后续单元只处理自己的新增对话，并在已有叙事上续写"""
+    first = await create(manager, "s", 0, 3)
+    assert (await wait_finished(manager, first))["status"] == "completed"
+    second = await create(manager, "s", 3, 6)
+    assert (await wait_finished(manager, second))["status"] == "completed"
+
+    assert workflow.inputs[first] == [names(0, 3)]
+    assert workflow.inputs[second] == [names(3, 6)]
+    assert workflow.offsets[second] == 3
+    session = manager._sessions["s"]
+    assert session["watermark"] == 6
+    assert session["narrative"] == " ".join(names(0, 6))
+
+
+@pytest.mark.asyncio
+async def test_stale_unit_is_superseded_and_absorbed(manager, workflow):
+    """叙事尚未生成的旧单元被新单元取代，新单元处理两者的对话"""
+    workflow.hold.add("m0")
+    stale = await create(manager, "s", 0, 3)
+    for _ in range(250):
+        if stale in workflow.inputs:
+            break
+        await asyncio.sleep(0.02)
+
+    newer = await create(manager, "s", 3, 6)
+    workflow.release.set()
+    stale_status = await wait_finished(manager, stale)
+    assert stale_status["status"] == "superseded"
+    assert stale_status["superseded_by"] == newer
+    assert (await wait_finished(manager, newer))["status"] == "completed"
+
+    assert workflow.inputs[newer] == [names(0, 6)]
+    assert manager._sessions["s"]["watermark"] == 6
+
+
+@pytest.mark.asyncio
+async def test_failed_first_unit_turns_are_not_lost(manager, workflow):
+    """会话的第一个单元失败时，下一个单元补上它的对话；之后不能再重试失败的单元"""
+    workflow.fail_on.add("m0")
+    first = await create(manager, "s", 0, 6)
+    assert (await wait_finished(manager, first))["status"] == "failed"
+
+    workflow.fail_on.clear()
+    second = await create(manager, "s", 6, 12)
+    assert (await wait_finished(manager, second))["status"] == "completed"
+    assert workflow.inputs[second] == [names(0, 12)]
+    assert workflow.offsets[second] == 0
+    assert manager._sessions["s"]["watermark"] == 12
+
+    # 后续单元已经提交了这些对话，不允许重试，会话进度不变
+    with pytest.raises(ValueError):
+        await manager.retry_unit(first)
+    assert (await manager.get_unit_status(first))["status"] == "failed"
+    assert workflow.inputs[first] == [names(0, 6)]
+    session = manager._sessions["s"]
+    assert session["watermark"] == 12
+    assert session["narrative"] == " ".join(names(0, 12))
+
+
+@pytest.mark.asyncio
+async def test_failed_middle_unit_turns_are_not_lost(manager, workflow):
+    """中间的单元失败时，下一个单元从上次提交的位置补齐对话"""
+    first = await create(manager, "s", 0, 3)
+    assert (await wait_finished(manager, first))["status"] == "completed"
+
+    workflow.fail_on.add("m3")
+    second = await create(manager, "s", 3, 6)
+    assert (await wait_finished(manager, second))["status"] == "failed"
+
+    workflow.fail_on.clear()
+    third = await create(manager, "s", 6, 9)
+    assert (await wait_finished(manager, third))["status"] == "completed"
+    assert workflow.inputs[third] == [names(3, 9)]
+    assert workflow.offsets[third] == 3
+    assert manager._sessions["s"]["narrative"] == " ".join(names(0, 9))
+
+
+@pytest.mark.asyncio
+async def test_cleanup_removes_monitor_data(manager, workflow):
+    """清理工作单元时一并删除监控池中的执行日志和节点结果"""
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import")
+    assert (await wait_finished(manager, unit_id))["status"] == "completed"
+    await monitor_pool.record(
+        category="workflows", key="node_results", value={"narrative": {"content": "叙事"}},
+        unit_id=unit_id, mode="merge"
+    )
+    assert await monitor_pool.get_data(unit_id=unit_id)
+
+    await manager.cleanup_old_units(max_age_hours=0)
+    assert await manager.get_unit_status(unit_id) is None
+    assert await monitor_pool.get_data(unit_id=unit_id) == {}
+
+
+@pytest.mark.asyncio
+async def test_reloading_snapshot_does_not_publish(manager, workflow):
+    """缓存未命中时从存储补建快照，不递增版本号也不推送事件"""
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import")
+    version = (await wait_finished(manager, unit_id))["version"]
+
+    manager._snapshots.pop(unit_id)
+    subscription = event_bus.subscribe({unit_id})
+    try:
+        snapshot = await manager.get_unit_status(unit_id)
+        assert snapshot["status"] == "completed"
+        assert snapshot["version"] == 1 < version
+        assert await subscription.get(timeout=0.05) is None
+
+        # 之后真正的状态变化照常推送
+        manager._save(manager.work_units.get(unit_id), payload=False)
+        event = await subscription.get(timeout=0.1)
+        assert event["event"] == "status" and event["data"]["version"] == 2
+    finally:
+        subscription.close()
+
+
+@pytest.mark.asyncio
+async def test_list_units_filters_by_type(manager, workflow):
+    """按类型过滤时由存储分页，只返回当前页的快照"""
+    imports = [await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import") for _ in range(3)]
+    realtime = await create(manager, "s", 0, 2)
+    for unit_id in imports + [realtime]:
+        await wait_finished(manager, unit_id)
+
+    listed = manager.list_units(unit_type="import", limit=2)
+    assert listed["total"] == 3
+    assert len(listed["items"]) == 2
+    assert {item["type"] for item in listed["items"]} == {"import"}
+    assert manager.list_units(status="completed", unit_type="realtime")["items"][0]["id"] == realtime
+    assert manager.list_units(status="active", unit_type="realtime")["total"] == 0
+
+
+@pytest.mark.asyncio
+async def test_svg_pages_are_served_one_at_a_time(manager, workflow):
+    """状态中带有SVG页数，按页码获取SVG，页码超出范围时抛出 IndexError"""
+    workflow.svg = ["<svg>1</svg>", "<svg>2</svg>"]
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import")
+    status = await wait_finished(manager, unit_id)
+    assert status["svg_ready"] and status["svg_pages"] == 2
+
+    first = await manager.get_svg_result(unit_id)
+    assert (first["content"], first["page"], first["page_count"]) == ("<svg>1</svg>", 1, 2)
+    assert (await manager.get_svg_result(unit_id, page=2))["content"] == "<svg>2</svg>"
+    for page in (0, 3):
+        with pytest.raises(IndexError):
+            await manager.get_svg_result(unit_id, page=page)
+
+
+@pytest.mark.asyncio
+async def test_unit_without_svg_reports_no_pages(manager, workflow):
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import")
+    status = await wait_finished(manager, unit_id)
+    assert not status["svg_ready"] and status["svg_pages"] == 0
+    assert await manager.get_svg_result(unit_id) is None
+
+
+@pytest.mark.asyncio
+async def test_iter_svg_pages_waits_for_svg(manager, workflow):
+    """SVG尚未生成时等待，生成后逐页产出"""
+    workflow.svg = ["<svg>1</svg>", "<svg>2</svg>"]
+    workflow.hold.add("m0")
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import")
+    collecting = asyncio.ensure_future(collect_pages(manager, unit_id))
+    await asyncio.sleep(0.1)
+    assert not collecting.done()
+
+    workflow.release.set()
+    pages = await asyncio.wait_for(collecting, timeout=5)
+    assert pages == [
+        {"page": 1, "page_count": 2, "content": "<svg>1</svg>"},
+        {"page": 2, "page_count": 2, "content": "<svg>2</svg>"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_iter_svg_pages_fails_when_unit_ends_without_svg(manager, workflow):
+    """工作单元结束但没有生成SVG时抛出 RuntimeError，不存在的工作单元抛出 KeyError"""
+    workflow.fail_on.add("m0")
+    workflow.hold.add("m0")
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 2)}, "import")
+    collecting = asyncio.ensure_future(collect_pages(manager, unit_id))
+    await asyncio.sleep(0.1)
+    workflow.release.set()
+    with pytest.raises(RuntimeError, match="模拟失败"):
+        await asyncio.wait_for(collecting, timeout=5)
+
+    with pytest.raises(KeyError):
+        await collect_pages(manager, "missing")
+
+
+async def wait_processing(workflow, unit_id):
+    for _ in range(250):
+        if unit_id in workflow.inputs:
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"工作单元 {unit_id} 未开始处理")
+
+
+@pytest.mark.asyncio
+async def test_cancel_running_unit_frees_slot(single_slot_manager, workflow):
+    """取消处理中的工作单元：未结束的节点记为已取消，名额立即交给排队的单元"""
+    manager = single_slot_manager
+    workflow.hold.add("m0")
+    running = await manager.create_work_unit({"dialogue_history": turns(0, 1)}, "import")
+    await wait_processing(workflow, running)
+    queued = await manager.create_work_unit({"dialogue_history": turns(1, 2)}, "import")
+    assert (await manager.get_unit_status(queued))["status"] == "pending"
+
+    result = await manager.cancel_unit(running)
+    assert result["status"] == "cancelled"
+    assert "narrative" in result["cancelled_nodes"]
+    assert (await wait_finished(manager, queued))["status"] == "completed"
+
+    status = await manager.get_unit_status(running)
+    assert status["status"] == "cancelled"
+    assert status["node_states"]["narrative"]["status"] == "cancelled"
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_unit_is_never_processed(single_slot_manager, workflow):
+    manager = single_slot_manager
+    workflow.hold.add("m0")
+    running = await manager.create_work_unit({"dialogue_history": turns(0, 1)}, "import")
+    await wait_processing(workflow, running)
+    queued = await manager.create_work_unit({"dialogue_history": turns(1, 2)}, "import")
+
+    assert (await manager.cancel_unit(queued))["status"] == "cancelled"
+    workflow.release.set()
+    assert (await wait_finished(manager, running))["status"] == "completed"
+    assert (await manager.get_unit_status(queued))["status"] == "cancelled"
+    assert queued not in workflow.inputs
+
+
+@pytest.mark.asyncio
+async def test_cancel_finished_or_unknown_unit(manager, workflow):
+    """已结束或已取消的工作单元不能取消，不存在的工作单元返回None"""
+    unit_id = await manager.create_work_unit({"dialogue_history": turns(0, 1)}, "import")
+    assert (await wait_finished(manager, unit_id))["status"] == "completed"
+    with pytest.raises(ValueError):
+        await manager.cancel_unit(unit_id)
+
+    workflow.hold.add("m1")
+    held = await manager.create_work_unit({"dialogue_history": turns(1, 2)}, "import")
+    await manager.cancel_unit(held)
+    with pytest.raises(ValueError):
+        await manager.cancel_unit(held)
+
+    assert await manager.cancel_unit("missing") is None
@@ -0,0 +1,322 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import json
+import os
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_NAME = re.compile(r"^segment_(\d{6})\.jsonl$")
+
+
+class ConversationLog:
+    """追加写的对话日志
+
+    - 所有会话写入同一组 JSONL 段文件，每行一条消息 {"session", "role", "content", "time"}，
+      每轮对话只追加新增的消息，写入开销与历史长度无关
+    - 写入先进入文件缓冲，累计 fsync_every 条或超过 fsync_interval 秒后统一 fsync
+    - 当前段超过 segment_bytes 时封存并开始新段；封存的段超过 max_segments 个时在后台压缩：
+      删除超过保留期的会话，把同一会话的消息合并到一起写入一个新段
+    - 内存索引记录每个会话的消息位置 {session: [(段号, 偏移)]}，读取会话时只读取相关行；
+      索引快照在压缩和关闭时保存，启动时加载快照后只扫描快照之后追加的部分
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 fsync_every: int = 32, fsync_interval: float = 1.0,
+                 max_segments: int = 8, retention_days: Optional[float] = 30):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.max_segments = max_segments
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = {}  # {session: {"created", "updated", "locations"}}
+        self._segments: List[int] = []
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._compacting: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._open_active()
+        self._flusher = threading.Thread(target=self._flush_loop, name="conversation-log", daemon=True)
+        self._flusher.start()
+
+    # ---------- 段文件与索引 ----------
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment_{segment:06d}.jsonl")
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _load(self):
+        """加载索引快照，并扫描快照之后追加的记录"""
+        self._segments = sorted(
+            int(match.group(1)) for match in map(_SEGMENT_NAME.match, os.listdir(self.directory)) if match
+        )
+        covered: Dict[int, int] = {}
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if set(map(int, snapshot["segments"])) <= set(self._segments):
+                covered = {int(segment): size for segment, size in snapshot["segments"].items()}
+                self._index = {
+                    session: {**meta, "locations": [tuple(location) for location in meta["locations"]]}
+                    for session, meta in snapshot["sessions"].items()
+                }
+        except (OSError, ValueError, KeyError):
+            pass
+
+        for segment in self._segments:
+            self._scan(segment, covered.get(segment, 0))
+
+    def _scan(self, segment: int, start: int):
+        """从指定偏移开始扫描段文件，把记录加入索引；末尾不完整的行被截掉"""
+        path = self._path(segment)
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    self._add_location(record["session"], record.get("time"), (segment, offset))
+                except (ValueError, KeyError):
+                    logger.warning(f"对话日志记录损坏: {path}@{offset}")
+                offset += len(line)
+        if offset < os.path.getsize(path):
+            # 上次写入中途退出留下的半行
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def _add_location(self, session: str, timestamp: Optional[str], location: Tuple[int, int]):
+        meta = self._index.get(session)
+        if meta is None:
+            meta = self._index[session] = {"created": timestamp, "updated": timestamp, "locations": []}
+        meta["updated"] = timestamp
+        meta["locations"].append(location)
+
+    def _open_active(self):
+        if not self._segments:
+            self._segments.append(1)
+        self._file = open(self._path(self._segments[-1]), "ab")
+
+    def _save_index(self):
+        """保存索引快照（调用方持有锁）"""
+        snapshot = {
+            "segments": {str(segment): os.path.getsize(self._path(segment)) for segment in self._segments},
+            "sessions": self._index
+        }
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self._index_path)
+
+    # ---------- 写入 ----------
+
+    def append(self, session: str, messages: List[Dict[str, Any]]):
+        """追加一个会话的新消息"""
+        if not messages:
+            return
+        now = datetime.now().isoformat()
+        with self._lock:
+            segment = self._segments[-1]
+            for message in messages:
+                line = json.dumps(
+                    {"session": session, "role": message.get("role"), "content": message.get("content"), "time": now},
+                    ensure_ascii=False
+                ).encode("utf-8") + b"\n"
+                offset = self._file.tell()
+                self._file.write(line)
+                self._add_location(session, now, (segment, offset))
+            self._unsynced += len(messages)
+            if self._unsynced >= self.fsync_every:
+                self._sync()
+            if self._file.tell() >= self.segment_bytes:
+                self._roll()
+
+    def _sync(self):
+        """flush 并 fsync 当前段（调用方持有锁）"""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _roll(self):
+        """封存当前段并开始新段（调用方持有锁）"""
+        self._sync()
+        self._file.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._file = open(self._path(self._segments[-1]), "ab")
+        if len(self._segments) - 1 > self.max_segments:
+            self._start_compaction()
+
+    def flush(self):
+        """立即把缓冲的记录写入磁盘"""
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+
+    # ---------- 读取 ----------
+
+    def read(self, session: str) -> List[Dict[str, Any]]:
+        """读取会话的全部消息 [{"role", "content", "time"}]"""
+        # 在锁内读取，避免与压缩替换段文件冲突
+        with self._lock:
+            meta = self._index.get(session)
+            if meta is None:
+                return []
+            if self._unsynced:
+                self._file.flush()
+
+            messages = []
+            handles = {}
+            try:
+                for segment, offset in meta["locations"]:
+                    if segment not in handles:
+                        handles[segment] = open(self._path(segment), "rb")
+                    f = handles[segment]
+                    f.seek(offset)
+                    record = json.loads(f.readline())
+                    messages.append({"role": record["role"], "content": record["content"], "time": record["time"]})
+            finally:
+                for f in handles.values():
+                    f.close()
+            return messages
+
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """所有会话的概要 {session: {"created", "updated", "messages"}}"""
+        with self._lock:
+            return {
+                session: {"created": meta["created"], "updated": meta["updated"], "messages": len(meta["locations"])}
+                for session, meta in self._index.items()
+            }
+
+    # ---------- 压缩 ----------
+
+    def _start_compaction(self):
+        if self._compacting is not None and self._compacting.is_alive():
+            return
+        self._compacting = threading.Thread(target=self.compact, name="conversation-log-compact", daemon=True)
+        self._compacting.start()
+
+    def compact(self):
+        """压缩已封存的段：删除过期会话，按会话合并消息，写入编号最小的段位置"""
+        with self._lock:
+            sealed = self._segments[:-1]
+            if not sealed:
+                return
+            sealed_set = set(sealed)
+            cutoff = (
+                (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+                if self.retention_days is not None else None
+            )
+            plan = {
+                session: [location for location in meta["locations"] if location[0] in sealed_set]
+                for session, meta in self._index.items()
+            }
+            expired = {
+                session for session, meta in self._index.items()
+                if cutoff is not None and (meta["updated"] or "") < cutoff
+            }
+
+        # 在锁外读取和写入封存的段，当前段的追加不受影响
+        target = sealed[0]
+        tmp = self._path(target) + ".compact"
+        moved: Dict[str, List[Tuple[int, int]]] = {}
+        handles = {segment: open(self._path(segment), "rb") for segment in sealed}
+        try:
+            with open(tmp, "wb") as out:
+                for session, locations in plan.items():
+                    if session in expired or not locations:
+                        continue
+                    moved[session] = []
+                    for segment, offset in locations:
+                        f = handles[segment]
+                        f.seek(offset)
+                        moved[session].append((target, out.tell()))
+                        out.write(f.readline())
+                out.flush()
+                os.fsync(out.fileno())
+        finally:
+            for f in handles.values():
+                f.close()
+
+        with self._lock:
+            # 先删除旧的索引快照，替换段文件中途退出时重启会重新扫描全部段
+            if os.path.exists(self._index_path):
+                os.remove(self._index_path)
+            os.replace(tmp, self._path(target))
+            for segment in sealed[1:]:
+                os.remove(self._path(segment))
+            self._segments = [target] + [segment for segment in self._segments if segment not in sealed_set]
+            for session in list(self._index):
+                meta = self._index[session]
+                newer = [location for location in meta["locations"] if location[0] not in sealed_set]
+                if session in expired and not newer:
+                    del self._index[session]
+                    continue
+                meta["locations"] = moved.get(session, []) + newer
+            # 快照记录的当前段大小必须包含缓冲中的记录，否则重启后会重复扫描这些记录
+            self._sync()
+            self._save_index()
+        logger.info(f"对话日志压缩完成: 合并 {len(sealed)} 个段，删除过期会话 {len(expired)} 个")
+
+    def close(self):
+        """写入剩余记录并保存索引"""
+        self._closed.set()
+        compacting = self._compacting
+        if compacting is not None:
+            compacting.join()
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+            self._save_index()
+
+
+_log: Optional[ConversationLog] = None
+_log_lock = threading.Lock()
+
+
+def get_conversation_log() -> ConversationLog:
+    """获取全局对话日志（首次使用时按环境变量创建）
+
+    - CONVERSATION_LOG_DIR: 日志目录，默认 logs/conversations
+    - CONVERSATION_LOG_SEGMENT_MB: 单个段文件的大小上限（MB），默认16
+    - CONVERSATION_LOG_FSYNC_EVERY: 累计多少条记录 fsync 一次，默认32
+    - CONVERSATION_LOG_FSYNC_INTERVAL: 最长多少秒 fsync 一次，默认1
+    - CONVERSATION_LOG_MAX_SEGMENTS: 封存的段超过该数量时压缩，默认8
+    - CONVERSATION_LOG_RETENTION_DAYS: 会话保留天数，压缩时删除过期会话，默认30
+    """
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = ConversationLog(
+                directory=os.getenv("CONVERSATION_LOG_DIR", "logs/conversations"),
+                segment_bytes=int(float(os.getenv("CONVERSATION_LOG_SEGMENT_MB", "16")) * 1024 * 1024),
+                fsync_every=int(os.getenv("CONVERSATION_LOG_FSYNC_EVERY", "32")),
+                fsync_interval=float(os.getenv("CONVERSATION_LOG_FSYNC_INTERVAL", "1")),
+                max_segments=int(os.getenv("CONVERSATION_LOG_MAX_SEGMENTS", "8")),
+                retention_days=float(os.getenv("CONVERSATION_LOG_RETENTION_DAYS", "30"))
+            )
+        return _log
@@ -0,0 +1,90 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventSubscription:
+    """事件订阅：有界队列，消费过慢时丢弃最旧的事件"""
+
+    def __init__(self, bus: "EventBus", unit_ids: Optional[Set[str]] = None, max_queue: int = 256):
+        self._bus = bus
+        self.unit_ids = unit_ids  # None 表示订阅全部事件（包括系统事件）
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.unit_ids is None:
+            return True
+        return event.get("unit_id") in self.unit_ids
+
+    def put(self, event: Dict[str, Any]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """等待下一个事件，超时返回None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """进程内事件总线：把工作流状态变化、执行日志和监控点推送给订阅者
+
+    - 只在API事件循环上使用，发布和订阅都不需要加锁
+    - 发布不等待订阅者，单个慢订阅者不会影响其他订阅者
+    """
+
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self._subscriptions: List[EventSubscription] = []
+
+    def subscribe(self, unit_ids: Optional[Set[str]] = None) -> EventSubscription:
+        """订阅事件，unit_ids 为空时订阅全部"""
+        subscription = EventSubscription(self, unit_ids, self.max_queue)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, event: str, data: Any = None, unit_id: Optional[str] = None):
+        """
+        发布事件
+        Args:
+            event: 事件类型，如 status / log / svg_ready / monitor
+            data: 事件数据，必须可JSON序列化
+            unit_id: 所属工作单元，系统事件为None
+        """
+        if not self._subscriptions:
+            return
+        message = {
+            "event": event,
+            "unit_id": unit_id,
+            "data": data,
+            "timestamp": datetime.now().isoformat()
+        }
+        for subscription in list(self._subscriptions):
+            try:
+                if subscription.matches(message):
+                    subscription.put(message)
+            except Exception as e:
+                logger.error(f"推送事件失败: {event}: {str(e)}")
+
+
+# 创建全局单例
+event_bus = EventBus()
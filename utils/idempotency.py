@@ -0,0 +1,89 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import os
+import logging
+from utils.tiered_cache import TieredCache, content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflictError(Exception):
+    """同一个幂等键被用于内容不同的请求"""
+
+    def __init__(self, key: str):
+        self.key = key
+        super().__init__(f"幂等键 {key} 已用于内容不同的请求")
+
+
+class IdempotencyStore:
+    """幂等键存储：带同一个 Idempotency-Key 的重复请求直接返回首次请求的结果
+
+    - 完成的响应保存在 TieredCache 中，超过有效期后失效
+    - 首次请求处理期间到达的重复请求等待它完成，不会重复执行
+    - 首次请求失败时不保存结果，客户端可以用同一个键重试
+    - 只在API事件循环上使用
+    """
+
+    def __init__(self, cache: TieredCache):
+        self.cache = cache
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def run(self, scope: str, key: str, payload: Any,
+                  compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        按幂等键执行请求
+        Args:
+            scope: 接口名称，不同接口的同名键互不影响
+            key: 客户端提供的幂等键
+            payload: 请求内容（可JSON序列化），用于识别键被误用于其他请求
+            compute: 首次请求时执行的处理，结果必须可JSON序列化
+        Returns:
+            (响应, 是否为重放的结果)
+        Raises:
+            IdempotencyConflictError: 键已用于内容不同的请求
+        """
+        cache_key = content_hash([scope, key])
+        fingerprint = content_hash(payload)
+
+        while True:
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                if entry["fingerprint"] != fingerprint:
+                    raise IdempotencyConflictError(key)
+                return entry["response"], True
+
+            pending = self._pending.get(cache_key)
+            if pending is None:
+                break
+            if pending[0] != fingerprint:
+                raise IdempotencyConflictError(key)
+            # 等待首次请求结束后重新检查：成功则重放结果，失败则由本请求重新执行
+            await asyncio.shield(pending[1])
+
+        done = asyncio.get_running_loop().create_future()
+        self._pending[cache_key] = (fingerprint, done)
+        try:
+            response = await compute()
+            self.cache.set(cache_key, {"fingerprint": fingerprint, "response": response})
+            return response, False
+        finally:
+            self._pending.pop(cache_key, None)
+            done.set_result(None)
+
+
+def create_idempotency_store() -> IdempotencyStore:
+    """根据环境变量创建幂等键存储
+
+    - IDEMPOTENCY_TTL_HOURS: 幂等键有效期（小时），默认24
+    - IDEMPOTENCY_MAX_ITEMS: 最多保存的幂等键数量，默认10000
+    - IDEMPOTENCY_DB_PATH: SQLite文件路径，配置后重启不丢失；默认只保存在内存中
+    """
+    max_items = int(os.getenv("IDEMPOTENCY_MAX_ITEMS", "10000"))
+    db_path: Optional[str] = os.getenv("IDEMPOTENCY_DB_PATH") or None
+    cache = TieredCache(
+        db_path=db_path,
+        memory_items=max_items if db_path is None else min(max_items, 1024),
+        max_items=max_items,
+        ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")) * 3600
+    )
+    return IdempotencyStore(cache)
@@ -0,0 +1,372 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+import logging
+import httpx
+from utils.tiered_cache import TieredCache, content_hash
+
+logger = logging.getLogger(__name__)
+
+# 模型服务提供方：默认接口地址，以及接口地址和API密钥所在的环境变量
+DEFAULT_PROVIDERS = {
+    "zhipu": {
+        "base_url": "https://open.bigmodel.cn/api/paas/v4",
+        "base_url_env": "ZHIPU_BASE_URL",
+        "api_key_env": "API_KEY_CONF"
+    }
+}
+
+# 可以重试的HTTP状态码：限流和服务端临时错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """模型接口调用失败"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class LLMGateway:
+    """进程级模型调用网关
+
+    工作流的各个事件循环、模型调用线程池和API事件循环都需要调用模型，
+    httpx.AsyncClient 只能在创建它的事件循环上使用，所以网关在独立线程中运行
+    自己的事件循环，所有调用都投递到这个循环上执行：
+    - 所有 agent 共享同一个连接池，keep-alive 连接复用，不再重复建立TLS连接
+    - 每个提供方一个信号量，限制同时进行的调用数量
+    - chat() 可以在任何事件循环上 await，chat_sync() 供同步代码调用
+    - 配置了响应缓存时，温度不高于 cache_max_temperature 的调用按
+      (提供方, 模型, 消息, 温度, 其他参数) 缓存回复内容，重复调用直接返回；流式调用不缓存
+    """
+
+    def __init__(self, providers: Optional[Dict[str, Dict[str, str]]] = None,
+                 concurrency: Optional[Dict[str, int]] = None,
+                 max_connections: int = 32, max_keepalive: int = 16,
+                 timeout: float = 120.0, max_retries: int = 2,
+                 transport: Optional[httpx.AsyncBaseTransport] = None,
+                 cache: Optional[TieredCache] = None, cache_max_temperature: float = 0.5):
+        self.providers = dict(providers or DEFAULT_PROVIDERS)
+        self.concurrency = dict(concurrency or {})
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.transport = transport  # 自定义传输层，测试时替换为本地实现
+        self.cache = cache
+        self.cache_max_temperature = cache_max_temperature
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._start_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        """首次调用时启动网关线程和连接池"""
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._client = httpx.AsyncClient(
+                        timeout=self.timeout,
+                        transport=self.transport,
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive
+                        )
+                    )
+                    ready.set()
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="llm-gateway", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+                logger.info(f"模型调用网关已启动，连接池上限 {self.max_connections}")
+            return self._loop
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.concurrency.get(provider, 8))
+            self._semaphores[provider] = semaphore
+        return semaphore
+
+    def _record(self, provider: str, latency: Optional[float]):
+        stats = self._stats.setdefault(provider, {"completed": 0, "failed": 0, "avg_latency": 0.0})
+        if latency is None:
+            stats["failed"] += 1
+            return
+        stats["avg_latency"] = latency if stats["completed"] == 0 else 0.8 * stats["avg_latency"] + 0.2 * latency
+        stats["completed"] += 1
+
+    def _endpoint(self, provider: str) -> Tuple[str, Dict[str, str]]:
+        """对话补全接口地址和请求头"""
+        config = self.providers.get(provider)
+        if config is None:
+            raise LLMError(f"未知的模型服务提供方: {provider}")
+        api_key = os.getenv(config["api_key_env"])
+        if not api_key:
+            raise LLMError(f"未找到API密钥，请检查环境变量 {config['api_key_env']}")
+        base_url = os.getenv(config.get("base_url_env", ""), "") or config["base_url"]
+        return f"{base_url}/chat/completions", {"Authorization": f"Bearer {api_key}"}
+
+    async def _request(self, provider: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """在网关事件循环上发送请求，限流和临时错误按指数退避重试"""
+        url, headers = self._endpoint(provider)
+
+        async with self._semaphore(provider):
+            start = time.monotonic()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self._client.post(url, json=payload, headers=headers)
+                except httpx.TransportError as e:
+                    error = LLMError(f"模型接口连接失败: {str(e)}")
+                else:
+                    if response.status_code < 400:
+                        self._record(provider, time.monotonic() - start)
+                        return response.json()
+                    error = LLMError(
+                        f"模型接口返回错误 {response.status_code}: {response.text[:200]}",
+                        response.status_code
+                    )
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        break
+                if attempt < self.max_retries:
+                    delay = 0.5 * 2 ** attempt
+                    logger.warning(f"{str(error)}，{delay:g}秒后重试")
+                    await asyncio.sleep(delay)
+            self._record(provider, None)
+            raise error
+
+    async def _stream(self, provider: str, payload: Dict[str, Any], emit: Callable[[str], None]):
+        """在网关事件循环上发送流式请求，每收到一段文本调用一次 emit；已经开始输出后不再重试"""
+        url, headers = self._endpoint(provider)
+
+        async with self._semaphore(provider):
+            start = time.monotonic()
+            try:
+                async with self._client.stream("POST", url, json={**payload, "stream": True},
+                                               headers=headers) as response:
+                    if response.status_code >= 400:
+                        body = (await response.aread()).decode("utf-8", "replace")
+                        raise LLMError(
+                            f"模型接口返回错误 {response.status_code}: {body[:200]}",
+                            response.status_code
+                        )
+                    # 服务端事件流：每个事件一行 "data: {...}"，以 "data: [DONE]" 结束
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                        except (ValueError, KeyError, IndexError, TypeError):
+                            raise LLMError(f"模型接口返回格式错误: {data[:200]}")
+                        if delta:
+                            emit(delta)
+            except httpx.TransportError as e:
+                self._record(provider, None)
+                raise LLMError(f"模型接口连接失败: {str(e)}")
+            except LLMError:
+                self._record(provider, None)
+                raise
+            self._record(provider, time.monotonic() - start)
+
+    @staticmethod
+    def _payload(model: str, messages: List[Dict[str, Any]], temperature: Optional[float],
+                 params: Dict[str, Any]) -> Dict[str, Any]:
+        payload = {"model": model, "messages": messages, **params}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        return payload
+
+    def _cache_key(self, provider: str, payload: Dict[str, Any]) -> Optional[str]:
+        """可以缓存的调用返回缓存键；未配置缓存、未指定温度或温度过高时返回None"""
+        if self.cache is None:
+            return None
+        temperature = payload.get("temperature")
+        if temperature is None or temperature > self.cache_max_temperature:
+            return None
+        return content_hash({"provider": provider, "payload": payload})
+
+    @staticmethod
+    def _content(data: Dict[str, Any]) -> str:
+        try:
+            return data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise LLMError(f"模型接口返回格式错误: {str(data)[:200]}")
+
+    async def chat(self, model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                   provider: str = "zhipu", **params) -> str:
+        """
+        调用对话补全接口，返回回复内容
+        Args:
+            model: 模型名称
+            messages: 对话消息
+            temperature: 采样温度
+            provider: 模型服务提供方
+            params: 其他接口参数，如 response_format
+        Raises:
+            LLMError: 调用失败
+        """
+        payload = self._payload(model, messages, temperature, params)
+        key = self._cache_key(provider, payload)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._request(provider, payload), loop)
+        content = self._content(await asyncio.wrap_future(future))
+        if key is not None:
+            self.cache.set(key, content)
+        return content
+
+    def chat_sync(self, model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                  provider: str = "zhipu", **params) -> str:
+        """chat() 的同步版本，阻塞当前线程直到调用完成，不能在网关线程上调用"""
+        payload = self._payload(model, messages, temperature, params)
+        key = self._cache_key(provider, payload)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._request(provider, payload), loop)
+        content = self._content(future.result())
+        if key is not None:
+            self.cache.set(key, content)
+        return content
+
+    async def chat_stream(self, model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                          provider: str = "zhipu", **params) -> AsyncIterator[str]:
+        """
+        流式调用对话补全接口，逐段产出回复内容
+        请求在网关事件循环上执行，文本片段通过队列转交给调用方所在的事件循环；
+        调用方提前停止迭代时取消请求
+        Raises:
+            LLMError: 调用失败
+        """
+        loop = self._ensure_started()
+        caller = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        payload = self._payload(model, messages, temperature, params)
+
+        def put(item: Tuple[str, Any]):
+            caller.call_soon_threadsafe(queue.put_nowait, item)
+
+        async def run():
+            try:
+                await self._stream(provider, payload, lambda delta: put(("delta", delta)))
+            except Exception as e:
+                put(("error", e))
+            else:
+                put(("done", None))
+
+        future = asyncio.run_coroutine_threadsafe(run(), loop)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "error":
+                    raise value
+                if kind == "done":
+                    return
+                yield value
+        finally:
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """按提供方统计调用次数、失败次数和平均耗时"""
+        return {
+            provider: {
+                "concurrency": self.concurrency.get(provider, 8),
+                "completed": stats["completed"],
+                "failed": stats["failed"],
+                "avg_latency_seconds": round(stats["avg_latency"], 3)
+            }
+            for provider, stats in list(self._stats.items())
+        }
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        """响应缓存的命中统计，未配置缓存时返回None"""
+        if self.cache is None:
+            return None
+        return {**self.cache.stats(), "max_temperature": self.cache_max_temperature}
+
+    def close(self):
+        """关闭连接池并停止网关线程"""
+        with self._start_lock:
+            if self._loop is None:
+                return
+            loop = self._loop
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = None
+            self._client = None
+            self._semaphores.clear()
+
+
+def parse_provider_concurrency(value: str) -> Dict[str, int]:
+    """解析 "zhipu=8" 形式的并发配置"""
+    concurrency = {}
+    for item in value.split(","):
+        if "=" in item:
+            provider, limit = item.split("=", 1)
+            concurrency[provider.strip()] = int(limit)
+    return concurrency
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    """获取全局模型调用网关（首次使用时按环境变量创建）
+
+    - LLM_CONCURRENCY: 按提供方的并发上限，默认 zhipu=8
+    - LLM_MAX_CONNECTIONS: 连接池上限，默认32
+    - LLM_MAX_KEEPALIVE: 保持的空闲连接数，默认16
+    - LLM_TIMEOUT: 单次请求超时（秒），默认120
+    - LLM_MAX_RETRIES: 限流和临时错误的重试次数，默认2
+    - LLM_CACHE_ENABLED: 设为0关闭响应缓存
+    - LLM_CACHE_PATH: 响应缓存的SQLite文件路径，默认 data/llm_cache.db
+    - LLM_CACHE_MEMORY_ITEMS: 内存LRU容量，默认256
+    - LLM_CACHE_MAX_ITEMS: 磁盘条目上限，默认20000
+    - LLM_CACHE_TTL_HOURS: 条目有效期（小时），默认168
+    - LLM_CACHE_MAX_TEMPERATURE: 只缓存温度不高于该值的调用，默认0.5
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            cache = None
+            if os.getenv("LLM_CACHE_ENABLED", "1") != "0":
+                cache = TieredCache(
+                    db_path=os.getenv("LLM_CACHE_PATH", "data/llm_cache.db"),
+                    memory_items=int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256")),
+                    max_items=int(os.getenv("LLM_CACHE_MAX_ITEMS", "20000")),
+                    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600
+                )
+            _gateway = LLMGateway(
+                concurrency=parse_provider_concurrency(os.getenv("LLM_CONCURRENCY", "zhipu=8")),
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "32")),
+                max_keepalive=int(os.getenv("LLM_MAX_KEEPALIVE", "16")),
+                timeout=float(os.getenv("LLM_TIMEOUT", "120")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+                cache=cache,
+                cache_max_temperature=float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.5"))
+            )
+        return _gateway
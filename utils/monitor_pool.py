@@ -3,6 +3,7 @@ from typing import Any, Dict, Optional
 from datetime import datetime
 from copy import deepcopy
 import logging
+from utils.event_bus import event_bus
 
 logger = logging.getLogger(__name__)
 
@@ -15,10 +16,12 @@ class MonitorPool:
             "chat": {}  # 对话相关数据
         }
         self._lock = asyncio.Lock()
+        self._loop = None  # 监控池所属的事件循环
 
     async def initialize(self):
         """初始化监控池"""
         try:
+            self._loop = asyncio.get_running_loop()
             current_time = datetime.now().isoformat()
             async with self._lock:
                 # 只记录启动时间和状态
@@ -36,6 +39,17 @@ class MonitorPool:
 
     async def record(self, category: str, key: str, value: Any, unit_id: str = None, mode: str = "update"):
         """统一的记录接口"""
+        # 来自工作线程事件循环的记录交给监控池所属的循环执行
+        if self._loop is not None and asyncio.get_running_loop() is not self._loop:
+            future = asyncio.run_coroutine_threadsafe(
+                self._record(category, key, value, unit_id, mode), self._loop
+            )
+            await asyncio.wrap_future(future)
+            return
+        await self._record(category, key, value, unit_id, mode)
+
+    async def _record(self, category: str, key: str, value: Any, unit_id: str = None, mode: str = "update"):
+        """在监控池所属的事件循环上写入数据"""
         try:
             async with self._lock:
                 if unit_id:
@@ -51,10 +65,11 @@ class MonitorPool:
                     # 追加模式
                     if key not in target:
                         target[key] = []
-                    target[key].append({
+                    entry = {
                         "value": value,
                         "timestamp": datetime.now().isoformat()
-                    })
+                    }
+                    target[key].append(entry)
                 elif mode == "merge":
 
                     # 合并模式（用于node_results）
@@ -63,16 +78,36 @@ class MonitorPool:
                         target[key] = {}
 
                     target[key].update(value)
+                    entry = value
                 else:
                     # 更新模式
-                    target[key] = {
+                    entry = target[key] = {
                         "value": value,
                         "timestamp": datetime.now().isoformat()
                     }
                 logger.debug(f"记录监控数据: category={category}, key={key}, unit_id={unit_id}")
+
+            # 推送给事件订阅者：执行日志推送日志内容，其他监控点推送本次写入的条目，
+            # 订阅者按 mode 合并到本地数据，不需要重新拉取全部监控数据
+            if key == "execution_log":
+                event_bus.publish("log", value, unit_id)
+            else:
+                event_bus.publish(
+                    "monitor", {"category": category, "key": key, "mode": mode, "entry": entry}, unit_id
+                )
         except Exception as e:
             logger.error(f"记录监控数据失败: {str(e)}")
 
+    async def remove_units(self, unit_ids):
+        """删除工作单元的监控数据（执行日志和节点结果），与工作单元的清理同步"""
+        if not unit_ids:
+            return
+        async with self._lock:
+            for unit_id in unit_ids:
+                self._data["workflows"].pop(unit_id, None)
+        for unit_id in unit_ids:
+            event_bus.publish("monitor", {"category": "workflows", "key": None, "mode": "remove"}, unit_id)
+
     async def get_data(self, category: str = None, unit_id: str = None) -> Dict:
         """获取数据"""
         try:
@@ -0,0 +1,66 @@
+import json
+from typing import Any, AsyncIterator, Optional, Tuple
+
+
+def sse_message(data: Any, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """格式化一条 Server-Sent Events 消息，data 按JSON序列化"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    lines.extend(f"data: {line}" for line in payload.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+def ndjson_line(data: Any) -> str:
+    """格式化一行 NDJSON"""
+    return json.dumps(data, ensure_ascii=False, default=str) + "\n"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    把字节块流切分为行，不需要把整个请求体读入内存
+    Args:
+        chunks: 字节块流，例如 request.stream()
+    Yields:
+        (行号, 行内容)，行号从1开始，空行跳过
+    """
+    buffer = b""
+    line_no = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, line
+    if buffer.strip():
+        yield line_no + 1, buffer
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    逐行解析 NDJSON 字节流
+    Args:
+        chunks: 字节块流，例如 request.stream()
+    Yields:
+        每行解析出的对象，空行跳过
+    Raises:
+        ValueError: 某一行不是合法的JSON
+    """
+    async for line_no, line in iter_lines(chunks):
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"第 {line_no} 行不是合法的JSON: {str(e)}")
+
+
+def sse_comment(text: str = "keepalive") -> str:
+    """SSE注释行，用于保持连接"""
+    return f": {text}\n\n"
+
+
+# SSE响应头：禁止缓存和代理缓冲
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
@@ -0,0 +1,227 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data: Any) -> str:
+    """对可JSON序列化的数据计算稳定的内容哈希"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """两级缓存：内存LRU + SQLite磁盘层
+
+    - 值必须可JSON序列化
+    - ttl_seconds 控制条目有效期，max_items 控制磁盘条目上限
+    - db_path 为 None 时只使用内存层
+    - get/set 在事件循环上调用：写入和访问时间更新放入待写队列，由后台写线程批量提交；
+      磁盘读取使用独立的只读连接（WAL模式下不被写入阻塞），不持有内存层的锁
+    """
+
+    def __init__(self, db_path: Optional[str] = None, memory_items: int = 256,
+                 max_items: int = 10000, ttl_seconds: Optional[float] = None):
+        self.memory_items = memory_items
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()  # 保护内存层、待写队列和统计，持有时间很短
+        self._changed = threading.Condition(self._lock)
+        self._read_lock = threading.Lock()  # 保护只读连接
+        self._db_lock = threading.Lock()  # 保护写连接
+        # 待写入的条目 {key: (JSON文本, 创建时间)} 和待更新的访问时间 {key: 访问时间}
+        self._pending: Dict[str, Tuple[str, float]] = {}
+        self._touched: Dict[str, float] = {}
+        self._writing = False
+        self._closed = False
+        self._writes = 0
+        self._hits = 0
+        self._misses = 0
+        self._conn = None
+        self._reader = None
+        self._writer = None
+
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at)")
+            self._conn.commit()
+            self._reader = sqlite3.connect(db_path, check_same_thread=False)
+
+            self._writer = threading.Thread(target=self._write_loop, name="tiered-cache-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)  # 进程退出前写完待写队列
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._memory[key]
+            row = self._pending.get(key)
+
+        if row is None and self._reader is not None:
+            with self._read_lock:
+                if self._reader is not None:
+                    row = self._reader.execute(
+                        "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+                    ).fetchone()
+
+        if row and not self._expired(row[1]):
+            value = json.loads(row[0])
+            with self._lock:
+                self._remember(key, value, row[1])
+                self._touched[key] = time.time()  # 访问时间由写线程批量更新
+                self._changed.notify_all()
+                self._hits += 1
+            return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        """写入缓存"""
+        now = time.time()
+        # 在调用方序列化，保证写入的是写入时的值
+        payload = json.dumps(value, ensure_ascii=False, default=str) if self._conn is not None else None
+        with self._lock:
+            self._remember(key, value, now)
+            if payload is None:
+                return
+            self._pending[key] = (payload, now)
+            self._touched.pop(key, None)
+            self._changed.notify_all()
+
+    def _remember(self, key: str, value: Any, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _write_loop(self):
+        """后台写线程：批量写入待写条目和访问时间，写完一批后通知等待的 flush"""
+        while True:
+            with self._lock:
+                while not (self._pending or self._touched or self._closed):
+                    self._changed.wait()
+                if self._closed and not (self._pending or self._touched):
+                    return
+
+            with self._db_lock:
+                with self._lock:
+                    entries, self._pending = self._pending, {}
+                    touched, self._touched = self._touched, {}
+                    self._writing = True
+                try:
+                    self._write(entries, touched)
+                except Exception as e:
+                    logger.error(f"缓存写入磁盘失败: {str(e)}")
+                finally:
+                    with self._lock:
+                        self._writing = False
+                        self._changed.notify_all()
+
+    def _write(self, entries: Dict[str, Tuple[str, float]], touched: Dict[str, float]):
+        """写入一批条目并更新访问时间（调用方持有写连接的锁）"""
+        if entries:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, payload, created_at, created_at) for key, (payload, created_at) in entries.items()]
+            )
+        if touched:
+            self._conn.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items()]
+            )
+        # 每写入一批条目检查一次容量，删除最久未访问和已过期的条目
+        previous = self._writes
+        self._writes += len(entries)
+        if self._writes // 100 != previous // 100:
+            self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if total > self.max_items:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (total - self.max_items,)
+            )
+
+    def flush(self):
+        """等待待写队列全部写入磁盘"""
+        if self._writer is None:
+            return
+        with self._lock:
+            while (self._pending or self._touched or self._writing) and self._writer.is_alive():
+                self._changed.wait(0.5)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._pending.clear()
+            self._touched.clear()
+        if self._conn is not None:
+            self.flush()
+            with self._db_lock:
+                self._conn.execute("DELETE FROM cache")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "memory_items": len(self._memory)
+            }
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._changed.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,160 @@
+from typing import Dict, Any, Optional, Callable, List
+from collections import deque, OrderedDict
+import math
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 工作单元类型优先级，数值越小越优先
+DEFAULT_PRIORITIES = {"realtime": 0, "import": 1}
+
+
+class QueueFullError(Exception):
+    """准入队列已满"""
+
+    def __init__(self, retry_after: int, depth: int):
+        self.retry_after = retry_after
+        self.depth = depth
+        super().__init__(f"工作流队列已满（排队 {depth} 个），请 {retry_after} 秒后重试")
+
+
+class AdmissionQueue:
+    """准入队列：有界优先级队列 + 按类型并发限制
+
+    - 所有方法都在API事件循环上同步调用，不需要额外加锁
+    - 有空闲名额时按优先级派发：realtime 先于 import
+    - 每种类型有自己的并发上限，总并发受 max_running 限制，
+      import 只能使用 realtime 剩下的名额
+    """
+
+    def __init__(self, max_size: int = 200, max_running: int = 8,
+                 concurrency: Optional[Dict[str, int]] = None,
+                 priorities: Optional[Dict[str, int]] = None):
+        self.max_size = max_size
+        self.max_running = max_running
+        self.priorities = dict(priorities or DEFAULT_PRIORITIES)
+        self.concurrency = dict(concurrency or {})
+        self._queues: Dict[str, deque] = {}
+        self._running: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._dispatch: Optional[Callable[[str], None]] = None
+        self._avg_wait = 0.0
+        self._avg_service = 0.0
+        self._dispatched = 0
+        self._completed = 0
+
+    def set_dispatcher(self, dispatch: Callable[[str], None]):
+        """设置派发回调：dispatch(unit_id) 负责真正启动工作单元"""
+        self._dispatch = dispatch
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def check_capacity(self, unit_type: str):
+        """检查能否接收新的工作单元，队列已满时抛出 QueueFullError"""
+        if self.depth >= self.max_size and not self._has_free_slot(unit_type):
+            raise QueueFullError(self.retry_after(), self.depth)
+
+    def submit(self, unit_id: str, unit_type: str):
+        """工作单元入队，并在有空闲名额时立即派发"""
+        self._queues.setdefault(unit_type, deque()).append((unit_id, time.monotonic()))
+        self._pump()
+
+    def remove(self, unit_id: str) -> bool:
+        """从队列中移除尚未派发的工作单元"""
+        for queue in self._queues.values():
+            for entry in queue:
+                if entry[0] == unit_id:
+                    queue.remove(entry)
+                    return True
+        return False
+
+    def release(self, unit_id: str):
+        """工作单元结束后释放名额，派发后续排队的工作单元"""
+        entry = self._running.pop(unit_id, None)
+        if entry is None:
+            return
+        service = time.monotonic() - entry["start"]
+        self._avg_service = service if self._completed == 0 else 0.8 * self._avg_service + 0.2 * service
+        self._completed += 1
+        self._pump()
+
+    def _limit(self, unit_type: str) -> int:
+        return self.concurrency.get(unit_type, self.max_running)
+
+    def _running_count(self, unit_type: str) -> int:
+        return sum(1 for entry in self._running.values() if entry["type"] == unit_type)
+
+    def _has_free_slot(self, unit_type: str) -> bool:
+        return (len(self._running) < self.max_running
+                and self._running_count(unit_type) < self._limit(unit_type))
+
+    def _ordered_types(self) -> List[str]:
+        return sorted(self._queues, key=lambda t: self.priorities.get(t, len(self.priorities)))
+
+    def _pump(self):
+        """按优先级派发排队的工作单元"""
+        if self._dispatch is None:
+            return
+        for unit_type in self._ordered_types():
+            queue = self._queues[unit_type]
+            while queue and self._has_free_slot(unit_type):
+                unit_id, enqueued = queue.popleft()
+                now = time.monotonic()
+                wait = now - enqueued
+                self._avg_wait = wait if self._dispatched == 0 else 0.8 * self._avg_wait + 0.2 * wait
+                self._dispatched += 1
+                self._running[unit_id] = {"type": unit_type, "start": now}
+                try:
+                    self._dispatch(unit_id)
+                except Exception as e:
+                    logger.error(f"派发工作单元失败: {unit_id}: {str(e)}")
+                    self._running.pop(unit_id, None)
+
+    def retry_after(self) -> int:
+        """根据排队深度和平均处理时间估算重试等待秒数"""
+        service = self._avg_service or 30.0
+        return max(1, math.ceil(self.depth / max(1, self.max_running) * service))
+
+    def stats(self) -> Dict[str, Any]:
+        """队列统计：排队深度、运行数量和等待时间"""
+        now = time.monotonic()
+        oldest = [queue[0][1] for queue in self._queues.values() if queue]
+        return {
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "max_running": self.max_running,
+            "depth_by_type": {t: len(q) for t, q in self._queues.items()},
+            "running_by_type": {t: self._running_count(t) for t in self._queues},
+            "concurrency": {t: self._limit(t) for t in self._queues},
+            "avg_wait_seconds": round(self._avg_wait, 3),
+            "oldest_wait_seconds": round(now - min(oldest), 3) if oldest else 0.0,
+            "avg_service_seconds": round(self._avg_service, 3),
+            "retry_after": self.retry_after()
+        }
+
+
+def parse_concurrency(value: str) -> Dict[str, int]:
+    """解析 "realtime=8,import=4" 形式的并发配置"""
+    concurrency = {}
+    for item in value.split(","):
+        if "=" in item:
+            unit_type, limit = item.split("=", 1)
+            concurrency[unit_type.strip()] = int(limit)
+    return concurrency
+
+
+def create_admission_queue() -> AdmissionQueue:
+    """根据环境变量创建准入队列
+
+    - WORKFLOW_QUEUE_SIZE: 最大排队数量，默认200
+    - WORKFLOW_MAX_RUNNING: 总并发上限，默认8
+    - WORKFLOW_CONCURRENCY: 按类型的并发上限，默认 realtime=8,import=4
+    """
+    return AdmissionQueue(
+        max_size=int(os.getenv("WORKFLOW_QUEUE_SIZE", "200")),
+        max_running=int(os.getenv("WORKFLOW_MAX_RUNNING", "8")),
+        concurrency=parse_concurrency(os.getenv("WORKFLOW_CONCURRENCY", "realtime=8,import=4"))
+    )
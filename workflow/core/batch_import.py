@@ -0,0 +1,239 @@
+from typing import Dict, Any, Optional, List, AsyncIterator
+from collections import OrderedDict, deque
+from datetime import datetime
+import asyncio
+import os
+import uuid
+import logging
+from utils.event_bus import event_bus
+from utils.tiered_cache import content_hash
+from .admission import QueueFullError
+from .unit_store import ACTIVE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+
+def history_hash(history: List[Dict[str, Any]]) -> str:
+    """对话历史的内容哈希，只考虑角色和内容，忽略时间戳"""
+    return content_hash([[entry["role"], entry["content"]] for entry in history])
+
+
+def is_valid_history(history: Any) -> bool:
+    """对话历史必须是非空列表，每条包含字符串类型的 role 和 content"""
+    return (
+        isinstance(history, list)
+        and len(history) > 0
+        and all(
+            isinstance(entry, dict)
+            and isinstance(entry.get("role"), str)
+            and isinstance(entry.get("content"), str)
+            for entry in history
+        )
+    )
+
+
+class BatchImporter:
+    """批量导入：把大量对话历史按批次投递为 import 工作单元
+
+    - 输入逐条读取，按内容哈希去重（批次内以及最近导入过、处理中或已完成的对话；
+      以失败、取消等状态结束的对话可以重新导入）
+    - 读取和投递同时进行：解析出的对话经容量为 queue_size 的队列交给投递任务，
+      队列满时暂停读取，内存中只保留一小段尚未投递的对话
+    - 每个批次同时在处理中的工作单元不超过 concurrency 个，
+      避免一次导入占满准入队列
+    - 批次进度保存在内存中，保留最近 max_batches 个批次，每个批次保留最近 max_errors 条错误
+    """
+
+    def __init__(self, manager, concurrency: int = 4, max_batches: int = 100, max_hashes: int = 10000,
+                 queue_size: int = 100, max_errors: int = 10):
+        self.manager = manager
+        self.concurrency = concurrency
+        self.max_batches = max_batches
+        self.max_hashes = max_hashes
+        self.queue_size = queue_size
+        self.max_errors = max_errors
+        self._batches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._imported: "OrderedDict[str, str]" = OrderedDict()  # 最近导入、未失败的对话 {内容哈希: unit_id}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, histories: AsyncIterator[Any]) -> Dict[str, Any]:
+        """
+        创建批次并读取输入，读取的同时在后台按并发上限逐步投递工作单元
+        Args:
+            histories: 逐条产出的对话历史，每条为条目列表或 {"dialogue_history": [...]}
+        Returns:
+            读取完毕时的批次进度
+        Raises:
+            读取输入时的异常（如 ValueError）：未投递的对话被丢弃，批次以 failed 结束，
+            已经创建的工作单元照常处理
+        """
+        batch_id = str(uuid.uuid4())
+        batch = {
+            "batch_id": batch_id,
+            "status": "queued",
+            "create_time": datetime.now().isoformat(),
+            "total": 0,
+            "duplicates": 0,
+            "invalid": 0,
+            "submitted": 0,
+            "rejected": 0,  # 创建工作单元失败
+            "completed": 0,
+            "failed": 0,  # 工作单元以失败、取消等非完成状态结束
+            "unit_ids": [],
+            "errors": deque(maxlen=self.max_errors)
+        }
+        self._batches[batch_id] = batch
+        while len(self._batches) > self.max_batches:
+            oldest = next(iter(self._batches))
+            if oldest in self._tasks:
+                break
+            self._batches.pop(oldest)
+
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        task = asyncio.create_task(self._feed(batch, pending))
+        self._tasks[batch_id] = task
+        seen = set()
+
+        try:
+            async for item in histories:
+                history = item.get("dialogue_history") if isinstance(item, dict) else item
+                if not is_valid_history(history):
+                    batch["invalid"] += 1
+                    continue
+                digest = history_hash(history)
+                if digest in seen or digest in self._imported:
+                    batch["duplicates"] += 1
+                    continue
+                seen.add(digest)
+                batch["total"] += 1
+                await pending.put((digest, history))  # 队列满时等待投递任务取走
+        except BaseException as e:
+            # 丢弃尚未投递的对话，通知投递任务跟踪完已创建的工作单元后结束
+            while not pending.empty():
+                pending.get_nowait()
+                batch["total"] -= 1
+            pending.put_nowait(e)
+            raise
+
+        await pending.put(None)
+        logger.info(
+            f"批量导入 {batch_id}: {batch['total']} 条，重复 {batch['duplicates']} 条，无效 {batch['invalid']} 条"
+        )
+        if not batch["total"]:
+            await task
+        return self.progress(batch_id)
+
+    async def _feed(self, batch: Dict[str, Any], pending: asyncio.Queue):
+        """
+        从队列取出对话，按并发上限投递工作单元，并跟踪它们的最终状态
+        队列中的 None 表示输入读取完毕，异常表示读取失败
+        """
+        batch_id = batch["batch_id"]
+        subscription = event_bus.subscribe(set())
+        running = {}  # 处理中的工作单元 {unit_id: 内容哈希}
+        item = None  # 已取出、尚未投递的对话
+        reading = True
+        read_error = None
+        batch["status"] = "running"
+        try:
+            while reading or running:
+                while reading and len(running) < self.concurrency:
+                    if item is None:
+                        item = await pending.get()
+                        if item is None or isinstance(item, BaseException):
+                            read_error, item, reading = item, None, False
+                            break
+                    digest, history = item
+                    try:
+                        unit_id = await self.manager.create_work_unit(
+                            data={
+                                "dialogue_history": history,
+                                "batch_id": batch_id,
+                                "create_time": datetime.now()
+                            },
+                            unit_type="import"
+                        )
+                    except QueueFullError as e:
+                        # 队列已满，等待后重试
+                        await asyncio.sleep(min(e.retry_after, 5))
+                        break
+                    except Exception as e:
+                        item = None
+                        batch["rejected"] += 1
+                        batch["errors"].append(str(e))
+                        continue
+
+                    item = None
+                    subscription.unit_ids.add(unit_id)
+                    running[unit_id] = digest
+                    batch["unit_ids"].append(unit_id)
+                    batch["submitted"] += 1
+                    self._remember(digest, unit_id)
+
+                if running:
+                    await subscription.get(timeout=5)
+                    for unit_id in list(running):
+                        status = await self.manager.get_unit_status(unit_id)
+                        state = status["status"] if status else "failed"
+                        if state not in ACTIVE_STATUSES:
+                            digest = running.pop(unit_id)
+                            subscription.unit_ids.discard(unit_id)
+                            batch["completed" if state == "completed" else "failed"] += 1
+                            if state != "completed":
+                                self._forget(digest, unit_id)
+
+            if read_error is not None:
+                batch["status"] = "failed"
+                batch["errors"].append(f"读取输入失败: {str(read_error) or type(read_error).__name__}")
+                logger.warning(f"批量导入 {batch_id} 读取输入失败，已创建 {batch['submitted']} 个工作单元")
+            else:
+                batch["status"] = "completed"
+                logger.info(f"批量导入 {batch_id} 完成: 成功 {batch['completed']}，失败 {batch['failed']}")
+        except asyncio.CancelledError:
+            batch["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"批量导入 {batch_id} 失败: {str(e)}")
+            batch["status"] = "failed"
+            batch["errors"].append(str(e))
+        finally:
+            subscription.close()
+            self._tasks.pop(batch_id, None)
+
+    def _remember(self, digest: str, unit_id: str):
+        self._imported[digest] = unit_id
+        while len(self._imported) > self.max_hashes:
+            self._imported.popitem(last=False)
+
+    def _forget(self, digest: str, unit_id: str):
+        """工作单元没有完成时移除它的内容哈希，之后可以重新导入"""
+        if self._imported.get(digest) == unit_id:
+            del self._imported[digest]
+
+    def progress(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """获取批次进度，批次不存在时返回None"""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        finished = batch["completed"] + batch["failed"]
+        return {
+            **batch,
+            "unit_ids": list(batch["unit_ids"]),
+            "errors": list(batch["errors"]),
+            "queued": batch["total"] - batch["submitted"] - batch["rejected"],
+            "running": batch["submitted"] - finished,
+            "progress": round((finished + batch["rejected"]) / batch["total"], 4) if batch["total"] else 1.0
+        }
+
+
+def create_batch_importer(manager) -> BatchImporter:
+    """根据环境变量创建批量导入器
+
+    - IMPORT_BATCH_CONCURRENCY: 每个批次同时处理的工作单元数，默认4
+    - IMPORT_BATCH_QUEUE_SIZE: 读取输入时最多暂存的未投递对话数，默认100
+    """
+    return BatchImporter(
+        manager,
+        concurrency=int(os.getenv("IMPORT_BATCH_CONCURRENCY", "4")),
+        queue_size=int(os.getenv("IMPORT_BATCH_QUEUE_SIZE", "100"))
+    )
@@ -1,6 +1,13 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Callable, Awaitable
 from datetime import datetime
 from enum import Enum
+import asyncio
+import os
+import logging
+from utils.tiered_cache import content_hash
+from .result_cache import get_result_cache
+
+logger = logging.getLogger(__name__)
 
 
 class NodeStatus(Enum):
@@ -8,13 +15,49 @@ class NodeStatus(Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     ERROR = "error"
+    SKIPPED = "skipped"
+    CANCELLED = "cancelled"
+
+
+# 各类型节点的默认执行期限（秒）
+DEFAULT_NODE_TIMEOUTS = {"narrative": 180.0, "svg": 60.0, "analysis": 240.0}
+
+
+def load_node_timeouts() -> Dict[str, float]:
+    """读取节点执行期限配置
+
+    NODE_TIMEOUTS 形如 "narrative=180,svg=60,analysis=240"，
+    未配置的节点使用默认值，配置为0表示不限时
+    """
+    timeouts = dict(DEFAULT_NODE_TIMEOUTS)
+    for item in os.getenv("NODE_TIMEOUTS", "").split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
 
 
 class BaseNode:
-    """节点基类，定义了节点的基本接口和状态管理"""
+    """节点基类，定义了节点的基本接口和状态管理
 
-    def __init__(self, name: str):
+    节点通过 inputs/outputs 声明依赖关系：
+    - inputs: 节点读取的上游结果键（work_unit["results"] 中的键）
+    - outputs: 节点产出的结果键，_process 返回的字典必须包含这些键
+    调度器据此构建DAG，依赖全部完成后立即启动节点。
+
+    version 标识节点的处理逻辑、提示词和模型版本，参与结果缓存键，
+    修改提示词或模型时需要同步更新。
+
+    timeout 为节点执行期限（秒），超时后节点以错误结束；None 或0表示不限时。
+    """
+
+    version = "1"
+    timeout: Optional[float] = None
+
+    def __init__(self, name: str, inputs: Optional[List[str]] = None, outputs: Optional[List[str]] = None):
         self.name = name
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs) if outputs is not None else [name]
         self.status = NodeStatus.IDLE
 
     async def process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
@@ -29,42 +72,92 @@ class BaseNode:
             self.status = NodeStatus.PROCESSING
 
             # 记录节点开始处理
-            work_unit["node_states"][self.name] = {
+            work_unit.setdefault("node_states", {})[self.name] = {
                 "status": self.status.value,
-                "start_time": datetime.now()
+                "start_time": datetime.now().isoformat()
             }
 
             # 执行具体处理逻辑，传入整个work_unit
-            result = await self._process(work_unit)
+            if self.timeout:
+                try:
+                    result = await asyncio.wait_for(self._process(work_unit), self.timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"节点 {self.name} 执行超时（{self.timeout:g}秒）")
+            else:
+                result = await self._process(work_unit)
+
+            missing = [key for key in self.outputs if key not in (result or {})]
+            if missing:
+                raise ValueError(f"节点 {self.name} 缺少输出: {missing}")
 
             # 更新处理结果和状态
             self.status = NodeStatus.COMPLETED
             if "results" not in work_unit:
                 work_unit["results"] = {}
-            work_unit["results"][self.name] = result
+            for key in self.outputs:
+                work_unit["results"][key] = result[key]
             work_unit["node_states"][self.name].update({
                 "status": self.status.value,
-                "end_time": datetime.now()
+                "end_time": datetime.now().isoformat()
             })
 
             return work_unit
 
+        except asyncio.CancelledError:
+            self.status = NodeStatus.CANCELLED
+            work_unit["node_states"][self.name].update({
+                "status": self.status.value,
+                "end_time": datetime.now().isoformat()
+            })
+            raise
+
         except Exception as e:
             self.status = NodeStatus.ERROR
             work_unit["node_states"][self.name].update({
                 "status": self.status.value,
                 "error": str(e),
-                "end_time": datetime.now()
+                "end_time": datetime.now().isoformat()
             })
             raise
 
     async def _process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
-        """具体节点需要实现的处理逻辑"""
+        """具体节点需要实现的处理逻辑，返回 {输出键: 结果}"""
         raise NotImplementedError
 
+    async def _cached(self, work_unit: Dict[str, Any], key_data: Any,
+                      compute: Callable[[], Awaitable[Any]],
+                      should_cache: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        按输入内容缓存计算结果
+        Args:
+            work_unit: 工作单元，命中时在节点状态中标记 cache_hit
+            key_data: 归一化后的节点输入（可JSON序列化）
+            compute: 未命中时执行的计算，结果必须可JSON序列化
+            should_cache: 判断结果是否写入缓存，例如不缓存部分失败的结果
+        Returns:
+            计算结果
+        """
+        cache = get_result_cache()
+        if cache is None:
+            return await compute()
+
+        key = content_hash({"node": self.name, "version": self.version, "input": key_data})
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"节点 {self.name} 命中结果缓存: {key[:12]}")
+            work_unit.setdefault("node_states", {}).setdefault(self.name, {})["cache_hit"] = True
+            return cached
+
+        result = await compute()
+        if should_cache is None or should_cache(result):
+            cache.set(key, result)
+        return result
+
     def get_status(self) -> Dict[str, Any]:
         """获取节点当前状态"""
         return {
             "name": self.name,
-            "status": self.status.value
+            "status": self.status.value,
+            "inputs": self.inputs,
+            "outputs": self.outputs
         }
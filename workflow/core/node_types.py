@@ -1,13 +1,18 @@
 from typing import Dict, Any, List
 from datetime import datetime
 from .node import BaseNode
+from utils.tiered_cache import content_hash
 from agents.conversation_agent import ConversationAgent
 from agents.narrative_agent import NarrativeAgent
 from agents.sentence_analyzer_agent import SentenceAnalyzerAgent
 from agents.tag_analyzer_agent import TagAnalyzerAgent
+from agents.combined_analyzer_agent import CombinedAnalyzerAgent
 from services.book_svg_service import BookSVGService
+from itertools import zip_longest
+import asyncio
 import logging
 import json
+import os
 
 from database.base import get_db
 from services.conversation_service import ConversationService
@@ -17,15 +22,31 @@ from services.tag_service import TagService
 from entities.narrative import Narrative
 from entities.paragraph import Paragraph
 from entities.tag import Tag
-from utils.monitor_pool import monitor_pool  # 添加导入
 logger = logging.getLogger(__name__)
 
+# NarrativeAgent 出错时以文本形式返回的错误信息前缀
+NARRATIVE_ERROR_PREFIXES = ("调用AI接口时发生错误", "处理对话历史时发生错误", "对话历史中没有有效的对话内容")
+# 分析Agent出错时返回的错误信息前缀
+SENTENCE_ERROR_PREFIX = "发生错误"
+TAG_ERROR_PREFIX = "标签分析出错"
+# 段落分类失败时使用的类型
+UNCLASSIFIED_TYPE = "未分类"
+
+
+def normalize_dialogue(dialogue: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """归一化对话历史：只保留角色和内容，去掉时间戳等不影响结果的字段"""
+    return [
+        {"role": entry["role"], "content": entry["content"]}
+        for entry in dialogue
+        if entry.get("role") != "system"
+    ]
+
 
 class ConversationNode(BaseNode):
     """对话处理节点：处理对话历史，准备生成叙事体的数据"""
 
     def __init__(self):
-        super().__init__("conversation")
+        super().__init__("conversation", inputs=[], outputs=["conversation"])
         self.agent = ConversationAgent()
 
     async def _process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
@@ -46,10 +67,12 @@ class ConversationNode(BaseNode):
             })
 
         return {
-            "dialogue": structured_dialogue,
-            "metadata": {
-                "dialogue_count": len(structured_dialogue),
-                "process_time": datetime.now().isoformat()
+            "conversation": {
+                "dialogue": structured_dialogue,
+                "metadata": {
+                    "dialogue_count": len(structured_dialogue),
+                    "process_time": datetime.now().isoformat()
+                }
             }
         }
 
@@ -58,65 +81,87 @@ class NarrativeNode(BaseNode):
     """叙事生成节点：根据处理后的对话生成叙事文本"""
 
     def __init__(self):
-        super().__init__("narrative")
+        super().__init__("narrative", inputs=[], outputs=["narrative"])
         self.agent = NarrativeAgent()
+        self.version = f"{NarrativeAgent.MODEL}:{NarrativeAgent.PROMPT_VERSION}"
 
-    async def process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
+    async def _process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
         """叙事生成节点"""
         try:
             # 验证工作单元
             if not work_unit or "id" not in work_unit:
                 raise ValueError("无效的工作单元：缺少ID")
 
-            # 获取对话历史
+            # 获取对话历史（实时会话中只包含上次处理之后的新增对话）
             dialogue = work_unit["data"].get("dialogue_history", [])
-
-            # 生成叙事文本
-            narrative_text = self.agent.generate_narrative(dialogue)
-
-            # 确保结果字典存在
-            if "results" not in work_unit:
-                work_unit["results"] = {}
-
-            # 更新工作单元结果
-            work_unit["results"]["narrative"] = {
-                "content": narrative_text,
-                "type": "chapter",
-                "metadata": {
-                    "source_dialogue_count": len(dialogue),
-                    "generate_time": datetime.now().isoformat()
-                }
-            }
-
-            # 添加监控点：工作单元叙述体结果
-            await monitor_pool.record(
-                category="workflows",
-                key="node_results",
-                value={
-                    "narrative": {
-                        "content": narrative_text
+            previous_narrative = work_unit["data"].get("previous_narrative")
+
+            if previous_narrative:
+                return {"narrative": await self._extend(work_unit, previous_narrative, dialogue)}
+
+            async def generate():
+                # 生成叙事文本
+                narrative_text = await self.agent.agenerate_narrative(dialogue)
+                if narrative_text.startswith(NARRATIVE_ERROR_PREFIXES):
+                    raise RuntimeError(narrative_text)
+
+                return {
+                    "content": narrative_text,
+                    "type": "chapter",
+                    "metadata": {
+                        "source_dialogue_count": len(dialogue),
+                        "generate_time": datetime.now().isoformat()
                     }
-                },
-                unit_id=work_unit["id"],
-                mode="merge"
-            )
-
+                }
 
-            return work_unit
+            # 相同对话内容直接复用已生成的叙事
+            narrative = await self._cached(work_unit, normalize_dialogue(dialogue), generate)
+            return {"narrative": narrative}
 
         except Exception as e:
             logger.error(f"叙事生成失败: {str(e)}")
             raise
 
+    async def _extend(self, work_unit: Dict[str, Any], previous_narrative: str,
+                      dialogue: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """增量模式：只根据新增对话续写，delta 为本次新增的叙事"""
+        if not normalize_dialogue(dialogue):
+            # 没有新的对话，沿用已有叙事
+            delta = ""
+        else:
+            async def generate():
+                delta_text = await self.agent.acontinue_narrative(previous_narrative, dialogue)
+                if delta_text.startswith(NARRATIVE_ERROR_PREFIXES):
+                    raise RuntimeError(delta_text)
+                return delta_text
+
+            key_data = {
+                "previous": content_hash(previous_narrative),
+                "dialogue": normalize_dialogue(dialogue)
+            }
+            delta = await self._cached(work_unit, key_data, generate)
+
+        return {
+            "content": f"{previous_narrative}\n\n{delta}" if delta else previous_narrative,
+            "delta": delta,
+            "type": "chapter",
+            "metadata": {
+                "source_dialogue_count": len(dialogue),
+                "incremental": True,
+                "base_length": len(previous_narrative),
+                "generate_time": datetime.now().isoformat()
+            }
+        }
+
 
 class SVGNode(BaseNode):
     """SVG生成节点：根据叙事文本生成可视化卡片"""
 
     def __init__(self):
-        super().__init__("svg")
+        super().__init__("svg", inputs=["narrative"], outputs=["svg"])
         self.svg_service = BookSVGService()
 
-    async def process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
+    async def _process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
         """SVG生成节点"""
         try:
             # 获取叙事内容
@@ -133,39 +178,27 @@ class SVGNode(BaseNode):
 
             logger.info(f"准备生成SVG，内容长度: {len(narrative_content)}")
 
-            # 生成SVG
-            svg_content = self.svg_service.generate_svg(
-                number="Chapter 1",  # 可以根据实际需求设置
-                title="回忆录",  # 可以从narrative中提取
-                content=narrative["content"],
-                is_chapter=False
-            )
-
-            # 更新工作单元结果
-            work_unit["results"]["svg"] = {
-                "content": svg_content,  # BookSVGService返回的是列表，取第一个
-                "type": "memory_tree",
-                "metadata": {
-                    "generate_time": datetime.now().isoformat(),
-                    "source_narrative": len(narrative["content"])
-                }
+            svg_params = {
+                "number": "Chapter 1",  # 可以根据实际需求设置
+                "title": "回忆录",  # 可以从narrative中提取
+                "content": narrative_content,
+                "is_chapter": False
             }
 
-            # 添加监控点：工作单元svg结果
-            await monitor_pool.record(
-                category="workflows",
-                key="node_results",
-                value={
-                    "svg": {
-                        "content": svg_content
-                    }
-                },
-                unit_id=work_unit["id"],
-                mode="merge"
-            )
+            async def render():
+                # 生成SVG
+                svg_content = await asyncio.to_thread(self.svg_service.generate_svg, **svg_params)
 
+                return {
+                    "content": svg_content,  # BookSVGService返回的是页面列表
+                    "type": "memory_tree",
+                    "metadata": {
+                        "generate_time": datetime.now().isoformat(),
+                        "source_narrative": len(narrative_content)
+                    }
+                }
 
-            return work_unit
+            return {"svg": await self._cached(work_unit, svg_params, render)}
 
         except Exception as e:
             logger.error(f"SVG生成失败: {str(e)}")
@@ -173,121 +206,206 @@ class SVGNode(BaseNode):
 
 
 class AnalysisNode(BaseNode):
-    """分析节点：分析叙事文本并进行持久化"""
+    """分析节点：分析叙事文本并进行持久化
+
+    ANALYSIS_MODE 选择分析方式：
+    - separate（默认）：段落分类和标签分析分别调用模型，并发执行后按段落对齐
+    - combined：一次调用完成分段、分类和标签，输出经过结构校验的JSON；
+      调用或校验失败时退回 separate
+    """
 
     def __init__(self):
-        super().__init__("analysis")
+        super().__init__("analysis", inputs=["narrative"], outputs=["analyse"])
         self.sentence_agent = SentenceAnalyzerAgent()
         self.tag_agent = TagAnalyzerAgent()
-        # 初始化服务
-        self.conversation_service = ConversationService()
-        self.narrative_service = NarrativeService()
-        self.paragraph_service = ParagraphService()
-        self.tag_service = TagService()
+        self.mode = os.getenv("ANALYSIS_MODE", "separate")
+        self.combined_agent = CombinedAnalyzerAgent() if self.mode == "combined" else None
+        self.version = (
+            f"{SentenceAnalyzerAgent.MODEL}:{SentenceAnalyzerAgent.PROMPT_VERSION}/"
+            f"{TagAnalyzerAgent.MODEL}:{TagAnalyzerAgent.PROMPT_VERSION}"
+        )
+        if self.combined_agent:
+            self.version = f"combined:{CombinedAnalyzerAgent.MODEL}:{CombinedAnalyzerAgent.PROMPT_VERSION}|{self.version}"
 
-    async def process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
+    async def _process(self, work_unit: Dict[str, Any]) -> Dict[str, Any]:
         """分析节点"""
         try:
-            # 从上游节点获取处理结果
-            narrative_content = work_unit["results"]["narrative"]["content"]
+            # 从上游节点获取处理结果，增量模式下只分析新增的叙事
+            narrative_result = work_unit["results"]["narrative"]
+            narrative_content = narrative_result.get("delta", narrative_result["content"])
             dialogue_history = work_unit["data"]["dialogue_history"]
-            session_id = work_unit["id"]  # 使用工作单元ID作为会话ID
-
-            # 分析处理
-            sentence_result = self.sentence_agent.analyze_narrative(narrative_content)
-            paragraphs = self.sentence_agent.get_paragraphs(sentence_result)
-
-            tag_result = self.tag_agent.analyze_tags(narrative_content)
-            tags = self.tag_agent.parse_tags(tag_result)
-
-            # 直接使用已有的分析结果
-            merged_results = []
-            for p, t in zip(paragraphs, tags):
-                merged_results.append({
-                    'content': p['text'],
-                    'type': p['type'],
-                    'tags': t.get('tags', {})
-                })
+            # 实时会话的各个工作单元保存到同一个会话下，导入的对话使用工作单元ID作为会话ID
+            session_id = work_unit["data"].get("session_id") or work_unit["id"]
+            dialogue_offset = work_unit["data"].get("dialogue_offset", 0)
+            paragraph_offset = work_unit["data"].get("paragraph_offset", 0)
 
-            if not merged_results:
-                raise Exception("合并失败")
+            if not narrative_content.strip():
+                # 没有新增叙事，不需要分析和持久化
+                return {"analyse": {"content": []}}
+
+            # 相同叙事内容直接复用分析结果，持久化仍按本工作单元执行；部分失败的结果不缓存
+            errors: Dict[str, str] = {}
+            merged_results = await self._cached(
+                work_unit,
+                narrative_content,
+                lambda: self._analyze(narrative_content, errors),
+                should_cache=lambda _: not errors
+            )
+            if errors:
+                logger.warning(f"分析部分失败，保存已有结果: {errors}")
+                work_unit["node_states"][self.name]["partial"] = True
+
+            # 数据库访问是同步的，放到线程中执行，不阻塞工作线程事件循环上的其他工作单元
+            await asyncio.to_thread(
+                self._persist, session_id, dialogue_history, dialogue_offset,
+                narrative_result["content"], merged_results, paragraph_offset
+            )
 
-            # 在事务中执行所有持久化操作
-            with get_db() as db:
-                try:
-                    # 设置所有服务使用同一个会话
-                    self.conversation_service._session = db
-                    self.narrative_service._session = db
-                    self.paragraph_service._session = db
-                    self.tag_service._session = db
+            analyse = {"content": merged_results}
+            if errors:
+                analyse.update({"partial": True, "errors": errors})
+            return {"analyse": analyse}
 
-                    # 3.1 保存对话历史
-                    if not self.conversation_service.save_history(session_id, dialogue_history):
-                        raise Exception("保存对话历史失败")
+        except Exception as e:
+            logger.error(f"分析失败: {str(e)}")
+            raise
 
-                    # 3.2 保存叙事体
+    def _persist(self, session_id: str, dialogue_history: List[Dict[str, Any]], dialogue_offset: int,
+                 narrative_content: str, merged_results: List[Dict[str, Any]], paragraph_offset: int):
+        """
+        在一个事务中保存对话历史、叙事体、段落和标签（在线程中执行）
+        同一会话只有一个叙事体：增量工作单元更新叙事全文，新段落接在已有段落之后
+        Args:
+            dialogue_offset / paragraph_offset: 本次对话和段落在会话中的起始位置
+            narrative_content: 会话到目前为止的完整叙事
+        """
+        # 每次调用使用独立的服务实例，它们共享同一个会话；节点实例在多个工作线程间共享，不能复用服务
+        conversation_service = ConversationService()
+        narrative_service = NarrativeService()
+        paragraph_service = ParagraphService()
+        tag_service = TagService()
+
+        with get_db() as db:
+            try:
+                conversation_service._session = db
+                narrative_service._session = db
+                paragraph_service._session = db
+                tag_service._session = db
+
+                # 3.1 保存对话历史
+                if not conversation_service.save_history(session_id, dialogue_history, dialogue_offset):
+                    raise Exception("保存对话历史失败")
+
+                # 3.2 保存叙事体：会话已有叙事体时更新全文
+                narrative = narrative_service.get_by_session(session_id)
+                if narrative is not None:
+                    narrative.content = narrative_content
+                    narrative = narrative_service.update(narrative)
+                else:
                     narrative = Narrative(
                         session_id=session_id,
                         content=narrative_content
                     )
-                    narrative = self.narrative_service.create(narrative)
-
-                    # 3.3 保存段落和标签
-                    for idx, result in enumerate(merged_results, 1):
-                        # 创建段落
-                        paragraph = Paragraph(
-                            narrative_id=narrative.id,
-                            content=result['content'],
-                            sequence_number=idx,
-                            paragraph_type=result['type']
-                        )
-                        paragraph = self.paragraph_service.create(paragraph)
-
-                        # 处理标签
-                        for dimension, tags in result['tags'].items():
-                            for tag_value in tags:
-                                # 查找或创建标签
-                                existing_tag = self.tag_service.find_by_dimension_and_value(
-                                    dimension, tag_value
-                                )
-                                if existing_tag:
-                                    tag = existing_tag
-                                else:
-                                    tag = Tag(dimension=dimension, tag_value=tag_value)
-                                    tag = self.tag_service.create(tag)
-
-                                # 关联标签
-                                paragraph.tags.append(tag)
-
-                        # 更新段落
-                        self.paragraph_service.update(paragraph)
-
-                    # 提交事务
-                    db.commit()
-
-                except Exception as e:
-                    db.rollback()  # 回滚事务
-                    raise
-
-            # 更新工作单元结果
-            work_unit["results"]["analyse"] = {
-                "content": merged_results,
-            }
-
-            # 添加监控点：工作单元分析任务结果
-            await monitor_pool.record(
-                category="workflows",
-                key="node_results",
-                value={
-                    "analyse": {
-                        "content": merged_results
-                    }
-                },
-                unit_id=work_unit["id"],
-                mode="merge"
-            )
-
-
-        except Exception as e:
-            logger.error(f"分析失败: {str(e)}")
-            raise
+                    narrative = narrative_service.create(narrative)
+
+                # 3.3 保存段落和标签
+                for idx, result in enumerate(merged_results, 1):
+                    # 创建段落
+                    paragraph = Paragraph(
+                        narrative_id=narrative.id,
+                        content=result['content'],
+                        sequence_number=paragraph_offset + idx,
+                        paragraph_type=result['type']
+                    )
+                    paragraph = paragraph_service.create(paragraph)
+
+                    # 处理标签
+                    for dimension, tags in result['tags'].items():
+                        for tag_value in tags:
+                            # 查找或创建标签
+                            existing_tag = tag_service.find_by_dimension_and_value(
+                                dimension, tag_value
+                            )
+                            if existing_tag:
+                                tag = existing_tag
+                            else:
+                                tag = Tag(dimension=dimension, tag_value=tag_value)
+                                tag = tag_service.create(tag)
+
+                            # 关联标签
+                            paragraph.tags.append(tag)
+
+                    # 更新段落
+                    paragraph_service.update(paragraph)
+
+                # 提交事务
+                db.commit()
+
+            except Exception as e:
+                db.rollback()  # 回滚事务
+                raise
+
+    async def _analyze(self, narrative_content: str, errors: Dict[str, str]) -> List[Dict[str, Any]]:
+        """按配置的分析方式分析叙事文本"""
+        if self.combined_agent:
+            try:
+                result = await self.combined_agent.aanalyze(narrative_content)
+                return self.combined_agent.parse(result)
+            except Exception as e:
+                logger.warning(f"合并分析失败，改为分别分析: {str(e)}")
+        return await self._analyze_separately(narrative_content, errors)
+
+    async def _analyze_separately(self, narrative_content: str, errors: Dict[str, str]) -> List[Dict[str, Any]]:
+        """
+        并发调用模型进行段落分类和标签分析，并合并结果
+        Args:
+            narrative_content: 叙事文本
+            errors: 记录失败的分析项 {"sentence" / "tags": 错误信息}
+        Returns:
+            合并后的段落列表；一项分析失败时用另一项的结果生成段落，两项都失败时抛出异常
+        """
+        sentence_result, tag_result = await asyncio.gather(
+            self.sentence_agent.aanalyze_narrative(narrative_content),
+            self.tag_agent.aanalyze_tags(narrative_content),
+            return_exceptions=True
+        )
+
+        paragraphs = []
+        if isinstance(sentence_result, Exception):
+            errors["sentence"] = str(sentence_result)
+        elif sentence_result.startswith(SENTENCE_ERROR_PREFIX):
+            errors["sentence"] = sentence_result
+        else:
+            paragraphs = self.sentence_agent.get_paragraphs(sentence_result)
+            if not paragraphs:
+                errors["sentence"] = "未解析到段落"
+
+        tags = []
+        if isinstance(tag_result, Exception):
+            errors["tags"] = str(tag_result)
+        elif tag_result.startswith(TAG_ERROR_PREFIX):
+            errors["tags"] = tag_result
+        else:
+            tags = self.tag_agent.parse_tags(tag_result)
+            if not tags:
+                errors["tags"] = "未解析到标签"
+
+        if not paragraphs and not tags:
+            raise RuntimeError(f"合并失败: {errors}")
+
+        if paragraphs and tags and len(paragraphs) != len(tags):
+            logger.warning(f"段落分类与标签分析的分段数量不一致: {len(paragraphs)} != {len(tags)}")
+
+        # 按顺序对齐两次分析的分段，多出的段落不丢弃：
+        # 缺少标签时标签为空，缺少分类时类型记为未分类
+        merged_results = []
+        for p, t in zip_longest(paragraphs, tags):
+            if p is None:
+                merged_results.append({'content': t['text'], 'type': UNCLASSIFIED_TYPE, 'tags': t.get('tags', {})})
+            else:
+                merged_results.append({
+                    'content': p['text'],
+                    'type': p.get('type', UNCLASSIFIED_TYPE),
+                    'tags': (t or {}).get('tags', {})
+                })
+        return merged_results
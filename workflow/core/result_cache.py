@@ -0,0 +1,30 @@
+from typing import Optional
+import os
+import threading
+from utils.tiered_cache import TieredCache
+
+_cache: Optional[TieredCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[TieredCache]:
+    """获取节点结果缓存（首次使用时按环境变量创建）
+
+    - NODE_CACHE_ENABLED: 设为0关闭缓存
+    - NODE_CACHE_PATH: SQLite文件路径，默认 data/node_cache.db
+    - NODE_CACHE_MEMORY_ITEMS: 内存LRU容量，默认256
+    - NODE_CACHE_MAX_ITEMS: 磁盘条目上限，默认20000
+    - NODE_CACHE_TTL_HOURS: 条目有效期（小时），默认168
+    """
+    global _cache
+    if os.getenv("NODE_CACHE_ENABLED", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TieredCache(
+                db_path=os.getenv("NODE_CACHE_PATH", "data/node_cache.db"),
+                memory_items=int(os.getenv("NODE_CACHE_MEMORY_ITEMS", "256")),
+                max_items=int(os.getenv("NODE_CACHE_MAX_ITEMS", "20000")),
+                ttl_seconds=float(os.getenv("NODE_CACHE_TTL_HOURS", "168")) * 3600
+            )
+        return _cache
@@ -0,0 +1,151 @@
+from typing import Dict, Any, List, Set, Optional, Callable, Awaitable
+from datetime import datetime
+import asyncio
+import logging
+from .node import BaseNode, NodeStatus
+
+logger = logging.getLogger(__name__)
+
+# 节点事件回调：(节点名, 事件, 工作单元, 错误信息)
+NodeEventCallback = Callable[[str, str, Dict[str, Any], Optional[str]], Awaitable[None]]
+
+
+class DAGScheduler:
+    """DAG调度器：根据节点声明的输入输出构建依赖图，依赖完成后立即启动节点"""
+
+    def __init__(self, nodes: List[BaseNode]):
+        self.nodes: Dict[str, BaseNode] = {}
+        for node in nodes:
+            if node.name in self.nodes:
+                raise ValueError(f"节点名称重复: {node.name}")
+            self.nodes[node.name] = node
+        self.dependencies = self._build_dependencies()
+        self.order = self._topological_order()
+
+    def _build_dependencies(self) -> Dict[str, Set[str]]:
+        """根据输入输出声明计算每个节点依赖的上游节点"""
+        producers = {}
+        for node in self.nodes.values():
+            for key in node.outputs:
+                if key in producers:
+                    raise ValueError(f"结果 {key} 被多个节点产出: {producers[key]}, {node.name}")
+                producers[key] = node.name
+
+        dependencies = {}
+        for node in self.nodes.values():
+            deps = set()
+            for key in node.inputs:
+                if key not in producers:
+                    raise ValueError(f"节点 {node.name} 的输入 {key} 没有对应的上游节点")
+                deps.add(producers[key])
+            dependencies[node.name] = deps
+        return dependencies
+
+    def _topological_order(self) -> List[str]:
+        """拓扑排序，同时检测环"""
+        order = []
+        remaining = {name: set(deps) for name, deps in self.dependencies.items()}
+        while remaining:
+            ready = sorted(name for name, deps in remaining.items() if not deps)
+            if not ready:
+                raise ValueError(f"节点依赖存在环: {sorted(remaining)}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return order
+
+    async def run(self, work_unit: Dict[str, Any], on_event: Optional[NodeEventCallback] = None,
+                  checkpoints: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, str]:
+        """
+        执行工作单元
+        Args:
+            work_unit: 工作单元数据，节点结果写入 work_unit["results"]
+            on_event: 节点事件回调，事件包括 start / complete / error / skipped / restored
+            checkpoints: 已完成节点的检查点 {节点名: 输出}，这些节点直接恢复，不再执行
+        Returns:
+            各节点的最终状态
+        """
+        work_unit.setdefault("results", {})
+        work_unit.setdefault("node_states", {})
+
+        states: Dict[str, str] = {}
+        pending = list(self.order)
+        running: Dict[asyncio.Task, str] = {}
+
+        async def emit(name: str, event: str, error: Optional[str] = None):
+            if on_event:
+                try:
+                    await on_event(name, event, work_unit, error)
+                except Exception as e:
+                    logger.error(f"节点事件回调失败: {name} {event}: {str(e)}")
+
+        # 从检查点恢复已完成的节点
+        for name, outputs in (checkpoints or {}).items():
+            node = self.nodes.get(name)
+            if node is None or any(key not in outputs for key in node.outputs):
+                continue
+            pending.remove(name)
+            states[name] = NodeStatus.COMPLETED.value
+            for key in node.outputs:
+                work_unit["results"][key] = outputs[key]
+            state = work_unit["node_states"].get(name, {})
+            work_unit["node_states"][name] = {
+                **state,
+                "status": NodeStatus.COMPLETED.value,
+                "restored": True
+            }
+            await emit(name, "restored")
+
+        try:
+            while pending or running:
+                # 依赖失败的节点直接跳过，依赖全部完成的节点立即启动
+                for name in list(pending):
+                    deps = self.dependencies[name]
+                    if any(states.get(dep) in (NodeStatus.ERROR.value, NodeStatus.SKIPPED.value) for dep in deps):
+                        pending.remove(name)
+                        states[name] = NodeStatus.SKIPPED.value
+                        work_unit["node_states"][name] = {
+                            "status": NodeStatus.SKIPPED.value,
+                            "end_time": datetime.now().isoformat()
+                        }
+                        await emit(name, "skipped")
+                    elif all(states.get(dep) == NodeStatus.COMPLETED.value for dep in deps):
+                        pending.remove(name)
+                        states[name] = NodeStatus.PROCESSING.value
+                        task = asyncio.create_task(self.nodes[name].process(work_unit))
+                        running[task] = name
+                        await emit(name, "start")
+
+                if not running:
+                    # 剩余节点只可能是依赖被跳过的节点，下一轮循环处理
+                    continue
+
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    error = task.exception()
+                    if error:
+                        logger.error(f"节点 {name} 执行失败: {str(error)}")
+                        states[name] = NodeStatus.ERROR.value
+                        await emit(name, "error", str(error))
+                    else:
+                        states[name] = NodeStatus.COMPLETED.value
+                        await emit(name, "complete")
+        except asyncio.CancelledError:
+            # 工作单元被取消：中止运行中的节点，未启动的节点标记为已取消
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            for name in pending:
+                work_unit["node_states"][name] = {
+                    "status": NodeStatus.CANCELLED.value,
+                    "end_time": datetime.now().isoformat()
+                }
+            raise
+        finally:
+            for task in running:
+                task.cancel()
+
+        return states
@@ -0,0 +1,502 @@
+from typing import Dict, Any, Optional, List, Tuple, Sequence
+from collections import OrderedDict
+from datetime import datetime
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 处理中的工作单元不会被热层淘汰
+ACTIVE_STATUSES = ("pending", "processing")
+# 体积大、只在创建和节点完成时变化的字段，与状态字段分开持久化
+PAYLOAD_FIELDS = ("data", "results")
+
+
+def _json_default(obj: Any) -> Any:
+    """序列化工作单元时转换datetime等对象"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _matches(unit: Dict[str, Any], statuses: Optional[Sequence[str]], unit_type: Optional[str],
+             since: Optional[str], until: Optional[str]) -> bool:
+    """工作单元是否符合 query 的过滤条件（创建时间按ISO字符串比较）"""
+    create_time = _json_default(unit.get("create_time"))
+    return ((statuses is None or unit.get("status") in statuses)
+            and (unit_type is None or unit.get("type") == unit_type)
+            and (since is None or create_time >= since)
+            and (until is None or create_time <= until))
+
+
+class WorkUnitStore:
+    """工作单元存储接口"""
+
+    def get(self, unit_id: str) -> Optional[Dict[str, Any]]:
+        """获取工作单元，不存在时返回None"""
+        raise NotImplementedError
+
+    def save(self, unit: Dict[str, Any], payload: bool = True):
+        """
+        保存（新增或更新）工作单元
+        Args:
+            unit: 工作单元
+            payload: data / results 是否有变化；为False时只持久化状态字段
+        """
+        raise NotImplementedError
+
+    def delete(self, unit_id: str):
+        """删除工作单元"""
+        raise NotImplementedError
+
+    def statuses(self) -> Dict[str, str]:
+        """获取所有工作单元的状态 {unit_id: status}"""
+        raise NotImplementedError
+
+    def purge(self, max_age_seconds: Optional[float] = None) -> List[str]:
+        """按TTL和容量清理非活动工作单元，返回被删除的ID"""
+        raise NotImplementedError
+
+    def query(self, statuses: Optional[Sequence[str]] = None, unit_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> Tuple[int, List[str]]:
+        """
+        按状态、类型和创建时间范围分页查询工作单元，按创建时间从新到旧排序
+        Returns:
+            (符合条件的总数, 当前页的工作单元ID)
+        """
+        raise NotImplementedError
+
+    def save_checkpoint(self, unit_id: str, node: str, outputs: Dict[str, Any]):
+        """保存节点输出检查点，按 (工作单元, 节点) 唯一"""
+        raise NotImplementedError
+
+    def load_checkpoints(self, unit_id: str) -> Dict[str, Dict[str, Any]]:
+        """读取工作单元的全部节点检查点 {node: outputs}"""
+        raise NotImplementedError
+
+    def close(self):
+        """释放存储资源"""
+
+    def __contains__(self, unit_id: str) -> bool:
+        return self.get(unit_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.statuses())
+
+
+class MemoryUnitStore(WorkUnitStore):
+    """纯内存存储：不落盘，只按TTL和容量清理"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_units: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_units = max_units
+        self._units: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._updated_at: Dict[str, float] = {}
+        self._checkpoints: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, unit_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._units.get(unit_id)
+
+    def save(self, unit: Dict[str, Any], payload: bool = True):
+        with self._lock:
+            self._units[unit["id"]] = unit
+            self._units.move_to_end(unit["id"])
+            self._updated_at[unit["id"]] = time.time()
+
+    def delete(self, unit_id: str):
+        with self._lock:
+            self._units.pop(unit_id, None)
+            self._updated_at.pop(unit_id, None)
+            self._checkpoints.pop(unit_id, None)
+
+    def save_checkpoint(self, unit_id: str, node: str, outputs: Dict[str, Any]):
+        with self._lock:
+            self._checkpoints.setdefault(unit_id, {})[node] = outputs
+
+    def load_checkpoints(self, unit_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._checkpoints.get(unit_id, {}))
+
+    def statuses(self) -> Dict[str, str]:
+        with self._lock:
+            return {unit_id: unit.get("status") for unit_id, unit in self._units.items()}
+
+    def purge(self, max_age_seconds: Optional[float] = None) -> List[str]:
+        max_age = max_age_seconds if max_age_seconds is not None else self.ttl_seconds
+        deleted = []
+        with self._lock:
+            now = time.time()
+            inactive = [
+                unit_id for unit_id, unit in self._units.items()
+                if unit.get("status") not in ACTIVE_STATUSES
+            ]
+            if max_age is not None:
+                for unit_id in inactive:
+                    if now - self._updated_at[unit_id] > max_age:
+                        deleted.append(unit_id)
+            if self.max_units is not None:
+                overflow = len(self._units) - len(deleted) - self.max_units
+                for unit_id in inactive:
+                    if overflow <= 0:
+                        break
+                    if unit_id not in deleted:
+                        deleted.append(unit_id)
+                        overflow -= 1
+            for unit_id in deleted:
+                del self._units[unit_id]
+                del self._updated_at[unit_id]
+                self._checkpoints.pop(unit_id, None)
+        return deleted
+
+    def query(self, statuses: Optional[Sequence[str]] = None, unit_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> Tuple[int, List[str]]:
+        with self._lock:
+            matched = sorted(
+                ((_json_default(unit.get("create_time")), unit_id) for unit_id, unit in self._units.items()
+                 if _matches(unit, statuses, unit_type, since, until)),
+                reverse=True
+            )
+        return len(matched), [unit_id for _, unit_id in matched[offset:offset + limit]]
+
+
+class TieredUnitStore(WorkUnitStore):
+    """分层存储：内存LRU热层 + SQLite(WAL)磁盘层
+
+    - 保存时立即更新热层，磁盘写入交给后台写线程，不阻塞调用方的事件循环；
+      同一工作单元排队中的多次保存合并为一次写入
+    - 状态字段（status / node_states 等）和 data / results 分列保存，
+      只有状态变化时不重新序列化对话历史和SVG页面
+    - 读取时先查热层和待写队列，未命中再从磁盘懒加载
+    - 热层超过容量时淘汰最久未使用的非活动工作单元
+    """
+
+    def __init__(self, db_path: str, hot_capacity: int = 256,
+                 ttl_seconds: Optional[float] = None, max_units: Optional[int] = None):
+        self.db_path = db_path
+        self.hot_capacity = hot_capacity
+        self.ttl_seconds = ttl_seconds
+        self.max_units = max_units
+        self._hot: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()  # 保护热层和待写队列，持有时间很短
+        self._db_lock = threading.Lock()  # 保护数据库连接，写线程写入一批时持有
+        self._changed = threading.Condition(self._lock)
+        # 待写入的工作单元 {unit_id: (工作单元, 状态, 状态字段JSON, data/results 或 None)}
+        self._pending: Dict[str, Tuple[Dict[str, Any], str, str, Optional[Dict[str, Any]]]] = {}
+        self._pending_checkpoints: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._writing = False
+        self._closed = False
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS work_units (
+                id TEXT PRIMARY KEY,
+                type TEXT,
+                status TEXT,
+                create_time TEXT,
+                updated_at REAL,
+                payload TEXT NOT NULL,
+                state TEXT
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(work_units)")]
+        if "state" not in columns:
+            # 旧版本的表：payload 保存完整的工作单元，state 为空
+            self._conn.execute("ALTER TABLE work_units ADD COLUMN state TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_work_units_updated ON work_units(updated_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_work_units_status ON work_units(status)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_work_units_created ON work_units(create_time)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS node_checkpoints (
+                unit_id TEXT NOT NULL,
+                node TEXT NOT NULL,
+                created_at REAL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (unit_id, node)
+            )
+        """)
+        self._conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="unit-store-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)  # 进程退出前写完待写队列
+
+    @staticmethod
+    def _decode(state: Optional[str], payload: str) -> Dict[str, Any]:
+        """合并状态列和 data / results 列；旧版本的行 payload 中是完整的工作单元"""
+        unit = json.loads(payload)
+        if state:
+            unit.update(json.loads(state))
+        return unit
+
+    def get(self, unit_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            unit = self._hot.get(unit_id)
+            if unit is not None:
+                self._hot.move_to_end(unit_id)
+                return unit
+            pending = self._pending.get(unit_id)
+            if pending is not None:
+                self._remember(pending[0])
+                return pending[0]
+
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT state, payload FROM work_units WHERE id = ?", (unit_id,)
+            ).fetchone()
+        if not row:
+            return None
+
+        unit = self._decode(*row)
+        with self._lock:
+            # 读取磁盘期间工作单元可能刚被保存，以内存中的版本为准
+            current = self._hot.get(unit_id) or self._pending.get(unit_id, (None,))[0]
+            if current is not None:
+                return current
+            self._remember(unit)
+        return unit
+
+    def save(self, unit: Dict[str, Any], payload: bool = True):
+        # 状态字段很小，在调用方序列化，保证写入的是保存时的状态
+        state = json.dumps(
+            {key: value for key, value in unit.items() if key not in PAYLOAD_FIELDS},
+            ensure_ascii=False, default=_json_default
+        )
+        # data / results 整体替换而不是原地修改，只保存引用，由写线程序列化
+        fields = {key: unit.get(key) for key in PAYLOAD_FIELDS} if payload else None
+        with self._lock:
+            previous = self._pending.get(unit["id"])
+            if fields is None and previous is not None:
+                fields = previous[3]  # 合并的写入中有一次改变了 data / results
+            self._pending[unit["id"]] = (unit, unit.get("status"), state, fields)
+            self._remember(unit)
+            self._changed.notify_all()
+
+    def delete(self, unit_id: str):
+        with self._db_lock:
+            with self._lock:
+                self._hot.pop(unit_id, None)
+                self._pending.pop(unit_id, None)
+                for key in [key for key in self._pending_checkpoints if key[0] == unit_id]:
+                    del self._pending_checkpoints[key]
+            self._conn.execute("DELETE FROM work_units WHERE id = ?", (unit_id,))
+            self._conn.execute("DELETE FROM node_checkpoints WHERE unit_id = ?", (unit_id,))
+            self._conn.commit()
+
+    def save_checkpoint(self, unit_id: str, node: str, outputs: Dict[str, Any]):
+        with self._lock:
+            self._pending_checkpoints[(unit_id, node)] = outputs
+            self._changed.notify_all()
+
+    def load_checkpoints(self, unit_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            pending = {
+                node: outputs for (pending_id, node), outputs in self._pending_checkpoints.items()
+                if pending_id == unit_id
+            }
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT node, payload FROM node_checkpoints WHERE unit_id = ?", (unit_id,)
+            ).fetchall()
+        return {**{node: json.loads(payload) for node, payload in rows}, **pending}
+
+    def statuses(self) -> Dict[str, str]:
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, status FROM work_units ORDER BY create_time"
+            ).fetchall()
+        return dict(rows)
+
+    def purge(self, max_age_seconds: Optional[float] = None) -> List[str]:
+        max_age = max_age_seconds if max_age_seconds is not None else self.ttl_seconds
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        self.flush()
+        deleted = []
+        with self._db_lock:
+            with self._lock:
+                # 刚保存、尚未写入的工作单元不参与清理
+                recent = set(self._pending)
+
+            if max_age is not None:
+                rows = self._conn.execute(
+                    f"SELECT id FROM work_units WHERE updated_at < ? AND status NOT IN ({placeholders})",
+                    (time.time() - max_age, *ACTIVE_STATUSES)
+                ).fetchall()
+                deleted.extend(row[0] for row in rows if row[0] not in recent)
+
+            if self.max_units is not None:
+                total = self._conn.execute("SELECT COUNT(*) FROM work_units").fetchone()[0]
+                overflow = total - len(deleted) - self.max_units
+                if overflow > 0:
+                    rows = self._conn.execute(
+                        f"SELECT id FROM work_units WHERE status NOT IN ({placeholders}) "
+                        f"ORDER BY updated_at LIMIT ?",
+                        (*ACTIVE_STATUSES, overflow + len(deleted) + len(recent))
+                    ).fetchall()
+                    for (unit_id,) in rows:
+                        if overflow <= 0:
+                            break
+                        if unit_id not in deleted and unit_id not in recent:
+                            deleted.append(unit_id)
+                            overflow -= 1
+
+            with self._lock:
+                for unit_id in deleted:
+                    self._hot.pop(unit_id, None)
+            self._conn.executemany("DELETE FROM work_units WHERE id = ?", [(unit_id,) for unit_id in deleted])
+            self._conn.executemany("DELETE FROM node_checkpoints WHERE unit_id = ?", [(unit_id,) for unit_id in deleted])
+            self._conn.commit()
+        return deleted
+
+    def query(self, statuses: Optional[Sequence[str]] = None, unit_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> Tuple[int, List[str]]:
+        conditions, params = [], []
+        if statuses is not None:
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            params.extend(statuses)
+        if unit_type is not None:
+            conditions.append("type = ?")
+            params.append(unit_type)
+        if since is not None:
+            conditions.append("create_time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("create_time <= ?")
+            params.append(until)
+
+        with self._db_lock:
+            # 持有数据库锁时写线程不会取走待写队列：待写的工作单元以内存中的版本为准，磁盘上的旧行排除在外
+            with self._lock:
+                pending = [entry[0] for entry in self._pending.values()]
+            matched = [
+                (_json_default(unit.get("create_time")), unit["id"]) for unit in pending
+                if _matches(unit, statuses, unit_type, since, until)
+            ]
+            if pending:
+                conditions.append(f"id NOT IN ({', '.join('?' for _ in pending)})")
+                params.extend(unit["id"] for unit in pending)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            total = self._conn.execute(f"SELECT COUNT(*) FROM work_units{where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT create_time, id FROM work_units{where} ORDER BY create_time DESC, id DESC LIMIT ?",
+                (*params, offset + limit)
+            ).fetchall()
+
+        page = sorted(rows + matched, reverse=True)[offset:offset + limit]
+        return total + len(matched), [unit_id for _, unit_id in page]
+
+    def flush(self):
+        """等待待写队列全部写入磁盘"""
+        with self._lock:
+            while (self._pending or self._pending_checkpoints or self._writing) and self._writer.is_alive():
+                self._changed.wait(0.5)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._changed.notify_all()
+        self._writer.join()
+        with self._db_lock:
+            self._hot.clear()
+            self._conn.close()
+
+    def _write_loop(self):
+        """后台写线程：批量写入待写队列，写完一批后通知等待的 flush"""
+        while True:
+            with self._lock:
+                while not (self._pending or self._pending_checkpoints or self._closed):
+                    self._changed.wait()
+                if self._closed and not (self._pending or self._pending_checkpoints):
+                    return
+
+            with self._db_lock:
+                with self._lock:
+                    units, self._pending = self._pending, {}
+                    checkpoints, self._pending_checkpoints = self._pending_checkpoints, {}
+                    self._writing = True
+                try:
+                    self._write(units, checkpoints)
+                except Exception as e:
+                    logger.error(f"工作单元写入磁盘失败: {str(e)}")
+                finally:
+                    with self._lock:
+                        self._writing = False
+                        self._changed.notify_all()
+
+    def _write(self, units: Dict[str, Tuple[Dict[str, Any], str, str, Optional[Dict[str, Any]]]],
+               checkpoints: Dict[Tuple[str, str], Dict[str, Any]]):
+        """写入一批工作单元和检查点（调用方持有数据库锁）"""
+        now = time.time()
+        for unit_id, (unit, status, state, fields) in units.items():
+            if fields is None:
+                cursor = self._conn.execute(
+                    "UPDATE work_units SET status = ?, updated_at = ?, state = ? WHERE id = ?",
+                    (status, now, state, unit_id)
+                )
+                if cursor.rowcount:
+                    continue
+                fields = {key: unit.get(key) for key in PAYLOAD_FIELDS}
+            self._conn.execute(
+                "INSERT OR REPLACE INTO work_units (id, type, status, create_time, updated_at, payload, state) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (unit_id, unit.get("type"), status, _json_default(unit.get("create_time")), now,
+                 json.dumps(fields, ensure_ascii=False, default=_json_default), state)
+            )
+        for (unit_id, node), outputs in checkpoints.items():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO node_checkpoints (unit_id, node, created_at, payload) VALUES (?, ?, ?, ?)",
+                (unit_id, node, now, json.dumps(outputs, ensure_ascii=False, default=_json_default))
+            )
+        self._conn.commit()
+
+    def _remember(self, unit: Dict[str, Any]):
+        """放入热层并按容量淘汰最久未使用的非活动工作单元"""
+        self._hot[unit["id"]] = unit
+        self._hot.move_to_end(unit["id"])
+        if len(self._hot) <= self.hot_capacity:
+            return
+        for unit_id in list(self._hot):
+            if len(self._hot) <= self.hot_capacity:
+                break
+            if self._hot[unit_id].get("status") not in ACTIVE_STATUSES:
+                del self._hot[unit_id]
+
+
+def create_unit_store() -> WorkUnitStore:
+    """根据环境变量创建工作单元存储
+
+    - WORKFLOW_STORE: sqlite（默认）或 memory
+    - WORKFLOW_DB_PATH: SQLite文件路径，默认 data/workflow.db
+    - WORKFLOW_HOT_UNITS: 内存热层容量，默认256
+    - WORKFLOW_UNIT_TTL_HOURS: 工作单元保留时间（小时），默认168
+    - WORKFLOW_MAX_UNITS: 最多保留的工作单元数量，默认10000
+    """
+    ttl_seconds = float(os.getenv("WORKFLOW_UNIT_TTL_HOURS", "168")) * 3600
+    max_units = int(os.getenv("WORKFLOW_MAX_UNITS", "10000"))
+
+    if os.getenv("WORKFLOW_STORE", "sqlite") == "memory":
+        return MemoryUnitStore(ttl_seconds=ttl_seconds, max_units=max_units)
+
+    return TieredUnitStore(
+        db_path=os.getenv("WORKFLOW_DB_PATH", "data/workflow.db"),
+        hot_capacity=int(os.getenv("WORKFLOW_HOT_UNITS", "256")),
+        ttl_seconds=ttl_seconds,
+        max_units=max_units
+    )
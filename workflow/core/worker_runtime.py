@@ -0,0 +1,119 @@
+from typing import Callable, Awaitable, Any, List, Optional
+from concurrent.futures import Future
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerRuntime:
+    """工作线程运行时：固定数量的长生命周期事件循环，每个循环并发运行多个工作单元
+
+    - 每个工作线程启动时创建一次事件循环和线程级资源（如数据库会话）
+    - submit 把协程投递到负载最低的循环，返回线程安全的 Future
+    """
+
+    def __init__(self, num_loops: int = 2,
+                 thread_initializer: Optional[Callable[[], None]] = None,
+                 thread_finalizer: Optional[Callable[[], None]] = None,
+                 name: str = "workflow-worker"):
+        self.num_loops = max(1, num_loops)
+        self.name = name
+        self._initializer = thread_initializer
+        self._finalizer = thread_finalizer
+        self._loops: List[asyncio.AbstractEventLoop] = []
+        self._threads: List[threading.Thread] = []
+        self._inflight: List[int] = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """启动所有工作线程，等待事件循环就绪后返回"""
+        with self._lock:
+            if self._started:
+                return
+            for index in range(self.num_loops):
+                ready = threading.Event()
+                holder = {}
+                thread = threading.Thread(
+                    target=self._run_loop,
+                    args=(ready, holder),
+                    name=f"{self.name}-{index}",
+                    daemon=True
+                )
+                thread.start()
+                ready.wait()
+                self._loops.append(holder["loop"])
+                self._threads.append(thread)
+                self._inflight.append(0)
+            self._started = True
+            logger.info(f"工作线程运行时已启动: {self.num_loops} 个事件循环")
+
+    def _run_loop(self, ready: threading.Event, holder: dict):
+        """工作线程主函数：初始化线程资源后常驻运行事件循环"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        holder["loop"] = loop
+        try:
+            if self._initializer:
+                self._initializer()
+        except Exception as e:
+            logger.error(f"工作线程初始化失败: {str(e)}")
+        ready.set()
+
+        try:
+            loop.run_forever()
+        finally:
+            try:
+                if self._finalizer:
+                    self._finalizer()
+            except Exception as e:
+                logger.error(f"工作线程清理失败: {str(e)}")
+            loop.close()
+
+    def submit(self, coro_factory: Callable[[], Awaitable[Any]]) -> Future:
+        """
+        在负载最低的事件循环上运行协程
+        Args:
+            coro_factory: 返回协程的函数，在目标循环上调用
+        Returns:
+            concurrent.futures.Future，可在任意线程等待或取消
+        """
+        self.start()
+        with self._lock:
+            index = min(range(self.num_loops), key=lambda i: self._inflight[i])
+            self._inflight[index] += 1
+            loop = self._loops[index]
+
+        async def runner():
+            return await coro_factory()
+
+        future = asyncio.run_coroutine_threadsafe(runner(), loop)
+        future.add_done_callback(lambda _: self._release(index))
+        return future
+
+    def _release(self, index: int):
+        with self._lock:
+            self._inflight[index] -= 1
+
+    def load(self) -> List[int]:
+        """各事件循环上正在运行的工作单元数量"""
+        with self._lock:
+            return list(self._inflight)
+
+    def shutdown(self, wait: bool = False):
+        """停止所有事件循环"""
+        with self._lock:
+            if not self._started:
+                return
+            for loop in self._loops:
+                loop.call_soon_threadsafe(loop.stop)
+            threads = list(self._threads)
+            self._loops.clear()
+            self._threads.clear()
+            self._inflight.clear()
+            self._started = False
+        if wait:
+            for thread in threads:
+                thread.join()
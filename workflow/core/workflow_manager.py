@@ -1,15 +1,41 @@
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Tuple, List, Mapping
+from collections import OrderedDict
+from itertools import islice
 from datetime import datetime
+from types import MappingProxyType
 import uuid
 import asyncio
-from copy import deepcopy
-from concurrent.futures import ThreadPoolExecutor
+import weakref
 from .workflow_thread import WorkflowThread
+from .worker_runtime import WorkerRuntime
+from .admission import AdmissionQueue, create_admission_queue
+from .unit_store import WorkUnitStore, create_unit_store, ACTIVE_STATUSES, PAYLOAD_FIELDS
 import logging
+import os
 from utils.monitor_pool import monitor_pool  # 添加导入
+from utils.event_bus import event_bus
+from utils.llm_gateway import get_llm_gateway
 
 logger = logging.getLogger(__name__)
 
+# 被撤回的工作单元不再接收执行结果和状态更新
+WITHDRAWN_STATUSES = ("superseded", "cancelled")
+# 不会再变化的状态（失败的单元可以重试，重试后重新进入活跃状态）
+FINISHED_STATUSES = ("completed", "failed") + WITHDRAWN_STATUSES
+
+
+def thaw_snapshot(snapshot: Mapping[str, Any]) -> Dict[str, Any]:
+    """把只读状态快照转换为普通字典，便于序列化"""
+    return {
+        **snapshot,
+        "node_states": {name: dict(state) for name, state in snapshot["node_states"].items()}
+    }
+
+
+def status_bucket(status: Optional[str]) -> str:
+    """概览中的状态分组：排队中和处理中都算活跃"""
+    return "active" if status in ACTIVE_STATUSES else (status or "unknown")
+
 
 def datetime_to_str(obj: Any) -> Any:
     """转换datetime对象为ISO格式字符串"""
@@ -21,14 +47,135 @@ def datetime_to_str(obj: Any) -> Any:
 class WorkflowManager:
     """工作流管理器：负责工作单元的创建和管理"""
 
-    def __init__(self):
-        self.work_units = {}  # 存储所有工作单元
+    def __init__(self, store: Optional[WorkUnitStore] = None, admission: Optional[AdmissionQueue] = None):
+        self.work_units = store if store is not None else create_unit_store()  # 工作单元存储（内存热层 + 磁盘层）
         self.workflow_thread = WorkflowThread()
-        self._lock = asyncio.Lock()  # 添加异步锁
-        self._executor = ThreadPoolExecutor(max_workers=3)  # 创建线程池
+        self._lock = asyncio.Lock()  # 全局异步锁，只保护会话状态和清理，只在API事件循环上使用
+        self._unit_locks = weakref.WeakValueDictionary()  # 按工作单元分段的锁 {unit_id: asyncio.Lock}
+        self._snapshots: Dict[str, MappingProxyType] = {}  # 只读状态快照 {unit_id: 快照}
+        self._loop = None  # API事件循环，工作线程通过它回传状态更新
+        self._runtime = WorkerRuntime(
+            num_loops=int(os.getenv("WORKFLOW_WORKER_LOOPS", "2")),
+            thread_initializer=self._open_worker_session,
+            thread_finalizer=self._close_worker_session
+        )
+        self._running = {}  # 正在运行的工作单元 {unit_id: Future}
+        self.admission = admission or create_admission_queue()  # 准入队列
+        self.admission.set_dispatcher(self._dispatch)
+        self._cleanup_interval = float(os.getenv("WORKFLOW_CLEANUP_INTERVAL", "3600"))
+        self._cleanup_task = None
+        # 实时会话的增量处理进度 {session_id: {"watermark", "narrative", "paragraph_count", "tail"}}
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._max_sessions = int(os.getenv("WORKFLOW_MAX_SESSIONS", "1000"))
+        self._unit_done: Dict[str, asyncio.Event] = {}  # 会话内工作单元按顺序执行
+        # 按状态分组的工作单元，随状态变化增量维护；dict 按加入顺序保存ID
+        self._unit_status: Dict[str, str] = {}
+        self._buckets: Dict[str, Dict[str, None]] = {}
+        self._overview_limit = int(os.getenv("WORKFLOW_OVERVIEW_LIMIT", "50"))
+        for unit_id, status in self.work_units.statuses().items():
+            self._track(unit_id, status)
+        self._recover_interrupted_units()
+
+    def _unit_lock(self, unit_id: str) -> asyncio.Lock:
+        """获取工作单元自己的锁，不同工作单元的状态更新互不阻塞"""
+        lock = self._unit_locks.get(unit_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._unit_locks[unit_id] = lock
+        return lock
+
+    def _save(self, work_unit: Dict[str, Any], payload: bool = True):
+        """保存工作单元，更新状态分组并发布新的状态快照
+
+        payload 为False表示 data / results 没有变化，存储只写入状态字段
+        """
+        self.work_units.save(work_unit, payload)
+        self._track(work_unit["id"], work_unit["status"])
+        self._publish(work_unit)
+
+    def _track(self, unit_id: str, status: str):
+        """状态变化时把工作单元移到对应的分组，O(1)"""
+        previous = self._unit_status.get(unit_id)
+        self._unit_status[unit_id] = status
+        if previous is not None and status_bucket(previous) == status_bucket(status):
+            return
+        if previous is not None:
+            self._buckets[status_bucket(previous)].pop(unit_id, None)
+        self._buckets.setdefault(status_bucket(status), {})[unit_id] = None
+
+    def _untrack(self, unit_id: str):
+        status = self._unit_status.pop(unit_id, None)
+        if status is not None:
+            self._buckets[status_bucket(status)].pop(unit_id, None)
+        self._snapshots.pop(unit_id, None)
+
+    @staticmethod
+    def _build_snapshot(work_unit: Dict[str, Any], previous: Optional[Mapping[str, Any]] = None) -> MappingProxyType:
+        """根据工作单元生成只读状态快照，版本号在上一个快照的基础上递增"""
+        return MappingProxyType({
+            "id": work_unit["id"],
+            "type": work_unit["type"],
+            "status": work_unit["status"],
+            "create_time": datetime_to_str(work_unit["create_time"]),
+            "node_states": MappingProxyType({
+                name: MappingProxyType({k: datetime_to_str(v) for k, v in state.items()})
+                for name, state in work_unit.get("node_states", {}).items()
+            }),
+            "error": work_unit.get("error"),
+            "svg_ready": "svg" in work_unit.get("results", {}),
+            "svg_pages": len(work_unit.get("results", {}).get("svg", {}).get("content") or []),
+            "superseded_by": work_unit.get("superseded_by"),
+            "version": previous["version"] + 1 if previous else 1
+        })
+
+    def _publish(self, work_unit: Dict[str, Any]) -> MappingProxyType:
+        """工作单元状态变化后替换状态快照（写时复制）并推送事件，只由 _save 调用"""
+        previous = self._snapshots.get(work_unit["id"])
+        snapshot = self._build_snapshot(work_unit, previous)
+        self._snapshots[work_unit["id"]] = snapshot
+
+        # 推送状态变化，SVG首次就绪时单独通知
+        if event_bus.subscriber_count:
+            event_bus.publish("status", thaw_snapshot(snapshot), work_unit["id"])
+        if snapshot["svg_ready"] and not (previous and previous["svg_ready"]):
+            event_bus.publish("svg_ready", {"pages": snapshot["svg_pages"]}, work_unit["id"])
+        return snapshot
+
+    def _recover_interrupted_units(self):
+        """服务重启后，将上次未处理完的工作单元标记为失败"""
+        for unit_id in list(self._buckets.get("active", {})):
+            unit = self.work_units.get(unit_id)
+            unit["status"] = "failed"
+            unit["error"] = "服务重启，处理中断"
+            self._save(unit, payload=False)
+            logger.warning(f"工作单元 {unit_id} 因服务重启被标记为失败")
+
+    def _ensure_cleanup_task(self):
+        """在当前事件循环中启动周期清理任务"""
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.get_event_loop().create_task(self._periodic_cleanup())
+
+    async def _periodic_cleanup(self):
+        """按TTL和容量预算周期清理工作单元"""
+        while True:
+            await asyncio.sleep(self._cleanup_interval)
+            try:
+                await self.cleanup_old_units()
+            except Exception as e:
+                logger.error(f"清理工作单元失败: {str(e)}")
 
     async def create_work_unit(self, data: Dict[str, Any], unit_type: str) -> str:
-        """创建新的工作单元"""
+        """创建新的工作单元
+
+        data 中带 session_id 时为增量工作单元：
+        - dialogue_history 只包含上次触发之后的新增对话
+        - watermark 为这些对话在会话历史中的起始位置
+        同一会话的工作单元按创建顺序执行，并在上一个单元的叙事基础上续写。
+        同一会话中尚未生成叙事的旧单元会被新单元取代，其新增对话并入新单元。
+
+        Raises:
+            QueueFullError: 准入队列已满
+        """
         unit_id = str(uuid.uuid4())
         work_unit = {
             "id": unit_id,
@@ -43,147 +190,545 @@ class WorkflowManager:
 
         # 使用锁保护工作单元创建
         async with self._lock:
-            self.work_units[unit_id] = work_unit
+            self.admission.check_capacity(unit_type)
+
+            session_id = data.get("session_id")
+            if session_id:
+                session = self._get_session(session_id)
+                work_unit["data"] = await self._absorb_stale_units(
+                    {**data, "previous_unit": session.get("tail")}, unit_id
+                )
+                if session["watermark"] is None:
+                    # 会话的第一个单元：处理进度从它的起始位置开始，
+                    # 这样它失败时后续单元能补上它的对话
+                    session["watermark"] = work_unit["data"].get("watermark", 0)
+                session["tail"] = unit_id
+                self._unit_done[unit_id] = asyncio.Event()
+
+            self._save(work_unit)
 
             # 添加监控点：更新系统工作流状态
             await self._update_workflows_overview()
 
-        # 在新线程中启动工作流处理
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(self._executor, self._run_workflow, unit_id)
+        self._loop = asyncio.get_running_loop()
+        self._ensure_cleanup_task()
+
+        # 进入准入队列，有空闲名额时投递到工作线程的常驻事件循环中处理
+        self.admission.submit(unit_id, unit_type)
 
         return unit_id
 
-    def _run_workflow(self, unit_id: str):
-        """在独立线程中运行工作流"""
-        try:
-            # 创建新的事件循环
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+    def _dispatch(self, unit_id: str):
+        """把工作单元投递到工作线程运行时（由准入队列调用）"""
+        future = self._runtime.submit(lambda: self._run_unit(unit_id))
+        self._running[unit_id] = future
+        future.add_done_callback(
+            lambda _: self._loop.call_soon_threadsafe(self._on_unit_done, unit_id)
+        )
+
+    def _on_unit_done(self, unit_id: str):
+        """工作单元结束：释放准入名额，放行同一会话的下一个单元"""
+        self._running.pop(unit_id, None)
+        self.admission.release(unit_id)
+        event = self._unit_done.pop(unit_id, None)
+        if event:
+            event.set()
+
+    def _get_session(self, session_id: str) -> Dict[str, Any]:
+        """获取会话的增量处理进度，超过上限时淘汰最久未使用的会话"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {"watermark": None, "narrative": None, "paragraph_count": 0, "tail": None}
+            self._sessions[session_id] = session
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _is_stale(self, work_unit: Optional[Dict[str, Any]]) -> bool:
+        """排队中或尚未完成叙事生成的工作单元可以被取代"""
+        if work_unit is None:
+            return False
+        if work_unit["status"] == "pending":
+            return True
+        narrative_state = work_unit["node_states"].get("narrative", {})
+        return work_unit["status"] == "processing" and narrative_state.get("status") != "completed"
+
+    async def _absorb_stale_units(self, data: Dict[str, Any], unit_id: str) -> Dict[str, Any]:
+        """取代同一会话中过时的旧单元，把它们的新增对话并入新单元的数据"""
+        previous = data.get("previous_unit")
+        while previous:
+            stale = self.work_units.get(previous)
+            if not self._is_stale(stale):
+                break
+
+            stale_data = stale["data"]
+            data = {
+                **data,
+                "dialogue_history": list(stale_data.get("dialogue_history", [])) + list(data.get("dialogue_history", [])),
+                "watermark": stale_data.get("watermark", data.get("watermark", 0)),
+                "previous_unit": stale_data.get("previous_unit")
+            }
+            await self._supersede(stale, unit_id)
+            previous = data["previous_unit"]
+        return data
+
+    async def _supersede(self, work_unit: Dict[str, Any], newer_id: str):
+        """把工作单元标记为被新单元取代：移出队列或取消执行，释放工作名额"""
+        unit_id = work_unit["id"]
+        work_unit["status"] = "superseded"
+        work_unit["superseded_by"] = newer_id
+        self._save(work_unit, payload=False)
+        logger.info(f"工作单元 {unit_id} 被 {newer_id} 取代")
+        self._withdraw(unit_id)
+
+        # 添加监控点：工作单元工作流状态
+        await monitor_pool.record(
+            category="workflows",
+            key="execution_log",
+            value={
+                "node": "workflow",
+                "event": "superseded",
+                "status": "superseded",
+                "message": f"被新的工作单元取代: {newer_id}"
+            },
+            unit_id=unit_id,
+            mode="append"
+        )
+
+    def _withdraw(self, unit_id: str):
+        """把工作单元移出准入队列，或取消正在执行的任务，立即释放工作名额"""
+        if self.admission.remove(unit_id):
+            # 尚未派发，直接放行等待它的单元
+            event = self._unit_done.pop(unit_id, None)
+            if event:
+                event.set()
+        else:
+            future = self._running.get(unit_id)
+            if future:
+                future.cancel()
+
+    async def _wait_session_turn(self, unit_id: str):
+        """等待同一会话中前一个工作单元结束"""
+        work_unit = self.work_units.get(unit_id)
+        previous = work_unit["data"].get("previous_unit") if work_unit else None
+        event = self._unit_done.get(previous) if previous else None
+        if event:
+            await event.wait()
+
+    def _session_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """为增量工作单元补充会话上下文：已有叙事、对话和段落偏移，并对齐新增对话"""
+        session_id = data.get("session_id")
+        if not session_id or session_id not in self._sessions:
+            return data
+
+        session = self._get_session(session_id)
+        start = data.get("watermark", 0)
+        committed = session["watermark"] if session["watermark"] is not None else start
+        delta = list(data.get("dialogue_history", []))
+
+        if committed > start:
+            # 部分对话已被之前的单元处理过
+            delta = delta[committed - start:]
+        elif committed < start:
+            # 之前的单元失败，补上它们未处理的对话
+            delta = self._missing_turns(data.get("previous_unit"), committed, start) + delta
+
+        return {
+            **data,
+            "dialogue_history": delta,
+            "previous_narrative": session["narrative"],
+            "dialogue_offset": committed,  # 对齐后的新增对话从会话已提交的位置开始
+            "paragraph_offset": session["paragraph_count"]
+        }
 
-            # 获取该线程的数据库会话
-            from database.mysql_connector import db_manager
-            session = db_manager.get_session()
+    def _missing_turns(self, unit_id: Optional[str], start: int, end: int, depth: int = 0) -> List[Dict[str, Any]]:
+        """沿会话中的前序单元收集 [start, end) 区间的对话"""
+        if not unit_id or start >= end or depth > 50:
+            return []
+        unit = self.work_units.get(unit_id)
+        if unit is None:
+            return []
+        data = unit["data"]
+        unit_start = data.get("watermark", 0)
+        turns = data.get("dialogue_history", [])
+        earlier = self._missing_turns(data.get("previous_unit"), start, unit_start, depth + 1)
+        return earlier + turns[max(0, start - unit_start):max(0, end - unit_start)]
+
+    def _turns_committed(self, work_unit: Dict[str, Any]) -> bool:
+        """实时会话中工作单元的全部对话是否已被后续单元并入并提交"""
+        data = work_unit["data"]
+        session = self._sessions.get(data.get("session_id"))
+        if session is None or session["watermark"] is None:
+            return False
+        return data.get("watermark", 0) + len(data.get("dialogue_history", [])) <= session["watermark"]
+
+    def _commit_session(self, work_unit: Dict[str, Any]):
+        """工作单元完成后推进会话的处理进度"""
+        data = work_unit["data"]
+        session_id = data.get("session_id")
+        results = work_unit.get("results", {})
+        if not session_id or "narrative" not in results:
+            return
+
+        session = self._get_session(session_id)
+        end = data.get("watermark", 0) + len(data.get("dialogue_history", []))
+        if session["watermark"] is not None and end < session["watermark"]:
+            return
+
+        session["watermark"] = end
+        session["narrative"] = results["narrative"]["content"]
+        if "analyse" in results and not work_unit.get("paragraphs_counted"):
+            session["paragraph_count"] += len(results["analyse"].get("content", []))
+            work_unit["paragraphs_counted"] = True
+
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """获取准入队列统计，附带模型调用网关和响应缓存的情况"""
+        gateway = get_llm_gateway()
+        return {
+            **self.admission.stats(),
+            "llm_gateway": gateway.stats(),
+            "llm_cache": gateway.cache_stats()
+        }
 
-            try:
-                # 运行工作流处理
-                loop.run_until_complete(self._process_unit(unit_id))
-            finally:
-                # 清理数据库会话
-                db_manager.close_session()
+    @staticmethod
+    def _open_worker_session():
+        """工作线程启动时获取该线程的数据库会话"""
+        from database.mysql_connector import db_manager
+        db_manager.get_session()
+
+    @staticmethod
+    def _close_worker_session():
+        """工作线程退出时清理数据库会话"""
+        from database.mysql_connector import db_manager
+        db_manager.close_session()
+
+    async def _call_api(self, coro):
+        """在API事件循环上执行协程（工作线程 -> API循环的线程安全交接）"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    async def _run_unit(self, unit_id: str):
+        """在工作线程的事件循环上处理工作单元"""
+        try:
+            await self._call_api(self._wait_session_turn(unit_id))
+            started = await self._call_api(self._start_unit(unit_id))
+            if started is None:
+                return
+            work_unit, checkpoints = started
+
+            # 处理工作单元，状态更新回传到API事件循环
+            result = await self.workflow_thread.process(
+                work_unit,
+                status_callback=self._report_status,
+                checkpoints=checkpoints,
+                checkpoint_callback=self._report_checkpoint
+            )
+            await self._call_api(self._finish_unit(unit_id, result))
 
         except Exception as e:
-            logger.error(f"工作流线程异常: {str(e)}")
-        finally:
-            loop.close()
+            logger.error(f"工作单元处理失败: {str(e)}")
+            await self._call_api(self._finish_unit(unit_id, None, error=str(e)))
+
+    async def _report_status(self, unit_id: str, status_update: Dict[str, Any]):
+        """工作线程中的状态回调"""
+        await self._call_api(self._update_status(unit_id, status_update))
 
-    async def _process_unit(self, unit_id: str):
-        """处理工作单元"""
+    async def _report_checkpoint(self, unit_id: str, node_name: str, outputs: Dict[str, Any]):
+        """工作线程中的检查点回调"""
+        await self._call_api(self._save_checkpoint(unit_id, node_name, outputs))
+
+    async def _save_checkpoint(self, unit_id: str, node_name: str, outputs: Dict[str, Any]):
+        """节点完成后持久化其输出"""
         try:
-            # 更新状态为处理中
-            async with self._lock:
-                work_unit = self.work_units[unit_id]
+            self.work_units.save_checkpoint(unit_id, node_name, outputs)
+        except Exception as e:
+            logger.error(f"保存检查点失败: {unit_id}/{node_name}: {str(e)}")
+
+    async def retry_unit(self, unit_id: str) -> Optional[Dict[str, Any]]:
+        """
+        重试失败的工作单元，只重新执行失败或缺失的节点
+        Args:
+            unit_id: 工作单元ID
+        Returns:
+            {"unit_id", "status", "pending_nodes"}，工作单元不存在时返回None
+        Raises:
+            ValueError: 工作单元不处于可重试状态
+            QueueFullError: 准入队列已满
+        """
+        async with self._unit_lock(unit_id):
+            work_unit = self.work_units.get(unit_id)
+            if work_unit is None:
+                logger.error(f"工作单元不存在: {unit_id}")
+                return None
 
-                logger.info(f"工作流 {unit_id} 开始处理")
-                logger.info(f"原始状态: {work_unit.get('status', 'unknown')}")
+            if work_unit["status"] != "failed":
+                raise ValueError(f"工作单元状态为 {work_unit['status']}，只能重试失败的工作单元")
+            if self._turns_committed(work_unit):
+                # 重试只会重复保存后续单元已经处理过的对话
+                raise ValueError("工作单元的对话已由同一会话的后续工作单元处理，不需要重试")
 
-                work_unit["status"] = "processing"
+            self.admission.check_capacity(work_unit["type"])
 
-                logger.info(f"更新为处理中状态: {work_unit['status']}")
+            checkpoints = self.work_units.load_checkpoints(unit_id)
+            pending_nodes = [name for name in self.workflow_thread.scheduler.order if name not in checkpoints]
 
-                # 添加监控点：更新系统工作流状态
-                await self._update_workflows_overview()
+            # 清除未完成节点的状态，已完成节点从检查点恢复
+            work_unit["node_states"] = {
+                name: state for name, state in work_unit["node_states"].items()
+                if name in checkpoints
+            }
+            work_unit["status"] = "pending"
+            work_unit["error"] = None
+            work_unit["retry_count"] = work_unit.get("retry_count", 0) + 1
+            self._save(work_unit, payload=False)
+            logger.info(f"重试工作单元 {unit_id}，待执行节点: {pending_nodes}")
 
-            # 处理工作单元
-            result = await self.workflow_thread.process(
-                work_unit,
-                status_callback=self._update_status
-            )
+            # 添加监控点：更新系统工作流状态
+            await self._update_workflows_overview()
 
-            # 更新处理结果
-            async with self._lock:
+        self._loop = asyncio.get_running_loop()
+        self.admission.submit(unit_id, work_unit["type"])
+
+        return {
+            "unit_id": unit_id,
+            "status": "pending",
+            "pending_nodes": pending_nodes
+        }
+
+    async def _start_unit(self, unit_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]]:
+        """更新状态为处理中，返回交给工作线程的工作副本和已有的节点检查点"""
+        async with self._unit_lock(unit_id):
+            work_unit = self.work_units.get(unit_id)
+            if work_unit is None:
+                logger.error(f"工作单元不存在: {unit_id}")
+                return None
+            if work_unit["status"] in WITHDRAWN_STATUSES:
+                logger.info(f"工作单元 {unit_id} 已{'被取代' if work_unit['status'] == 'superseded' else '取消'}，跳过处理")
+                return None
+
+            logger.info(f"工作流 {unit_id} 开始处理")
+            logger.info(f"原始状态: {work_unit.get('status', 'unknown')}")
+
+            work_unit["status"] = "processing"
+            self._save(work_unit, payload=False)
+
+            logger.info(f"更新为处理中状态: {work_unit['status']}")
+
+            # 添加监控点：更新系统工作流状态
+            await self._update_workflows_overview()
+
+            # 工作线程只修改自己的副本，状态通过回调交回API循环
+            work_copy = {
+                **work_unit,
+                "data": self._session_data(work_unit["data"]),
+                "results": dict(work_unit["results"]),
+                "node_states": {name: dict(state) for name, state in work_unit["node_states"].items()}
+            }
+
+            # 已完成节点的检查点，重试时这些节点不再执行
+            return work_copy, self.work_units.load_checkpoints(unit_id)
+
+    async def _finish_unit(self, unit_id: str, result: Optional[Dict[str, Any]], error: Optional[str] = None):
+        """记录工作单元的最终结果"""
+        async with self._unit_lock(unit_id):
+            work_unit = self.work_units.get(unit_id)
+            if work_unit is None or work_unit["status"] in WITHDRAWN_STATUSES:
+                return
+
+            if result is not None:
                 logger.info(f"工作流 {unit_id} 处理完成")
                 logger.info(f"处理结果: {result.get('status', 'unknown')}")
-                self.work_units[unit_id].update(result)
+                work_unit.update({
+                    "results": result.get("results", {}),
+                    "node_states": result.get("node_states", {}),
+                    "error": result.get("error")
+                })
 
                 # 只更新主要状态
                 if result.get("status") == "failed":
-                    self.work_units[unit_id]["status"] = "failed"
+                    work_unit["status"] = "failed"
                 else:
-                    self.work_units[unit_id]["status"] = "completed"
+                    work_unit["status"] = "completed"
+                self._commit_session(work_unit)
+            else:
+                work_unit["status"] = "failed"
+                work_unit["error"] = error
 
-                logger.info(f"最终状态: {self.work_units[unit_id]['status']}")
-                await self._update_workflows_overview()  # 需要添加这行
+            self._save(work_unit, payload=result is not None)
+            logger.info(f"最终状态: {work_unit['status']}")
 
-        except Exception as e:
-            logger.error(f"工作单元处理失败: {str(e)}")
-            async with self._lock:
-                self.work_units[unit_id]["status"] = "failed"
-                self.work_units[unit_id]["error"] = str(e)
+            # 添加监控点：更新系统工作流状态
+            await self._update_workflows_overview()
+
+    async def cancel_unit(self, unit_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取消排队中或处理中的工作单元，立即释放其工作名额
+        Args:
+            unit_id: 工作单元ID
+        Returns:
+            {"unit_id", "status", "cancelled_nodes"}，工作单元不存在时返回None
+        Raises:
+            ValueError: 工作单元已经结束
+        """
+        async with self._unit_lock(unit_id):
+            work_unit = self.work_units.get(unit_id)
+            if work_unit is None:
+                logger.error(f"工作单元不存在: {unit_id}")
+                return None
 
-                # 添加监控点：更新系统工作流状态
-                await self._update_workflows_overview()
+            if work_unit["status"] not in ACTIVE_STATUSES:
+                raise ValueError(f"工作单元状态为 {work_unit['status']}，只能取消排队中或处理中的工作单元")
+
+            # 未结束的节点记录为已取消
+            now = datetime.now().isoformat()
+            cancelled_nodes = []
+            for name in self.workflow_thread.scheduler.order:
+                state = work_unit["node_states"].get(name, {})
+                if state.get("status") not in ("completed", "error", "skipped"):
+                    work_unit["node_states"][name] = {**state, "status": "cancelled", "end_time": now}
+                    cancelled_nodes.append(name)
+
+            work_unit["status"] = "cancelled"
+            work_unit["error"] = "已取消"
+            self._save(work_unit, payload=False)
+            logger.info(f"取消工作单元 {unit_id}，取消节点: {cancelled_nodes}")
+            self._withdraw(unit_id)
+
+            # 添加监控点：更新系统工作流状态
+            await self._update_workflows_overview()
+
+        # 添加监控点：工作单元工作流状态
+        await monitor_pool.record(
+            category="workflows",
+            key="execution_log",
+            value={
+                "node": "workflow",
+                "event": "cancelled",
+                "status": "cancelled",
+                "message": "工作单元已取消"
+            },
+            unit_id=unit_id,
+            mode="append"
+        )
+
+        return {
+            "unit_id": unit_id,
+            "status": "cancelled",
+            "cancelled_nodes": cancelled_nodes
+        }
 
     async def _update_status(self, unit_id: str, status_update: Dict[str, Any]):
         """更新工作单元状态"""
         try:
-            async with self._lock:
-                if unit_id in self.work_units:
-                    self.work_units[unit_id].update(status_update)
+            async with self._unit_lock(unit_id):
+                work_unit = self.work_units.get(unit_id)
+                # 已撤回的单元不再接收执行中的状态更新
+                if work_unit is not None and work_unit["status"] not in WITHDRAWN_STATUSES:
+                    work_unit.update(status_update)
+                    # 只有节点完成时带 results，其余状态回调只写入状态字段
+                    self._save(work_unit, payload=any(key in status_update for key in PAYLOAD_FIELDS))
 
         except Exception as e:
             logger.error(f"状态更新失败: {str(e)}")
 
-    async def get_unit_status(self, unit_id: str) -> Optional[Dict]:
-        """获取工作单元状态"""
+    async def get_unit_status(self, unit_id: str) -> Optional[Mapping[str, Any]]:
+        """
+        获取工作单元状态
+        返回只读的状态快照，不加锁也不复制整个工作单元；
+        快照随每次状态变化整体替换，读到的总是某个完整版本
+        """
         try:
-            async with self._lock:
-                if unit_id not in self.work_units:
-                    logger.error(f"工作单元不存在: {unit_id}")
-                    return None
-
-                # 创建深拷贝避免状态读取时的资源竞争
-                unit = deepcopy(self.work_units[unit_id])
-
-            # 验证状态数据完整性
-            if not isinstance(unit, dict):
-                logger.error(f"工作单元数据格式错误: {type(unit)}")
-                return None
+            return self._snapshot(unit_id)
+        except Exception as e:
+            logger.error(f"获取工作单元状态异常: {str(e)}")
+            return None
 
-            required_fields = ["id", "type", "status", "create_time", "node_states"]
-            if not all(field in unit for field in required_fields):
-                logger.error(f"工作单元数据不完整: {unit.keys()}")
-                return None
+    def _snapshot(self, unit_id: str) -> Optional[Mapping[str, Any]]:
+        """读取状态快照，重启后首次读取时从存储懒加载"""
+        snapshot = self._snapshots.get(unit_id)
+        if snapshot is not None:
+            return snapshot
 
-            logger.info(f"获取工作单元状态: {unit_id}, 当前状态: {unit['status']}")
-
-            # 添加更多日志来调试
-            logger.debug(f"工作单元完整数据: {unit}")
-
-            return {
-                "id": unit["id"],
-                "type": unit["type"],
-                "status": unit["status"],
-                "create_time": unit["create_time"],
-                "node_states": {
-                    name: {k: datetime_to_str(v) for k, v in state.items()}
-                    for name, state in unit["node_states"].items()
-                },
-                "error": unit.get("error"),
-                "svg_ready": "svg" in unit.get("results", {})
-            }
+        unit = self.work_units.get(unit_id)
+        if unit is None:
+            logger.error(f"工作单元不存在: {unit_id}")
+            return None
 
-        except Exception as e:
-            logger.error(f"获取工作单元状态异常: {str(e)}")
+        required_fields = ["id", "type", "status", "create_time", "node_states"]
+        if not all(field in unit for field in required_fields):
+            logger.error(f"工作单元数据不完整: {unit.keys()}")
             return None
 
-    async def get_svg_result(self, unit_id: str) -> Optional[Dict]:
-        """获取SVG生成结果"""
+        # 只是补建缓存，状态没有变化：不递增版本号，也不推送事件
+        snapshot = self._build_snapshot(unit)
+        self._snapshots[unit_id] = snapshot
+        return snapshot
+
+    def get_unit_statuses(self, unit_ids: List[str]) -> Dict[str, Optional[Mapping[str, Any]]]:
+        """
+        批量获取工作单元状态
+        在事件循环上一次性读取全部快照，中间不让出控制权，
+        返回的是同一时刻的状态；不存在的工作单元为None
+        """
+        statuses = {}
+        for unit_id in unit_ids:
+            try:
+                statuses[unit_id] = self._snapshot(unit_id)
+            except Exception as e:
+                logger.error(f"获取工作单元状态异常: {unit_id}: {str(e)}")
+                statuses[unit_id] = None
+        return statuses
+
+    def list_units(self, status: Optional[str] = None, unit_type: Optional[str] = None,
+                   since: Optional[str] = None, until: Optional[str] = None,
+                   offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """
+        按条件分页列出工作单元状态快照，从新到旧排序
+        Args:
+            status: 状态分组（active / completed / failed / superseded / cancelled）
+            unit_type: 工作单元类型（realtime / import）
+            since / until: 创建时间范围（ISO格式，含边界）
+            offset: 跳过的条数
+            limit: 返回的条数
+        Returns:
+            {"total", "offset", "limit", "items": [状态快照]}
+        """
+        ids = self._unit_status if status is None else self._buckets.get(status, {})
+        if unit_type is None and since is None and until is None:
+            # 只按状态过滤时直接从分组分页，不需要读取快照
+            page = islice(reversed(ids), offset, offset + limit)
+            items = [snapshot for snapshot in map(self._snapshot, page) if snapshot is not None]
+            return {"total": len(ids), "offset": offset, "limit": limit, "items": items}
+
+        # 按类型或时间过滤时交给存储分页，只为当前页生成快照
+        statuses = None if status is None else (ACTIVE_STATUSES if status == "active" else (status,))
+        total, page = self.work_units.query(statuses, unit_type, since, until, offset, limit)
+        items = [snapshot for snapshot in map(self._snapshot, page) if snapshot is not None]
+        return {"total": total, "offset": offset, "limit": limit, "items": items}
+
+    async def get_svg_result(self, unit_id: str, page: int = 1) -> Optional[Dict]:
+        """
+        获取SVG生成结果的指定页
+        Args:
+            unit_id: 工作单元ID
+            page: 页码，从1开始
+        Returns:
+            {"content", "type", "metadata", "page", "page_count"}，SVG不存在时返回None
+        Raises:
+            IndexError: 页码超出范围
+        """
         try:
-            if unit_id not in self.work_units:
+            # 热层未命中时从磁盘层懒加载
+            unit = self.work_units.get(unit_id)
+            if unit is None:
                 return None
 
-            unit = self.work_units[unit_id]
             if "svg" not in unit["results"]:
                 return None
 
@@ -197,67 +742,129 @@ class WorkflowManager:
             if not svg_data["content"]:  # 检查内容是否为空
                 logger.error("SVG内容为空")
                 return None
-
-            # 转换为符合 SVGResult 模型的格式
-            return {
-                "content": svg_data["content"][0],  # 取第一页SVG内容
-                "type": svg_data["type"],
-                "metadata": svg_data["metadata"]
-            }
         except Exception as e:
             logger.error(f"获取SVG结果出错: {str(e)}")
             return None
 
-    async def cleanup_old_units(self, max_age_hours: int = 24):
-        """清理旧的工作单元"""
-        now = datetime.now()
-        to_delete = []
+        pages = svg_data["content"]  # BookSVGService返回的是页面列表
+        if not 1 <= page <= len(pages):
+            raise IndexError(f"页码超出范围: {page}，共 {len(pages)} 页")
+
+        # 转换为符合 SVGResult 模型的格式
+        return {
+            "content": pages[page - 1],
+            "type": svg_data["type"],
+            "metadata": svg_data["metadata"],
+            "page": page,
+            "page_count": len(pages)
+        }
 
-        for unit_id, unit in self.work_units.items():
-            create_time = datetime.fromisoformat(unit["create_time"])
-            age = now - create_time
-            if age.total_seconds() > max_age_hours * 3600:
-                to_delete.append(unit_id)
+    async def iter_svg_pages(self, unit_id: str):
+        """
+        逐页产出SVG，SVG尚未生成时等待SVG节点完成
+        Yields:
+            {"page", "page_count", "content"}
+        Raises:
+            KeyError: 工作单元不存在
+            RuntimeError: 工作单元结束但没有生成SVG
+        """
+        subscription = event_bus.subscribe({unit_id})
+        try:
+            while True:
+                unit = self.work_units.get(unit_id)
+                if unit is None:
+                    raise KeyError(f"工作单元不存在: {unit_id}")
+
+                pages = unit["results"].get("svg", {}).get("content")
+                if pages:
+                    for index, content in enumerate(pages, 1):
+                        yield {"page": index, "page_count": len(pages), "content": content}
+                    return
+
+                if unit["status"] in FINISHED_STATUSES:
+                    raise RuntimeError(unit.get("error") or "SVG未生成")
+
+                # 等待下一次状态变化再检查
+                await subscription.get(timeout=15)
+        finally:
+            subscription.close()
 
-        for unit_id in to_delete:
-            del self.work_units[unit_id]
+    async def cleanup_old_units(self, max_age_hours: Optional[float] = None):
+        """清理旧的工作单元（不指定时间时使用存储配置的TTL和容量预算）"""
+        max_age_seconds = max_age_hours * 3600 if max_age_hours is not None else None
+        async with self._lock:
+            deleted = self.work_units.purge(max_age_seconds)
+            for unit_id in deleted:
+                self._untrack(unit_id)
+            # 监控池中的执行日志和节点结果随工作单元一起删除
+            await monitor_pool.remove_units(deleted)
+            if deleted:
+                logger.info(f"清理工作单元 {len(deleted)} 个")
 
-        # 添加监控点：更新系统工作流状态
-        await self._update_workflows_overview()
+            # 添加监控点：更新系统工作流状态
+            await self._update_workflows_overview()
 
     def __del__(self):
         """清理资源"""
-        self._executor.shutdown(wait=False)
+        self._runtime.shutdown(wait=False)
+        self.work_units.close()
+
+    def _recent(self, ids: Dict[str, Any], limit: int) -> List[str]:
+        """取最近加入的 limit 个ID，按从旧到新排列"""
+        return list(islice(reversed(ids), limit))[::-1]
+
+    def _status_counts(self) -> Dict[str, int]:
+        counts = {bucket: len(ids) for bucket, ids in self._buckets.items()}
+        counts["total"] = len(self._unit_status)
+        return counts
+
+    def get_overview(self, status: Optional[str] = None, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """
+        分页读取工作流概览
+        Args:
+            status: 状态分组（active / completed / failed / superseded / cancelled），为空时返回全部
+            offset: 跳过的条数，按从新到旧排序
+            limit: 返回的条数
+        Returns:
+            {"counts", "status", "total", "offset", "limit", "items": [{"id", "status"}]}
+        """
+        ids = self._unit_status if status is None else self._buckets.get(status, {})
+        page = islice(reversed(ids), offset, offset + limit)
+        return {
+            "counts": self._status_counts(),
+            "status": status,
+            "total": len(ids),
+            "offset": offset,
+            "limit": limit,
+            "items": [{"id": unit_id, "status": self._unit_status[unit_id]} for unit_id in page]
+        }
 
-    # 添加新的辅助方法
     async def _update_workflows_overview(self):
-        """更新工作流概览监控点"""
-        # 添加详细的状态日志
-        logger.info("=== 工作流状态更新 ===")
-        for wid, unit in self.work_units.items():
-            logger.info(f"工作流 {wid}: status={unit.get('status', 'unknown')}")
+        """更新工作流概览监控点
 
-        # 构建概览数据
+        状态分组随状态变化增量维护，这里只读取计数和每组最近的
+        WORKFLOW_OVERVIEW_LIMIT 个ID，开销与工作单元总数无关；
+        完整列表通过 get_overview 分页读取
+        """
+        limit = self._overview_limit
         overview = {
-            "all_workflows": list(self.work_units.keys()),
-            "active_workflows": [
-                wid for wid, unit in self.work_units.items()
-                if unit.get("status") in ["pending", "processing"]
-            ],
-            "completed_workflows": [
-                wid for wid, unit in self.work_units.items()
-                if unit.get("status") == "completed"
-            ],
-            "failed_workflows": [
-                wid for wid, unit in self.work_units.items()
-                if unit.get("status") == "failed"
-            ]
+            "all_workflows": self._recent(self._unit_status, limit),
+            "active_workflows": self._recent(self._buckets.get("active", {}), limit),
+            "completed_workflows": self._recent(self._buckets.get("completed", {}), limit),
+            "failed_workflows": self._recent(self._buckets.get("failed", {}), limit),
+            "counts": self._status_counts()
         }
-
-        logger.info(f"工作流概览数据: {overview}")
+        logger.debug(f"工作流概览计数: {overview['counts']}")
 
         await monitor_pool.record(
             category="system",
             key="workflows_overview",
             value=overview
+        )
+
+        # 添加监控点：准入队列深度与等待时间
+        await monitor_pool.record(
+            category="system",
+            key="admission_queue",
+            value=self.admission.stats()
         )
\ No newline at end of file
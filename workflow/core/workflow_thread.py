@@ -1,8 +1,8 @@
-from typing import Dict, Any
-import asyncio
+from typing import Dict, Any, Optional
 import logging
-from datetime import datetime
 from utils.monitor_pool import monitor_pool  # 添加导入
+from .node import load_node_timeouts
+from .scheduler import DAGScheduler
 from .node_types import (
     ConversationNode,
     NarrativeNode,
@@ -12,238 +12,86 @@ from .node_types import (
 
 logger = logging.getLogger(__name__)
 
+# 节点事件对应的执行日志
+EVENT_LOG = {
+    "start": ("processing", "开始执行"),
+    "complete": ("completed", "执行完成"),
+    "error": ("failed", "执行失败"),
+    "skipped": ("skipped", "上游节点失败，已跳过"),
+    "restored": ("completed", "已从检查点恢复"),
+}
+
 
 class WorkflowThread:
     """工作流执行器：负责执行单个工作单元的处理流程"""
 
     def __init__(self):
-        # 初始化所有节点
+        # 初始化所有节点，节点间的依赖由各节点声明的输入输出决定
         self.narrative_node = NarrativeNode()
         self.svg_node = SVGNode()
         self.analysis_node = AnalysisNode()
-
-    async def process(self, work_unit: Dict[str, Any], status_callback=None) -> Dict[str, Any]:
-        """处理工作单元"""
+        self.scheduler = DAGScheduler([
+            self.narrative_node,
+            self.svg_node,
+            self.analysis_node
+        ])
+
+        # 按节点类型设置执行期限
+        timeouts = load_node_timeouts()
+        for node in self.scheduler.nodes.values():
+            node.timeout = timeouts.get(node.name) or None
+
+    async def process(self, work_unit: Dict[str, Any], status_callback=None,
+                      checkpoints: Optional[Dict[str, Dict[str, Any]]] = None,
+                      checkpoint_callback=None) -> Dict[str, Any]:
+        """
+        处理工作单元
+        Args:
+            work_unit: 工作单元数据
+            status_callback: 状态回调 (unit_id, 状态更新)
+            checkpoints: 之前运行保存的节点检查点，对应节点不再执行
+            checkpoint_callback: 节点完成后的检查点回调 (unit_id, 节点名, 输出)
+        """
         try:
             if not work_unit or "id" not in work_unit:
                 raise ValueError("无效的工作单元：缺少ID")
-                
+
             unit_id = work_unit["id"]
             logger.info(f"开始处理工作单元: {unit_id}")
 
             # 添加监控点：工作单元工作流状态
-            await monitor_pool.record(
-                category="workflows",
-                key="execution_log",
-                value={
-                    "node": "workflow",
-                    "event": "start",
-                    "status": "processing",
-                    "message": "开始处理工作流"
-                },
-                unit_id=unit_id,
-                mode="append"
-            )
-
-            # 确保结果字典存在
-            if "results" not in work_unit:
-                work_unit["results"] = {}
-            
-            # 叙事生成阶段
-            logger.info(f"开始生成叙事: {unit_id}")
+            await self._log_event(unit_id, "workflow", "start", "processing", "开始处理工作流")
 
-            # 添加监控点：工作单元工作流状态
-            await monitor_pool.record(
-                category="workflow",
-                key="execution_log",
-                value={
-                    "node": "narrative",
-                    "event": "start",
-                    "status": "processing",
-                    "message": "开始生成叙事"
-                },
-                unit_id=unit_id,
-                mode="append"
-            )
-
-            work_unit["status"] = "generating_narrative"
-            work_unit["node_states"]["narrative"] = {
-                "status": "processing",
-                "start_time": datetime.now().isoformat()
-            }
-            if status_callback:
-                await status_callback(unit_id, {
-                    "status": work_unit["status"],
-                    "node_states": work_unit["node_states"]
-                })
-            
-            # 叙事生成
-            work_unit = await self.narrative_node.process(work_unit)
-            work_unit["node_states"]["narrative"]["status"] = "completed"
-            work_unit["node_states"]["narrative"]["end_time"] = datetime.now().isoformat()
-            logger.info(f"叙事生成完成: {unit_id}")
-
-            # 添加监控点：工作单元工作流状态
-            await monitor_pool.record(
-                category="workflow",
-                key="execution_log",
-                value={
-                    "node": "narrative",
-                    "event": "complete",
-                    "status": "completed",
-                    "message": "叙事生成完成"
-                },
-                unit_id=unit_id,
-                mode="append"
-            )
-
-            if status_callback:
-                await status_callback(unit_id, {
-                    "node_states": work_unit["node_states"]
-                })
-            
-            # SVG生成阶段
-            logger.info(f"开始生成SVG: {unit_id}")
-
-            # 开始分析叙述体
-            logger.info(f"开始分析叙述体: {unit_id}")
-
-            # 添加监控点：工作单元工作流状态
-            await monitor_pool.record(
-                category="workflow",
-                key="execution_log",
-                value={
-                    "node": "parallel",
-                    "event": "start",
-                    "status": "processing",
-                    "message": "开始并行处理SVG和分析任务"
-                },
-                unit_id=unit_id,
-                mode="append"
-            )
-
-            work_unit["status"] = "generating_svg"
-            work_unit["node_states"]["svg"] = {
-                "status": "processing",
-                "start_time": datetime.now().isoformat()
-            }
-            if status_callback:
-                await status_callback(unit_id, {
-                    "status": work_unit["status"],
-                    "node_states": work_unit["node_states"]
-                })
-            
-            # 并行处理SVG和分析
-            svg_task = asyncio.create_task(self.svg_node.process(work_unit.copy()))
-            analysis_task = asyncio.create_task(self.analysis_node.process(work_unit.copy()))
-            
-            try:
-                # 等待SVG结果
-                svg_result = await svg_task
-                if svg_result and "results" in svg_result:
-                    work_unit["results"].update(svg_result["results"])
-                    work_unit["status"] = "svg_completed"
-                    work_unit["node_states"]["svg"]["status"] = "completed"
-                    work_unit["node_states"]["svg"]["end_time"] = datetime.now().isoformat()
-                    logger.info(f"SVG生成完成: {unit_id}")
-
-                    # 添加监控点：工作单元工作流状态
-                    await monitor_pool.record(
-                        category="workflow",
-                        key="execution_log",
-                        value={
-                            "node": "svg",
-                            "event": "complete",
-                            "status": "completed",
-                            "message": "SVG生成完成"
-                        },
-                        unit_id=unit_id,
-                        mode="append"
+            async def on_event(node_name: str, event: str, unit: Dict[str, Any], error: Optional[str]):
+                if event == "complete" and checkpoint_callback:
+                    node = self.scheduler.nodes[node_name]
+                    await checkpoint_callback(
+                        unit_id, node_name, {key: unit["results"][key] for key in node.outputs}
                     )
+                await self._on_node_event(node_name, event, unit, error, status_callback)
+
+            states = await self.scheduler.run(work_unit, on_event=on_event, checkpoints=checkpoints)
+
+            failed = [name for name, state in states.items() if state != "completed"]
+            if failed:
+                errors = [
+                    f"{name}: {work_unit['node_states'][name].get('error', '已跳过')}"
+                    for name in failed
+                ]
+                work_unit["status"] = "failed"
+                work_unit["error"] = "; ".join(errors)
+                await self._log_event(unit_id, "workflow", "error", "failed", f"工作流处理失败: {work_unit['error']}")
+            else:
+                work_unit["status"] = "completed"
+                await self._log_event(unit_id, "workflow", "complete", "completed", "工作流处理完成")
 
-
-                    if status_callback:
-                        await status_callback(unit_id, {
-                            "status": work_unit["status"],
-                            "node_states": work_unit["node_states"]
-                        })
-                else:
-                    logger.error(f"SVG生成失败: {unit_id}")
-
-                    # 添加监控点：工作单元工作流状态
-                    await monitor_pool.record(
-                        category="workflow",
-                        key="execution_log",
-                        value={
-                            "node": "svg",
-                            "event": "error",
-                            "status": "failed",
-                            "message": "SVG生成失败：结果无效"
-                        },
-                        unit_id=unit_id,
-                        mode="append"
-                    )
-
-
-                    work_unit["status"] = "svg_failed"
-                    work_unit["node_states"]["svg"]["status"] = "failed"
-                    work_unit["node_states"]["svg"]["end_time"] = datetime.now().isoformat()
-                    if status_callback:
-                        await status_callback(unit_id, {
-                            "status": work_unit["status"],
-                            "node_states": work_unit["node_states"]
-                        })
-                    
-            except Exception as e:
-                logger.error(f"SVG生成异常: {str(e)}")
-
-                # 添加监控点：工作单元工作流状态
-                await monitor_pool.record(
-                    category="workflow",
-                    key="execution_log",
-                    value={
-                        "node": "svg",
-                        "event": "error",
-                        "status": "failed",
-                        "message":  f"SVG生成异常: {str(e)}"
-                    },
-                    unit_id=unit_id,
-                    mode="append"
-                )
-
-
-                work_unit["status"] = "svg_failed"
-                work_unit["node_states"]["svg"]["status"] = "failed"
-                work_unit["node_states"]["svg"]["error"] = str(e)
-                work_unit["node_states"]["svg"]["end_time"] = datetime.now().isoformat()
-                if status_callback:
-                    await status_callback(unit_id, {
-                        "status": work_unit["status"],
-                        "node_states": work_unit["node_states"]
-                    })
-            
-            # 后台继续处理分析任务
-            asyncio.create_task(self._complete_analysis(work_unit, analysis_task))
-            
             return work_unit
-            
+
         except Exception as e:
             logger.error(f"工作流处理失败: {str(e)}")
 
             # 添加监控点：工作单元工作流状态
-            await monitor_pool.record(
-                category="workflow",
-                key="execution_log",
-                value={
-                    "node": "workflow",
-                    "event": "error",
-                    "status": "failed",
-                    "message": f"工作流处理失败: {str(e)}",
-                },
-                unit_id=work_unit['id'],
-                mode="append"
-            )
-
+            await self._log_event(work_unit['id'], "workflow", "error", "failed", f"工作流处理失败: {str(e)}")
 
             if status_callback:
                 await status_callback(work_unit['id'], {
@@ -252,58 +100,53 @@ class WorkflowThread:
                 })
             raise
 
-    async def _complete_analysis(self, work_unit: Dict[str, Any], analysis_task: asyncio.Task):
-        """后台完成分析任务"""
-        try:
-            analysis_result = await analysis_task
-            work_unit["results"]["analysis"] = analysis_result
-            work_unit["status"] = "completed"
-            logger.info(f"分析任务完成: {work_unit['id']}")
+    async def _on_node_event(self, node_name: str, event: str, work_unit: Dict[str, Any],
+                             error: Optional[str], status_callback=None):
+        """统一处理节点事件：执行日志、结果监控与状态回调"""
+        unit_id = work_unit["id"]
+        status, message = EVENT_LOG[event]
+        if error:
+            message = f"{message}: {error}"
+        logger.info(f"节点 {node_name} {message}: {unit_id}")
 
-            # 通过 status_callback 更新状态 - 这里缺少了状态回调！
-            if hasattr(self, '_status_callback') and self._status_callback:
-                await self._status_callback(work_unit['id'], {
-                    "status": "completed",
-                    "results": work_unit["results"]
-                })
-
-            # 添加监控点：工作单元工作流状态
-            await monitor_pool.record(
-                category="workflow",
-                key="execution_log",
-                value={
-                    "node": "analysis",
-                    "event": "complete",
-                    "status": "completed",
-                    "message":  "分析任务完成",
-                },
-                unit_id=work_unit['id'],
-                mode="append"
-            )
+        # 添加监控点：工作单元工作流状态
+        await self._log_event(unit_id, node_name, event, status, message)
 
-        except Exception as e:
-            logger.error(f"分析任务失败: {str(e)}")
+        update = {
+            "node_states": {name: dict(state) for name, state in work_unit["node_states"].items()}
+        }
 
-            # 同样需要通过 status_callback 更新失败状态
-            if hasattr(self, '_status_callback') and self._status_callback:
-                await self._status_callback(work_unit['id'], {
-                    "status": "failed",
-                    "error": str(e)
-                })
+        if event in ("complete", "restored"):
+            node = self.scheduler.nodes[node_name]
+            node_results = {key: work_unit["results"][key] for key in node.outputs}
 
-            # 添加监控点：工作单元工作流状态
+            # 添加监控点：工作单元节点结果
             await monitor_pool.record(
-                category="workflow",
-                key="execution_log",
+                category="workflows",
+                key="node_results",
                 value={
-                    "node": "analysis",
-                    "event": "error",
-                    "status": "failed",
-                    "message":  f"分析任务失败: {str(e)}"
+                    key: {"content": result.get("content")}
+                    for key, result in node_results.items()
                 },
-                unit_id=work_unit['id'],
-                mode="append"
+                unit_id=unit_id,
+                mode="merge"
             )
-
-            work_unit["status"] = "analysis_failed"
-            work_unit["error"] = str(e)
+            update["results"] = dict(work_unit["results"])
+
+        if status_callback:
+            await status_callback(unit_id, update)
+
+    async def _log_event(self, unit_id: str, node: str, event: str, status: str, message: str):
+        """记录执行日志监控点"""
+        await monitor_pool.record(
+            category="workflows",
+            key="execution_log",
+            value={
+                "node": node,
+                "event": event,
+                "status": status,
+                "message": message
+            },
+            unit_id=unit_id,
+            mode="append"
+        )
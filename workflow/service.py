@@ -1,6 +1,8 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Set, List, AsyncIterator
 from datetime import datetime
-from .core.workflow_manager import WorkflowManager
+from .core.workflow_manager import WorkflowManager, thaw_snapshot
+from .core.batch_import import create_batch_importer
+from utils.event_bus import event_bus, EventSubscription
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +12,7 @@ class WorkflowService:
     
     def __init__(self):
         self.workflow_manager = WorkflowManager()
+        self.batch_importer = create_batch_importer(self.workflow_manager)
     
     async def create_workflow(self, data: Dict[str, Any], unit_type: str) -> str:
         """
@@ -19,9 +22,58 @@ class WorkflowService:
             unit_type: 工作单元类型 ("realtime" 或 "import")
         Returns:
             工作单元ID
+        Raises:
+            QueueFullError: 准入队列已满
         """
         return await self.workflow_manager.create_work_unit(data, unit_type)
+
+    async def import_batch(self, histories: AsyncIterator[Any]) -> Dict[str, Any]:
+        """
+        批量导入对话历史，去重后在后台逐步创建 import 工作单元
+        Args:
+            histories: 逐条产出的对话历史
+        Returns:
+            批次进度
+        """
+        return await self.batch_importer.submit(histories)
+
+    def get_batch_progress(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """获取批量导入进度，批次不存在时返回None"""
+        return self.batch_importer.progress(batch_id)
+
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """获取准入队列统计（排队深度、等待时间等）"""
+        return self.workflow_manager.get_queue_stats()
     
+    def get_overview(self, status: Optional[str] = None, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """分页获取工作流概览（按状态分组，从新到旧）"""
+        return self.workflow_manager.get_overview(status, offset, limit)
+
+    def get_workflow_statuses(self, unit_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """批量获取工作流状态，不存在的工作单元为None"""
+        return {
+            unit_id: thaw_snapshot(status) if status is not None else None
+            for unit_id, status in self.workflow_manager.get_unit_statuses(unit_ids).items()
+        }
+
+    def list_workflows(self, status: Optional[str] = None, unit_type: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None,
+                       offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """按状态、类型和创建时间范围分页列出工作流状态，从新到旧排序"""
+        result = self.workflow_manager.list_units(status, unit_type, since, until, offset, limit)
+        result["items"] = [thaw_snapshot(snapshot) for snapshot in result["items"]]
+        return result
+
+    def subscribe_events(self, unit_ids: Optional[Set[str]] = None) -> EventSubscription:
+        """
+        订阅工作流事件（状态变化、执行日志、SVG就绪、监控点变化）
+        Args:
+            unit_ids: 关注的工作单元，为空时订阅全部事件
+        Returns:
+            事件订阅，使用完毕后需要调用 close()
+        """
+        return event_bus.subscribe(unit_ids)
+
     async def get_workflow_status(self, unit_id: str) -> Optional[Dict]:
         """获取工作流状态"""
         try:
@@ -31,26 +83,52 @@ class WorkflowService:
                 return None
                 
             logger.info(f"工作单元状态: {status['status']}, ID: {unit_id}")
-            return status
+            # 快照只包含状态字段，转换为普通字典的开销很小，便于调用方序列化
+            return thaw_snapshot(status)
             
         except Exception as e:
             logger.error(f"获取工作流状态失败: {str(e)}")
             raise
     
-    async def get_svg_result(self, unit_id: str) -> Optional[Dict]:
+    async def retry_workflow(self, unit_id: str) -> Optional[Dict]:
+        """
+        重试失败的工作流，已完成的节点从检查点恢复
+        Args:
+            unit_id: 工作单元ID
+        Returns:
+            重试信息，工作单元不存在时返回None
+        """
+        return await self.workflow_manager.retry_unit(unit_id)
+
+    async def cancel_workflow(self, unit_id: str) -> Optional[Dict]:
+        """
+        取消排队中或处理中的工作流
+        Args:
+            unit_id: 工作单元ID
+        Returns:
+            取消信息，工作单元不存在时返回None
+        """
+        return await self.workflow_manager.cancel_unit(unit_id)
+
+    async def get_svg_result(self, unit_id: str, page: int = 1) -> Optional[Dict]:
         """
         获取SVG生成结果
         Args:
             unit_id: 工作单元ID
+            page: 页码，从1开始
         Returns:
             SVG结果数据
         """
-        return await self.workflow_manager.get_svg_result(unit_id)
+        return await self.workflow_manager.get_svg_result(unit_id, page)
+
+    def iter_svg_pages(self, unit_id: str):
+        """逐页获取SVG，SVG尚未生成时等待"""
+        return self.workflow_manager.iter_svg_pages(unit_id)
     
-    def cleanup(self, max_age_hours: int = 24):
+    async def cleanup(self, max_age_hours: Optional[float] = None):
         """
         清理旧的工作单元
         Args:
-            max_age_hours: 最大保留时间（小时）
+            max_age_hours: 最大保留时间（小时），不指定时使用存储配置的TTL
         """
-        self.workflow_manager.cleanup_old_units(max_age_hours) 
\ No newline at end of file
+        await self.workflow_manager.cleanup_old_units(max_age_hours) 
\ No newline at end of file